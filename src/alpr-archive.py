@@ -0,0 +1,106 @@
+# look through the archive segments diy-lpr writes (see ARCHIVE_DIR in diy-lpr.py)
+#
+# examples:
+#   python src/alpr-archive.py list work/archive                             # every frame, as CSV
+#   python src/alpr-archive.py list work/archive/1489012345678.seg            # just one segment (read front to back)
+#   python src/alpr-archive.py get work/archive 1489012345678-1234.jpg -o frame.jpg
+#   python src/alpr-archive.py get work/archive --time "2017-03-08 22:30" -o frame.jpg
+#   python src/alpr-archive.py extract work/archive /mnt/usb/frames --since "2017-03-08" --until "2017-03-09"
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+
+import archive
+import layout
+
+def parse_time(value):
+    try:
+        return float(value) # already epoch seconds
+    except ValueError:
+        pass
+
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError("can't parse time {}".format(value))
+
+def format_time(t):
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t)) if t else ''
+
+# every frame in the segments (or directories of segments) in paths, each segment read front to back
+def stream(paths):
+    for path in paths:
+        for segment_file in archive.list_segments(path) if os.path.isdir(path) else [path]:
+            for offset, r in archive.read_segment(segment_file):
+                yield r
+
+# a directory of segments or one segment, opened for lookups
+def open_archive(path):
+    return archive.archive(path) if os.path.isdir(path) else archive.segment(path)
+
+parser = argparse.ArgumentParser(description = "read diy-lpr archive segments")
+commands = parser.add_subparsers(dest = "command")
+
+list_parser = commands.add_parser("list", help = "list frames as CSV (streamed, in the order they were archived)")
+list_parser.add_argument("paths", nargs = "+", help = "archive directories and/or segment files")
+
+get_parser = commands.add_parser("get", help = "look up one frame by its file name or capture time, and print its results")
+get_parser.add_argument("archive", help = "archive directory or segment file")
+get_parser.add_argument("id", nargs = "?", help = "the frame's file name (e.g. 1489012345678-1234.jpg)")
+get_parser.add_argument("--time", type = parse_time, help = "the first frame captured at or after this time instead (epoch seconds or YYYY-MM-DD[ HH:MM[:SS]])")
+get_parser.add_argument("-o", "--out", help = "write the frame's JPEG to this file")
+
+extract_parser = commands.add_parser("extract", help = "write frames out as a JPEG and a JSON file each")
+extract_parser.add_argument("archive", help = "archive directory or segment file")
+extract_parser.add_argument("out_dir", help = "directory to write the frames to")
+extract_parser.add_argument("--since", type = parse_time, help = "only frames captured at or after this time")
+extract_parser.add_argument("--until", type = parse_time, help = "only frames captured before this time")
+extract_parser.add_argument("--layout", default = layout.LAYOUT_FLAT, help = "time.strftime pattern for subdirectories of out_dir (see POSTPROC_LAYOUT in diy-lpr.py)")
+args = parser.parse_args()
+
+if args.command == "list":
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["file", "capture_time", "capture_epoch_time", "latitude", "longitude", "altitude_m", "speed", "outcome", "plates", "jpeg_bytes"])
+    for r in stream(args.paths):
+        results = r.results if isinstance(r.results, dict) else {}
+        writer.writerow([r.id, format_time(r.capture_time), r.capture_time, r.latitude, r.longitude, r.altitude, r.speed,
+            results.get('outcome', ''), " ".join(match['plate'] for match in results.get('matches', [])), len(r.jpeg)])
+
+elif args.command == "get":
+    if not(args.id) and args.time is None:
+        get_parser.error("give a file name or --time")
+    arc = open_archive(args.archive)
+    r = arc.get(args.id) if args.id else arc.at(args.time)
+    if r is None:
+        print >> sys.stderr, "alpr-archive - no such frame"
+        sys.exit(1)
+
+    print json.dumps({'file': r.id, 'capture_time': format_time(r.capture_time), 'capture_epoch_time': r.capture_time,
+        'latitude': r.latitude, 'longitude': r.longitude, 'altitude_m': r.altitude, 'speed': r.speed, 'results': r.results}, indent = 2)
+    if (args.out):
+        with open(args.out, "wb") as f:
+            f.write(r.jpeg)
+    arc.close()
+
+elif args.command == "extract":
+    start_time = time.time()
+    count = 0
+    if not(os.path.isdir(args.out_dir)):
+        os.makedirs(args.out_dir)
+    arc = open_archive(args.archive)
+    for r in arc.between(args.since if args.since is not None else float('-inf'), args.until):
+        with open(layout.path(args.out_dir.rstrip("/"), r.id, args.layout), "wb") as f:
+            f.write(r.jpeg)
+        with open(layout.path(args.out_dir.rstrip("/"), os.path.splitext(r.id)[0] + ".json", args.layout), "w") as f:
+            json.dump({'file': r.id, 'capture_epoch_time': r.capture_time, 'latitude': r.latitude, 'longitude': r.longitude,
+                'altitude_m': r.altitude, 'speed': r.speed, 'results': r.results}, f)
+        count += 1
+    arc.close()
+    print >> sys.stderr, "alpr-archive - extracted {} frames in {:.1f}s".format(count, time.time() - start_time)
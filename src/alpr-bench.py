@@ -0,0 +1,187 @@
+# replay a directory of captured images through the recognizer pipeline and report throughput, latency and memory use.
+# no camera or GPS needed -- images come straight from disk, and OpenALPR can be swapped for a stand-in with --alpr
+#
+# examples:
+#   python src/alpr-bench.py work/proc-hit work/proc-lowconf
+#   python src/alpr-bench.py --workers 4 --backend process --limit 500 /mnt/archive/proc-hit
+#   python src/alpr-bench.py --alpr alprengine:fakealpr --fake-secs 0.2 --skip-exif work/proc-hit    # no OpenALPR needed
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+import resource
+import threading
+import multiprocessing
+
+import alprengine
+import recognizer
+import workqueue
+import outwriter
+import frame
+import roi
+import watchlist
+import logsetup
+
+STAGES = ['claim', 'filter', 'ocr', 'watchlist', 'scoring', 'meta', 'output', 'finish']
+
+# all the JPEGs under the given directories, sorted by name
+def find_images(dirs):
+    images = []
+    for d in dirs:
+        for root, subdirs, files in os.walk(d):
+            images.extend(os.path.join(root, f) for f in files if f.lower().endswith(".jpg"))
+    return sorted(images, key = os.path.basename)
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+parser = argparse.ArgumentParser(description = "benchmark the diy-lpr recognizer pipeline on a directory of images")
+parser.add_argument("corpus", nargs = "+", help = "directories of JPEGs to replay (searched recursively)")
+parser.add_argument("--workers", type = int, default = multiprocessing.cpu_count(), help = "number of recognizers (default: %(default)s)")
+parser.add_argument("--backend", default = alprengine.BACKEND_THREAD, choices = [alprengine.BACKEND_THREAD, alprengine.BACKEND_PROCESS], help = "where OpenALPR runs (default: %(default)s)")
+parser.add_argument("--mode", default = "file", choices = ["file", "memory"], help = "replay images as files in a capture directory, or as in-memory frames (default: %(default)s)")
+parser.add_argument("--limit", type = int, help = "only replay this many images")
+parser.add_argument("--region", default = "ma", help = "OpenALPR default region (default: %(default)s)")
+parser.add_argument("--min-conf-patternmatch", type = float, default = recognizer.recognizer.min_conf_patternmatch)
+parser.add_argument("--min-conf-nopatternmatch", type = float, default = recognizer.recognizer.min_conf_nopatternmatch)
+parser.add_argument("--detect-scale", type = float, default = 1.0, help = "find plates at this scale first (see DETECT_SCALE in diy-lpr.py)")
+parser.add_argument("--alpr", metavar = "MODULE:CALLABLE", help = "stand-in for openalpr.Alpr, e.g. alprengine:fakealpr")
+parser.add_argument("--fake-secs", type = float, default = 0.0, help = "with --alpr alprengine:fakealpr, seconds each recognition takes")
+parser.add_argument("--watchlist", metavar = "FILE", help = "check every candidate against this watchlist (see WATCHLIST_FILE in diy-lpr.py)")
+parser.add_argument("--skip-exif", action = "store_true", help = "give frames capture metadata up front, so hits don't read EXIF")
+parser.add_argument("--keep", action = "store_true", help = "keep the scratch directory (output, sorted images) when done")
+parser.add_argument("--verbose", action = "store_true", help = "show the recognizers' per-image output")
+args = parser.parse_args()
+
+logsetup.setup("DEBUG" if args.verbose else "WARNING", burst = None)
+
+alprengine.ALPR_FACTORY = args.alpr
+alprengine.fakealpr.recognize_secs = args.fake_secs
+
+images = find_images(args.corpus)
+if args.limit:
+    images = images[:args.limit]
+if not images:
+    print "alpr-bench - no images found in {}".format(", ".join(args.corpus))
+    sys.exit(1)
+
+# scratch copy of the pipeline's directories
+work_dir = tempfile.mkdtemp(prefix = "alpr-bench-")
+dirs = {}
+for d in ["capture", "processing", "hit", "lowconf", "nohit", "output"]:
+    dirs[d] = os.path.join(work_dir, d)
+    os.makedirs(dirs[d])
+
+print "alpr-bench - loading {} images into {}".format(len(images), work_dir)
+work_queue = workqueue.workqueue()
+for i, image in enumerate(images):
+    name = os.path.basename(image)
+    if not(workqueue.CAPTURE_FILE_RE.match(name)) or os.path.exists(os.path.join(dirs["capture"], name)):
+        name = "{:013d}-bench.jpg".format(i)
+
+    meta = None
+    if args.skip_exif:
+        meta = {'capture_epoch_time': time.time(), 'latitude': 0.0, 'longitude': 0.0, 'altitude': None, 'speed': None}
+
+    if args.mode == "memory":
+        with open(image, "rb") as f:
+            work_queue.put(frame.frame(name, data = f.read(), meta = meta))
+    else:
+        target = os.path.join(dirs["capture"], name)
+        try:
+            os.link(image, target)
+        except OSError:
+            shutil.copyfile(image, target)
+        work_queue.put(frame.frame(name, meta = meta))
+
+# collect per-frame results from the recognizers
+lock = threading.Lock()
+all_done = threading.Event()
+latencies = []
+stage_secs = dict((stage, 0.0) for stage in STAGES)
+outcomes = {}
+
+def on_frame(frm, outcome, timer):
+    with lock:
+        latencies.append(timer.total())
+        for stage, secs in timer.stages.items():
+            stage_secs[stage] = stage_secs.get(stage, 0.0) + secs
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if len(latencies) == len(images):
+            all_done.set()
+
+output = outwriter.outwriter(output_csv_file = os.path.join(dirs["output"], "output.csv"))
+
+detector = roi.detector(scale = args.detect_scale) if args.detect_scale < 1.0 else None
+hotlist = watchlist.watchlist(args.watchlist, watchlist.alertsink(os.path.join(dirs["output"], "alerts.jsonl"))) if args.watchlist else None
+
+setup_start = time.time()
+recogs = []
+for x in range(args.workers):
+    recog = recognizer.recognizer(
+        source_dir = dirs["capture"],
+        processing_dir = os.path.join(dirs["processing"], "recog-{}".format(x)),
+        postproc_hit_dir = dirs["hit"],
+        postproc_nohit_lowconf_dir = dirs["lowconf"],
+        postproc_nohit_dir = dirs["nohit"],
+        output = output,
+        default_region = args.region,
+        work_queue = work_queue,
+        backend = args.backend,
+        detector = detector,
+        watchlist = hotlist
+    )
+    recog.min_conf_patternmatch = args.min_conf_patternmatch
+    recog.min_conf_nopatternmatch = args.min_conf_nopatternmatch
+    recog.on_frame = on_frame
+    recogs.append(recog)
+for recog in recogs:
+    recog.engine.wait_ready() # OpenALPR loads in the background -- count it as setup, not as time spent recognizing
+setup_secs = time.time() - setup_start
+
+output.start()
+start_time = time.time()
+for recog in recogs:
+    recog.start()
+
+try:
+    while not(all_done.wait(1.0)):
+        # a recognizer that died (see its log) may have taken frames with it that will never finish
+        if not(all(recog.is_alive() for recog in recogs)):
+            print "alpr-bench - a recognizer stopped unexpectedly, giving up after {} of {} images".format(len(latencies), len(images))
+            break
+except KeyboardInterrupt:
+    pass
+elapsed = time.time() - start_time
+
+for recog in recogs:
+    recog.stop()
+output.stop()
+
+self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+done = len(latencies)
+
+print "alpr-bench - {} images, {} {} workers, {} mode{}".format(done, args.workers, args.backend, args.mode, ", alpr {}".format(args.alpr) if args.alpr else "")
+print "  setup:       {:.2f}s".format(setup_secs)
+print "  elapsed:     {:.2f}s".format(elapsed)
+print "  throughput:  {:.2f} frames/s".format(done / elapsed if elapsed > 0 else 0.0)
+print "  latency:     p50 {:.1f}ms  p95 {:.1f}ms  p99 {:.1f}ms  max {:.1f}ms".format(
+    percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000, percentile(latencies, 99) * 1000, max(latencies or [0]) * 1000)
+print "  outcomes:    {}".format(", ".join("{} {}".format(count, outcome) for outcome, count in sorted(outcomes.items())))
+print "  stages (mean per frame, share of busy time):"
+busy = sum(stage_secs.values()) or 1.0
+for stage in STAGES:
+    print "    {:9s} {:9.2f}ms {:6.1f}%".format(stage, stage_secs[stage] * 1000 / max(1, done), stage_secs[stage] * 100 / busy)
+print "  peak RSS:    {:.1f}MB (this process), {:.1f}MB (largest worker process)".format(self_rss / 1024.0, children_rss / 1024.0)
+
+if args.keep:
+    print "alpr-bench - scratch directory kept at {}".format(work_dir)
+else:
+    shutil.rmtree(work_dir)
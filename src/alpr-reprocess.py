@@ -0,0 +1,258 @@
+# re-run recognition over archived images (e.g. months of proc-hit and proc-lowconf) on all cores, into a new output set.
+# the source images are only read, never moved. progress is checkpointed, so an interrupted run picks up where it left off
+# when run again with the same --out. images that crash OpenALPR are skipped, and listed in the checkpoint. every run caches OpenALPR's raw results in the output set (see rawlog), so trying
+# new thresholds later (--rescore) doesn't need another OCR pass. --rescore also takes the raw log diy-lpr writes (RAW_LOG)
+#
+# examples:
+#   python src/alpr-reprocess.py --out work/reprocess-2017-06 /mnt/archive/proc-hit /mnt/archive/proc-lowconf
+#   python src/alpr-reprocess.py --out work/rescore-80 --rescore work/reprocess-2017-06 --min-conf-patternmatch 80
+#   python src/alpr-reprocess.py --out work/rescore-80 --rescore work/output/raw.bin --min-conf-patternmatch 80
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+import multiprocessing
+import multiprocessing.pool
+
+import alprengine
+import recognizer
+import scoring
+import rawlog
+import outwriter
+import logsetup
+import roi
+
+CHECKPOINT_EVERY = 5 # write out results and checkpoint after this many images
+RAW_FILE = "raw.bin" # cached OpenALPR results, a rawlog record per image, named by its path
+CHECKPOINT_FILE = "checkpoint.json"
+OUTPUT_FILES = ["output.csv", "output.jsonl", RAW_FILE]
+
+# every JPEG under the given directories, in a stable order (so a resumed run sees them in the same order)
+def walk_images(dirs):
+    for d in dirs:
+        for root, subdirs, files in os.walk(d):
+            subdirs.sort()
+            for f in sorted(files):
+                if f.lower().endswith(".jpg"):
+                    yield os.path.join(root, f)
+
+# where path comes in walk_images(dirs)' order, for comparing: which of dirs it's under, then each directory on the
+# way down to it (a directory's files come before its subdirectories), then its name. None if it's under none of dirs
+def walk_key(dirs, path):
+    for i, d in enumerate(dirs):
+        rel = os.path.relpath(path, d)
+        if rel != os.pardir and not(rel.startswith(os.pardir + os.sep)):
+            parts = rel.split(os.sep)
+            return (i, [(1, part) for part in parts[:-1]] + [(0, parts[-1])])
+    return None
+
+# the paths (from walk_images(dirs)) after last, or all of them if last is None. last needn't still be there (it may
+# have been moved or deleted since) -- whatever would have come after it still does
+def resume_after(paths, last, dirs):
+    last_key = walk_key(dirs, last) if last else None
+    if last and last_key is None:
+        print "alpr-reprocess - checkpointed image {} isn't under any of the sources, starting from the beginning".format(last)
+
+    found = False
+    for path in paths:
+        if last_key is not None:
+            if walk_key(dirs, path) <= last_key:
+                found = found or path == last
+                continue
+            if not(found):
+                print "alpr-reprocess - checkpointed image {} is no longer there, resuming after where it was".format(last)
+            last_key = None
+        yield path
+
+# each pool thread drives an OpenALPR worker process of its own (see alprengine.processengine), so an image that
+# crashes OpenALPR only takes down (and restarts) that worker instead of hanging the pool
+_local = threading.local()
+_engines = []
+_engines_lock = threading.Lock()
+_skip_exif = False
+
+def init_worker(region, detector, skip_exif):
+    global _skip_exif
+    _local.engine = alprengine.processengine(region, "alpr-" + threading.current_thread().name, detector)
+    with _engines_lock:
+        _engines.append(_local.engine)
+    _skip_exif = skip_exif
+
+# [path, start_time, recognize_secs, meta, results]. results is None if OpenALPR crashed on the image
+def recognize(path):
+    start_time = time.time()
+    try:
+        results, recognize_secs = _local.engine.recognize_file(path)
+    except alprengine.workercrashed:
+        return [path, start_time, time.time() - start_time, None, None]
+    except Exception as e:
+        print "alpr-reprocess - could not recognize {}: {}".format(path, e)
+        results, recognize_secs = {'results': []}, time.time() - start_time
+
+    meta = None
+    if not(_skip_exif):
+        try:
+            meta = recognizer.read_exif_meta(path)
+        except Exception as e:
+            print "alpr-reprocess - could not read EXIF from {}: {}".format(path, e)
+    return [path, start_time, recognize_secs, meta, results]
+
+# (path, matches) for each recognized image, writing its raw results to raw_log as they come in. matches is None for
+# images OpenALPR crashed on
+def scored(records, raw_log, min_conf_patternmatch, min_conf_nopatternmatch):
+    for path, start_time, recognize_secs, meta, results in records:
+        if results is None:
+            yield path, None
+            continue
+        raw_log.append(path, start_time, recognize_secs, results, meta)
+        matches = [recognizer.match_record(os.path.basename(path), plate, best, start_time, recognize_secs)
+            for plate, best in scoring.score(results, min_conf_patternmatch, min_conf_nopatternmatch) if best]
+        if matches:
+            recognizer.add_capture_meta(matches, meta or {'capture_epoch_time': None, 'latitude': None, 'longitude': None, 'altitude': None})
+        yield path, matches
+
+# (name, matches) for each image in a raw log, scored all at once by scoring.score_columns
+def rescored(raw_file, min_conf_patternmatch, min_conf_nopatternmatch):
+    cols = rawlog.read_columns(raw_file)
+    plate_frames, plate_first, plate_counts, texts = cols['plate_frames'], cols['plate_first'], cols['plate_counts'], cols['texts']
+    best = scoring.score_columns(plate_first, plate_counts, cols['confidences'], cols['matches_templates'],
+        min_conf_patternmatch, min_conf_nopatternmatch)
+
+    p = 0 # plates are in frame order
+    for frame, name in enumerate(cols['names']):
+        matches = []
+        while p < len(plate_frames) and plate_frames[p] == frame:
+            b = best[p]
+            if b >= 0:
+                plate = {'candidates': [{'plate': text} for text in texts[plate_first[p]:plate_first[p] + plate_counts[p]]]}
+                candidate = {'plate': texts[b], 'confidence': cols['confidences'][b], 'matches_template': cols['matches_templates'][b]}
+                matches.append(recognizer.match_record(os.path.basename(name), plate, candidate, cols['start_times'][frame], cols['recognize_secs'][frame]))
+            p += 1
+
+        if matches:
+            meta = dict((field, None if math.isnan(cols[key][frame]) else cols[key][frame]) for field, key in
+                [('capture_epoch_time', 'capture_times'), ('latitude', 'latitudes'), ('longitude', 'longitudes'), ('altitude', 'altitudes')])
+            recognizer.add_capture_meta(matches, meta)
+        yield name, matches
+
+# skipped - images OpenALPR crashed on
+def save_checkpoint(out_dir, last, done, skipped):
+    sizes = dict((name, os.path.getsize(os.path.join(out_dir, name))) for name in OUTPUT_FILES if os.path.exists(os.path.join(out_dir, name)))
+    tmp_file = os.path.join(out_dir, CHECKPOINT_FILE + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({'last': last, 'done': done, 'sizes': sizes, 'skipped': skipped}, f)
+    os.rename(tmp_file, os.path.join(out_dir, CHECKPOINT_FILE))
+
+# roll the output files back to the last checkpoint -- anything written after it will be written again
+def load_checkpoint(out_dir):
+    checkpoint_file = os.path.join(out_dir, CHECKPOINT_FILE)
+    if not(os.path.exists(checkpoint_file)):
+        return None, 0, []
+    with open(checkpoint_file) as f:
+        checkpoint = json.load(f)
+    for name in OUTPUT_FILES:
+        file = os.path.join(out_dir, name)
+        if name in checkpoint['sizes']:
+            with open(file, "r+") as f:
+                f.truncate(checkpoint['sizes'][name])
+        elif os.path.exists(file):
+            os.unlink(file)
+    return checkpoint['last'], checkpoint['done'], checkpoint.get('skipped', [])
+
+parser = argparse.ArgumentParser(description = "re-run diy-lpr recognition over archived images into a new output set")
+parser.add_argument("sources", nargs = "*", help = "directories of JPEGs to reprocess (searched recursively)")
+parser.add_argument("--out", required = True, help = "directory for the new output set (output.csv, output.jsonl, raw results, checkpoint)")
+parser.add_argument("--rescore", metavar = "OUT_DIR_OR_LOG", help = "don't run OpenALPR -- re-score the raw results cached in an earlier output set, or in a raw log from diy-lpr")
+parser.add_argument("--workers", type = int, default = multiprocessing.cpu_count(), help = "number of OpenALPR worker processes (default: %(default)s)")
+parser.add_argument("--region", default = "ma", help = "OpenALPR default region (default: %(default)s)")
+parser.add_argument("--min-conf-patternmatch", type = float, default = recognizer.recognizer.min_conf_patternmatch)
+parser.add_argument("--min-conf-nopatternmatch", type = float, default = recognizer.recognizer.min_conf_nopatternmatch)
+parser.add_argument("--detect-scale", type = float, default = 1.0, help = "find plates at this scale first (see DETECT_SCALE in diy-lpr.py)")
+parser.add_argument("--alpr", metavar = "MODULE:CALLABLE", help = "stand-in for openalpr.Alpr, e.g. alprengine:fakealpr")
+parser.add_argument("--skip-exif", action = "store_true", help = "don't read capture time and location from the images' EXIF")
+args = parser.parse_args()
+
+if not(args.sources) and not(args.rescore):
+    parser.error("give directories to reprocess, or --rescore")
+
+logsetup.setup("WARNING")
+alprengine.ALPR_FACTORY = args.alpr
+
+if not(os.path.isdir(args.out)):
+    os.makedirs(args.out)
+
+last, done, skipped = load_checkpoint(args.out)
+if last:
+    print "alpr-reprocess - resuming after {} ({} images already done, {} skipped)".format(last, done, len(skipped))
+
+output = outwriter.outwriter(output_csv_file = os.path.join(args.out, "output.csv"), output_jsonl_file = os.path.join(args.out, "output.jsonl"))
+
+pool = None
+raw_log = None
+if (args.rescore):
+    raw_file = os.path.join(args.rescore, RAW_FILE) if os.path.isdir(args.rescore) else args.rescore
+    images = rescored(raw_file, args.min_conf_patternmatch, args.min_conf_nopatternmatch)
+    if last:
+        for name, matches in images:
+            if name == last:
+                break
+else:
+    detector = roi.detector(scale = args.detect_scale) if args.detect_scale < 1.0 else None
+    pool = multiprocessing.pool.ThreadPool(args.workers, init_worker, (args.region, detector, args.skip_exif))
+    raw_log = rawlog.rawlog(os.path.join(args.out, RAW_FILE))
+    images = scored(pool.imap(recognize, resume_after(walk_images(args.sources), last, args.sources), chunksize = 4), raw_log,
+        args.min_conf_patternmatch, args.min_conf_nopatternmatch)
+
+start_time = time.time()
+count = 0
+hits = 0
+batch = []
+try:
+    for path, matches in images:
+        if matches:
+            batch.append(matches)
+            hits += 1
+
+        count += 1
+        if matches is None:
+            # checkpoint right away, so a rerun never gets to this image again
+            print "alpr-reprocess - OpenALPR crashed on {}, skipping it".format(path)
+            skipped.append(path)
+        if count % CHECKPOINT_EVERY == 0 or matches is None:
+            if batch:
+                output.flush(batch)
+                batch = []
+            if (raw_log):
+                raw_log.flush()
+            save_checkpoint(args.out, path, done + count, skipped)
+            print "alpr-reprocess - {} images, {:.1f} images/s".format(done + count, count / (time.time() - start_time))
+            sys.stdout.flush()
+        last = path
+except KeyboardInterrupt:
+    if (pool):
+        pool.terminate()
+    print "alpr-reprocess - interrupted, run again with the same --out to resume"
+    sys.exit(1)
+
+if batch:
+    output.flush(batch)
+output.close()
+if (raw_log):
+    raw_log.close()
+if (pool):
+    pool.close()
+    pool.join()
+    for engine in _engines:
+        engine.unload()
+if count:
+    save_checkpoint(args.out, last, done + count, skipped)
+
+elapsed = time.time() - start_time
+print "alpr-reprocess - {} images ({} with plates) in {:.1f}s, {:.1f} images/s. results in {}".format(
+    count, hits, elapsed, count / elapsed if elapsed > 0 else 0.0, args.out)
+if skipped:
+    print "alpr-reprocess - {} images skipped after crashing OpenALPR (listed in {})".format(len(skipped), os.path.join(args.out, CHECKPOINT_FILE))
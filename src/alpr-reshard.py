@@ -0,0 +1,68 @@
+# move the images (or JSON files) in diy-lpr's output directories into a new layout (see POSTPROC_LAYOUT in diy-lpr.py),
+# e.g. from the old flat directories into a directory per hour. each file is moved once, by rename, in a single pass
+# over the tree, and the directories left empty are removed. stop diy-lpr first
+#
+# examples:
+#   python src/alpr-reshard.py work/proc-hit work/proc-lowconf work/output/json
+#   python src/alpr-reshard.py --layout "%Y/%m/%d" work/proc-hit      # a directory per day instead
+#   python src/alpr-reshard.py --layout flat work/proc-hit            # back to flat
+
+import os
+import sys
+import time
+import argparse
+
+import layout
+
+PROGRESS_EVERY = 10000 # report progress after this many files
+
+# move every file under dir to where layout puts it. returns (files moved, files already in place, files skipped)
+def reshard(dir, pattern, dry_run = False):
+    moved = 0
+    in_place = 0
+    skipped = 0
+    for root, subdirs, files in os.walk(dir):
+        subdirs.sort()
+        for name in sorted(files):
+            file = os.path.join(root, name)
+            target = os.path.join(dir, layout.relpath(name, pattern))
+            if file == target:
+                in_place += 1
+                continue
+            if os.path.exists(target):
+                print "alpr-reshard - {} is already at {}, leaving it where it is".format(file, target)
+                skipped += 1
+                continue
+
+            if not(dry_run):
+                os.rename(file, layout.path(dir, name, pattern))
+            moved += 1
+            if moved % PROGRESS_EVERY == 0:
+                print "alpr-reshard - {}: moved {} files".format(dir, moved)
+                sys.stdout.flush()
+
+    # clear out the directories the old layout left behind
+    if not(dry_run):
+        for root, subdirs, files in os.walk(dir, topdown = False):
+            if root != dir and not(os.listdir(root)):
+                os.rmdir(root)
+    return moved, in_place, skipped
+
+parser = argparse.ArgumentParser(description = "move diy-lpr images / JSON results into a new directory layout")
+parser.add_argument("dirs", nargs = "+", help = "directories to reshard (e.g. POSTPROC_HIT_DIR, POSTPROC_LOWCONF_DIR, OUTPUT_JSON)")
+parser.add_argument("--layout", default = layout.LAYOUT_HOUR, help = "time.strftime pattern for the subdirectories, or \"flat\" (default: %(default)s)")
+parser.add_argument("--dry-run", action = "store_true", help = "only report what would be moved")
+args = parser.parse_args()
+
+pattern = None if args.layout == "flat" else args.layout
+
+for dir in args.dirs:
+    dir = dir.rstrip("/")
+    if not(os.path.isdir(dir)):
+        print "alpr-reshard - {} is not a directory, skipping it".format(dir)
+        continue
+
+    start_time = time.time()
+    moved, in_place, skipped = reshard(dir, pattern, args.dry_run)
+    print "alpr-reshard - {}: {} {} files, {} already in place, {} skipped, in {:.1f}s".format(dir,
+        "would move" if args.dry_run else "moved", moved, in_place, skipped, time.time() - start_time)
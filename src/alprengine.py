@@ -0,0 +1,295 @@
+### alprengine - runs OpenALPR either in the recognizer thread or in a dedicated worker process
+import time
+import threading
+import importlib
+import multiprocessing
+import logging
+
+import metrics
+
+log = logging.getLogger("alprengine")
+
+WORKER_RESTARTS = metrics.get_counter("alprengine_worker_restarts_total", "OpenALPR worker processes restarted after dying")
+
+ALPR_COUNTRY = "us"
+ALPR_CONFIG_FILE = "/etc/openalpr/openalpr.conf"
+ALPR_RUNTIME_DATA = "/usr/share/openalpr/runtime_data"
+ALPR_TOP_N = 10
+
+BACKEND_THREAD = "thread"
+BACKEND_PROCESS = "process"
+
+WORKER_START_TIMEOUT_SECS = 60 # how long to wait for a worker process (or, when unloading, a loader thread) to load OpenALPR
+
+# ALPR_FACTORY - "module:callable" returning an object that works like openalpr.Alpr, used in place of OpenALPR
+#                (e.g. "alprengine:fakealpr" to benchmark the pipeline on a machine without OpenALPR). set it before
+#                creating any engines so worker processes inherit it
+ALPR_FACTORY = None
+
+class workercrashed (Exception):
+    pass
+
+# raised by threadengine when OpenALPR could not be loaded
+class notloaded (Exception):
+    pass
+
+# load and configure an OpenALPR instance. returns None if OpenALPR couldn't be loaded
+def load_alpr(default_region = None):
+    if ALPR_FACTORY:
+        module, name = ALPR_FACTORY.split(":")
+        Alpr = getattr(importlib.import_module(module), name)
+    else:
+        from openalpr import Alpr
+
+    alpr = Alpr(ALPR_COUNTRY, ALPR_CONFIG_FILE, ALPR_RUNTIME_DATA)
+    if not alpr.is_loaded():
+        return None
+
+    alpr.set_top_n(ALPR_TOP_N)
+
+    if (default_region):
+        alpr.set_default_region(default_region)
+
+    return alpr
+
+# stand-in for openalpr.Alpr that takes recognize_secs per image and "finds" the same plate in every one.
+# exercises everything around OpenALPR without needing it installed
+class fakealpr (object):
+    recognize_secs = 0.0
+    plate = "FAKE123"
+    confidence = 90.0
+
+    def __init__(self, country = None, config_file = None, runtime_dir = None):
+        pass
+
+    def is_loaded(self):
+        return True
+
+    def set_top_n(self, n):
+        pass
+
+    def set_default_region(self, region):
+        pass
+
+    def unload(self):
+        pass
+
+    def recognize_file(self, file):
+        return self.recognize_array(None)
+
+    def recognize_array(self, data):
+        if self.recognize_secs:
+            time.sleep(self.recognize_secs)
+        return {
+            'processing_time_ms': self.recognize_secs * 1000,
+            'results': [{
+                'plate': self.plate,
+                'confidence': self.confidence,
+                'coordinates': [{'x': 0, 'y': 0}, {'x': 100, 'y': 0}, {'x': 100, 'y': 50}, {'x': 0, 'y': 50}],
+                'candidates': [{'plate': self.plate, 'confidence': self.confidence, 'matches_template': 1}]
+            }]
+        }
+
+# create an engine for the given backend. if detector (a roi.detector) is given, it decides which parts
+# of each image OpenALPR looks at
+def create(backend, default_region = None, name = None, detector = None):
+    if backend == BACKEND_THREAD:
+        return threadengine(default_region, detector)
+    elif backend == BACKEND_PROCESS:
+        return processengine(default_region, name, detector)
+    else:
+        raise ValueError("unknown recognizer backend {}".format(backend))
+
+# runs OpenALPR in the calling thread. whether other threads get to run during recognition depends on the
+# openalpr binding releasing the GIL. OpenALPR takes a few seconds to load, so it loads in a thread of its own
+# while the caller gets on with other things -- wait_ready() blocks until it's done
+class threadengine (object):
+
+    def __init__(self, default_region = None, detector = None):
+        self.detector = detector
+        self.alpr = None
+        self.load_secs = None
+        self.loaded = threading.Event()
+
+        loader = threading.Thread(target = self.load, args = (default_region,), name = "alpr-loader")
+        loader.daemon = True
+        loader.start()
+
+    def load(self, default_region):
+        start_time = time.time()
+        try:
+            self.alpr = load_alpr(default_region)
+        except Exception:
+            log.exception("alprengine:threadengine - exception loading OpenALPR")
+        self.load_secs = time.time() - start_time
+        if not(self.alpr):
+            log.error("alprengine:threadengine - error loading OpenALPR")
+        self.loaded.set()
+
+    # block until OpenALPR has loaded. returns False if it couldn't be
+    def wait_ready(self):
+        self.loaded.wait()
+        return self.alpr is not None
+
+    # returns (results, recognize_secs)
+    def recognize_file(self, file):
+        if self.alpr is None and not(self.wait_ready()):
+            raise notloaded(file)
+        start_time = time.time()
+        results = _recognize(self.alpr, self.detector, "file", file)
+        return results, time.time() - start_time
+
+    # recognize an encoded image (e.g. JPEG bytes) held in memory. returns (results, recognize_secs)
+    def recognize_array(self, data):
+        if self.alpr is None and not(self.wait_ready()):
+            raise notloaded("{} byte image".format(len(data)))
+        start_time = time.time()
+        results = _recognize(self.alpr, self.detector, "array", data)
+        return results, time.time() - start_time
+
+    def unload(self):
+        self.loaded.wait(WORKER_START_TIMEOUT_SECS) # don't pull it out from under the loader
+        if (self.alpr):
+            self.alpr.unload()
+            self.alpr = None
+
+# recognize a file or encoded image bytes (kind "file" or "array"), through the detector if there is one
+def _recognize(alpr, detector, kind, payload):
+    if kind == "array":
+        return detector.recognize_array(alpr, payload) if detector else alpr.recognize_array(payload)
+    else:
+        return detector.recognize_file(alpr, payload) if detector else alpr.recognize_file(payload)
+
+# main loop for a worker process: load OpenALPR once, then recognize whatever the parent sends us. requests are
+# ("file", path) or ("array", encoded image bytes), and None to shut down
+def _worker_main(conn, default_region, detector):
+    alpr = load_alpr(default_region)
+    conn.send(alpr is not None)
+    if not(alpr):
+        return
+
+    try:
+        while True:
+            request = conn.recv()
+            if request is None:
+                break
+
+            kind, payload = request
+            start_time = time.time()
+            results = _recognize(alpr, detector, kind, payload)
+            conn.send((results, time.time() - start_time))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        alpr.unload()
+
+# runs OpenALPR in a worker process of its own, so recognition isn't bound by the GIL. if OpenALPR takes
+# the worker down (e.g. a segfault on a bad image), the worker is restarted for the next file. the first worker
+# is started right away but not waited for, so several engines load OpenALPR at once -- see wait_ready()
+class processengine (object):
+
+    def __init__(self, default_region = None, name = None, detector = None):
+        self.default_region = default_region
+        self.detector = detector
+        self.name = name or "alpr-worker"
+        self.process = None
+        self.conn = None
+        self.restarts = 0
+        self.files = 0
+        self.recognize_secs = 0.0
+        self.ready = False
+        self.load_secs = None
+        self.spawn_worker()
+
+    # start a worker and wait for it to load OpenALPR. returns whether it did
+    def start_worker(self):
+        self.spawn_worker()
+        return self.wait_worker()
+
+    def spawn_worker(self):
+        self.spawn_time = time.time()
+        parent_conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target = _worker_main, args = (child_conn, self.default_region, self.detector), name = self.name)
+        self.process.daemon = True
+        self.process.start()
+        child_conn.close() # so we see EOF if the worker dies
+        self.conn = parent_conn
+
+    # wait for the worker spawn_worker started to say it has loaded OpenALPR. returns whether it did
+    def wait_worker(self):
+        if not(self.conn.poll(WORKER_START_TIMEOUT_SECS)):
+            log.error("alprengine:processengine[{}] - worker did not start within {}s".format(self.name, WORKER_START_TIMEOUT_SECS))
+            self.stop_worker()
+            return False
+
+        try:
+            loaded = self.conn.recv()
+        except EOFError:
+            loaded = False
+
+        if not(loaded):
+            self.stop_worker()
+            return False
+
+        self.ready = True
+        self.load_secs = time.time() - self.spawn_time
+        log.info("alprengine:processengine[{}] - worker pid {} ready in {:.2f}s".format(self.name, self.process.pid, self.load_secs))
+        return True
+
+    # block until the worker has loaded OpenALPR. returns False if it couldn't
+    def wait_ready(self):
+        if not(self.ready) and self.conn is not None and not(self.wait_worker()):
+            log.error("alprengine:processengine[{}] - error loading OpenALPR".format(self.name))
+        return self.ready
+
+    def stop_worker(self):
+        if (self.process and self.process.is_alive()):
+            try:
+                self.conn.send(None)
+            except (IOError, EOFError):
+                pass
+            self.process.join(5)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join()
+        if (self.conn):
+            self.conn.close()
+        self.process = None
+        self.conn = None
+        self.ready = False
+
+    # returns (results, recognize_secs) where recognize_secs is the time spent in OpenALPR inside the worker.
+    # raises workercrashed if the worker died on this file
+    def recognize_file(self, file):
+        return self.request(("file", file), file)
+
+    # recognize an encoded image held in memory. the bytes are copied to the worker over the pipe
+    def recognize_array(self, data):
+        return self.request(("array", data), "{} byte image".format(len(data)))
+
+    def request(self, request, description):
+        if not(self.wait_ready()) and not(self.start_worker()):
+            raise workercrashed(description)
+
+        try:
+            self.conn.send(request)
+            results, recognize_secs = self.conn.recv()
+        except (IOError, EOFError):
+            self.process.join(1)
+            exitcode = self.process.exitcode
+            log.warning("alprengine:processengine[{}] - worker died (exit code {}) on {}, restarting".format(self.name, exitcode, description))
+            self.stop_worker()
+            self.restarts += 1
+            WORKER_RESTARTS.inc(worker = self.name)
+            if not(self.start_worker()):
+                log.error("alprengine:processengine[{}] - could not restart worker, will try again on the next file".format(self.name))
+            raise workercrashed(description)
+
+        self.files += 1
+        self.recognize_secs += recognize_secs
+        return results, recognize_secs
+
+    def unload(self):
+        if (self.process and self.files):
+            log.info("alprengine:processengine[{}] - {} files, {:.4f}s avg recognize time, {} restarts".format(self.name, self.files, self.recognize_secs / self.files, self.restarts))
+        self.stop_worker()
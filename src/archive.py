@@ -0,0 +1,360 @@
+### archive - processed frames (JPEG, capture time and position, recognition results) appended to large segment files
+### instead of a JPEG and a JSON file each. every segment ends with an index by capture time and by frame id, so a
+### reader can map it into memory and jump to any frame in O(log n), or stream through it front to back
+import os
+import json
+import errno
+import mmap
+import math
+import time
+import zlib
+import struct
+import threading
+import collections
+import logging
+
+import frame
+
+log = logging.getLogger("archive")
+
+# a segment is SEGMENT_MAGIC, then a record per frame, then the indexes and a trailer:
+#   record: RECORD_MAGIC, length of the rest (uint32), frame id length (uint16) and id (the capture's file name),
+#           capture time, latitude, longitude, altitude, speed (doubles, NaN if unknown), results JSON length (uint32)
+#           and JSON, then the JPEG
+#   time index: (capture time (double), record offset (uint64)) per frame, sorted
+#   id index: (crc32 of the frame id (uint32), record offset (uint64)) per frame, sorted
+#   trailer: offsets of the time and id indexes, number of frames (uint64s), first and last capture time (doubles),
+#            TRAILER_MAGIC
+# all little endian. a segment without a trailer (its writer didn't get to close it) can still be read -- the indexes
+# are rebuilt from the records
+SEGMENT_MAGIC = b'\xfaAS\x01'
+RECORD_MAGIC = b'\xfaAR\x01'
+TRAILER_MAGIC = b'\xfaAE\x01'
+_LENGTH = struct.Struct('<I')
+_ID = struct.Struct('<H')
+_META = struct.Struct('<ddddd')
+_TIME_ENTRY = struct.Struct('<dQ')
+_ID_ENTRY = struct.Struct('<IQ')
+_TRAILER = struct.Struct('<QQQdd4s')
+
+SEGMENT_SUFFIX = ".seg"
+
+NAN = float('nan')
+
+# a frame read back from an archive. capture time, position and speed are None if unknown. results is whatever was
+# archived with the frame (see recognizer)
+record = collections.namedtuple('record', ['id', 'capture_time', 'latitude', 'longitude', 'altitude', 'speed', 'results', 'jpeg'])
+
+def _id_key(id):
+    return zlib.crc32(id) & 0xffffffff
+
+def _nan_to_none(v):
+    return None if math.isnan(v) else v
+
+def _encode(id, jpeg, meta, results):
+    meta = meta or {}
+    results_json = json.dumps(results)
+    body = b''.join([_ID.pack(len(id)), id,
+        _META.pack(*[NAN if meta.get(field) is None else meta[field] for field in ('capture_epoch_time', 'latitude', 'longitude', 'altitude', 'speed')]),
+        _LENGTH.pack(len(results_json)), results_json, jpeg])
+    return RECORD_MAGIC + _LENGTH.pack(len(body)) + body
+
+# the frame's capture time, for the time index -- from its metadata, or its id if that's unknown
+def _capture_time(id, meta):
+    t = meta.get('capture_epoch_time') if meta else None
+    if t is None:
+        t = frame.name_time(id)
+    return t if t is not None else 0.0
+
+def _decode(body):
+    (id_len,) = _ID.unpack_from(body, 0)
+    pos = _ID.size
+    id = body[pos:pos + id_len]
+    pos += id_len
+    meta = [_nan_to_none(v) for v in _META.unpack_from(body, pos)]
+    pos += _META.size
+    (results_len,) = _LENGTH.unpack_from(body, pos)
+    pos += _LENGTH.size
+    results = json.loads(body[pos:pos + results_len])
+    pos += results_len
+    return record(id, meta[0], meta[1], meta[2], meta[3], meta[4], results, body[pos:])
+
+# (offset, record) for every complete record in a segment, in the order they were written. reads the file front to
+# back, so works on segments that are still being written, or on a pipe
+def read_segment(segment_file):
+    header_size = len(RECORD_MAGIC) + _LENGTH.size
+    with open(segment_file, 'rb') as f:
+        if f.read(len(SEGMENT_MAGIC)) != SEGMENT_MAGIC:
+            raise (ValueError('{} is not an archive segment'.format(segment_file)))
+        offset = len(SEGMENT_MAGIC)
+        while True:
+            header = f.read(header_size)
+            if len(header) < header_size or not(header.startswith(RECORD_MAGIC)):
+                return # the indexes (or a record cut short)
+            (length,) = _LENGTH.unpack_from(header, len(RECORD_MAGIC))
+            body = f.read(length)
+            if len(body) < length:
+                return
+            yield offset, _decode(body)
+            offset += header_size + length
+
+# the time and id indexes for records (a list of (offset, id, capture time)), packed as they're stored
+def _pack_indexes(records):
+    time_index = b''.join(_TIME_ENTRY.pack(t, offset) for t, offset in sorted((t, offset) for offset, id, t in records))
+    id_index = b''.join(_ID_ENTRY.pack(key, offset) for key, offset in sorted((_id_key(id), offset) for offset, id, t in records))
+    return time_index, id_index
+
+# a segment opened for lookups. the file is mapped into memory, and lookups read only the index entries and records
+# they need
+class segment (object):
+
+    def __init__(self, segment_file):
+        self.segment_file = segment_file
+        self.file = open(segment_file, 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.map = mmap.mmap(self.file.fileno(), size, access = mmap.ACCESS_READ) if size else b''
+        if self.map[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+            self.close()
+            raise (ValueError('{} is not an archive segment'.format(segment_file)))
+
+        trailer = self.map[size - _TRAILER.size:] if size >= len(SEGMENT_MAGIC) + _TRAILER.size else b''
+        if trailer.endswith(TRAILER_MAGIC):
+            self.time_index_offset, self.id_index_offset, self.count, self.first_time, self.last_time, _ = _TRAILER.unpack(trailer)
+            self.index = self.map
+            self.complete = True
+        else:
+            # never closed -- index whatever records made it to disk
+            records = [(offset, r.id, _capture_time(r.id, {'capture_epoch_time': r.capture_time})) for offset, r in read_segment(segment_file)]
+            time_index, id_index = _pack_indexes(records)
+            self.index = time_index + id_index
+            self.time_index_offset, self.id_index_offset, self.count = 0, len(time_index), len(records)
+            times = [t for offset, id, t in records]
+            self.first_time, self.last_time = (min(times), max(times)) if times else (0.0, 0.0)
+            self.complete = False
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if (self.map):
+            self.map.close()
+        self.file.close()
+
+    def read(self, offset):
+        if self.map[offset:offset + len(RECORD_MAGIC)] != RECORD_MAGIC:
+            raise (ValueError('no record at offset {} in {}'.format(offset, self.segment_file)))
+        (length,) = _LENGTH.unpack_from(self.map, offset + len(RECORD_MAGIC))
+        start = offset + len(RECORD_MAGIC) + _LENGTH.size
+        return _decode(self.map[start:start + length])
+
+    # index of the first entry in the index table at table_offset with a key >= key
+    def _bisect(self, table_offset, entry, key):
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if entry.unpack_from(self.index, table_offset + mid * entry.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    # the frame with id (its capture's file name), or None if it isn't in this segment
+    def get(self, id):
+        key = _id_key(id)
+        i = self._bisect(self.id_index_offset, _ID_ENTRY, key)
+        while i < self.count:
+            entry_key, offset = _ID_ENTRY.unpack_from(self.index, self.id_index_offset + i * _ID_ENTRY.size)
+            if entry_key != key:
+                break
+            r = self.read(offset)
+            if r.id == id:
+                return r
+            i += 1 # crc32 collision
+        return None
+
+    # the frames captured from start_time up to (but not including) end_time, in capture time order
+    def between(self, start_time, end_time = None):
+        i = self._bisect(self.time_index_offset, _TIME_ENTRY, start_time)
+        while i < self.count:
+            t, offset = _TIME_ENTRY.unpack_from(self.index, self.time_index_offset + i * _TIME_ENTRY.size)
+            if end_time is not None and t >= end_time:
+                break
+            yield self.read(offset)
+            i += 1
+
+    # the first frame captured at or after t, or None
+    def at(self, t):
+        return next(self.between(t), None)
+
+    # every frame, in capture time order
+    def __iter__(self):
+        return self.between(float('-inf'))
+
+# the segment files in archive_dir, oldest first (they're named for when they were started)
+def list_segments(archive_dir):
+    return [os.path.join(archive_dir, f) for f in sorted(os.listdir(archive_dir)) if f.endswith(SEGMENT_SUFFIX)]
+
+# (number of frames, first capture time, last capture time) from a segment's trailer, or None if it has none
+def read_trailer(segment_file):
+    with open(segment_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() < len(SEGMENT_MAGIC) + _TRAILER.size:
+            return None
+        f.seek(-_TRAILER.size, os.SEEK_END)
+        trailer = f.read(_TRAILER.size)
+    if not(trailer.endswith(TRAILER_MAGIC)):
+        return None
+    time_index_offset, id_index_offset, count, first_time, last_time, _ = _TRAILER.unpack(trailer)
+    return count, first_time, last_time
+
+# lookups across every segment in archive_dir. only the segments' trailers are read up front -- segments are opened
+# (a few at a time) when a lookup needs them
+class archive (object):
+    max_open = 8 # segments to keep open
+
+    def __init__(self, archive_dir):
+        self.segment_files = list_segments(archive_dir)
+        self.trailers = dict((f, read_trailer(f)) for f in self.segment_files)
+        self.open = collections.OrderedDict()
+
+    def segment(self, segment_file):
+        s = self.open.pop(segment_file, None) or segment(segment_file)
+        self.open[segment_file] = s
+        while len(self.open) > self.max_open:
+            self.open.popitem(last = False)[1].close()
+        return s
+
+    def close(self):
+        for s in self.open.values():
+            s.close()
+        self.open.clear()
+
+    def __len__(self):
+        return sum(self.trailers[f][0] if self.trailers[f] else len(self.segment(f)) for f in self.segment_files)
+
+    # the segments that could hold frames captured from start_time to end_time (unfinished ones always could)
+    def covering(self, start_time, end_time):
+        for f in self.segment_files:
+            trailer = self.trailers[f]
+            if trailer is None or (trailer[0] and trailer[2] >= start_time and trailer[1] <= end_time):
+                yield self.segment(f)
+
+    def get(self, id):
+        t = frame.name_time(id)
+        for s in self.covering(t - 1.0, t + 1.0) if t is not None else (self.segment(f) for f in self.segment_files):
+            r = s.get(id)
+            if r:
+                return r
+        return None
+
+    # frames captured from start_time up to (but not including) end_time, in capture time order within each segment
+    def between(self, start_time, end_time = None):
+        for s in self.covering(start_time, end_time if end_time is not None else float('inf')):
+            for r in s.between(start_time, end_time):
+                yield r
+
+    def at(self, t):
+        found = [r for r in (s.at(t) for s in self.covering(t, float('inf'))) if r]
+        return min(found, key = lambda r: r.capture_time) if found else None
+
+# write the indexes and trailer for a segment whose writer never closed it (e.g. after a power loss), dropping any
+# record cut short at the end
+def finish_segment(segment_file):
+    records = [(offset, r.id, _capture_time(r.id, {'capture_epoch_time': r.capture_time})) for offset, r in read_segment(segment_file)]
+    end = len(SEGMENT_MAGIC)
+    if records:
+        with open(segment_file, 'rb') as f:
+            f.seek(records[-1][0] + len(RECORD_MAGIC))
+            end = records[-1][0] + len(RECORD_MAGIC) + _LENGTH.size + _LENGTH.unpack(f.read(_LENGTH.size))[0]
+
+    time_index, id_index = _pack_indexes(records)
+    times = [t for offset, id, t in records]
+    with open(segment_file, 'r+b') as f:
+        f.truncate(end)
+        f.seek(end)
+        f.write(time_index)
+        f.write(id_index)
+        f.write(_TRAILER.pack(end, end + len(time_index), len(records), min(times) if times else 0.0, max(times) if times else 0.0, TRAILER_MAGIC))
+    return len(records)
+
+# appends frames to segments in archive_dir, starting a new segment once the current one reaches segment_bytes.
+# shared by all the recognizers
+class archivewriter (object):
+    segment_bytes = 512 * 1024 * 1024 # start a new segment once the current one is this big
+    storage = None # set to a storage.storagemanager to have it keep finished segments within archive_dir's quota
+
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir.rstrip("/")
+        if not(os.path.isdir(self.archive_dir)):
+            os.makedirs(self.archive_dir)
+        self.lock = threading.Lock()
+        self.file = None
+        self.segment_file = None
+        self.records = []
+        self.size = 0
+
+        # anything left open by the last run gets its index now
+        for segment_file in list_segments(self.archive_dir):
+            if read_trailer(segment_file) is None:
+                log.info("archive:init - indexed {} frames in unfinished segment {}".format(finish_segment(segment_file), segment_file))
+
+    # add a frame. id is its capture's file name, meta its capture metadata (see frame.frame) and results anything
+    # JSON serializable (e.g. the match records)
+    def append(self, id, jpeg, meta, results):
+        data = _encode(id, jpeg, meta, results)
+        with self.lock:
+            if (self.file is None):
+                self.open_segment()
+            self.records.append((self.size, id, _capture_time(id, meta)))
+            self.file.write(data)
+            self.size += len(data)
+            if self.size >= self.segment_bytes:
+                self.close_segment()
+
+    # segments are named for when they were started (ms since the epoch), but always after the newest one already
+    # there -- two can start in the same ms, and the clock can step backwards (e.g. a Pi with no RTC before GPS or NTP
+    # has set it). the file is created exclusively, so an existing segment can never be truncated
+    def open_segment(self):
+        number = int(time.time() * 1000)
+        for segment_file in list_segments(self.archive_dir):
+            try:
+                number = max(number, int(os.path.basename(segment_file)[:-len(SEGMENT_SUFFIX)]) + 1)
+            except ValueError:
+                pass # not one of ours
+
+        while True:
+            self.segment_file = os.path.join(self.archive_dir, "{}{}".format(number, SEGMENT_SUFFIX))
+            try:
+                fd = os.open(self.segment_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                break
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                number += 1
+        self.file = os.fdopen(fd, 'wb')
+        self.file.write(SEGMENT_MAGIC)
+        self.size = len(SEGMENT_MAGIC)
+        self.records = []
+
+    def close_segment(self):
+        time_index, id_index = _pack_indexes(self.records)
+        times = [t for offset, id, t in self.records]
+        self.file.write(time_index)
+        self.file.write(id_index)
+        self.file.write(_TRAILER.pack(self.size, self.size + len(time_index), len(self.records), min(times) if times else 0.0,
+            max(times) if times else 0.0, TRAILER_MAGIC))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        log.info("archive:close_segment - {} frames in {}".format(len(self.records), self.segment_file))
+
+        if (self.storage):
+            self.storage.add(self.archive_dir, os.path.basename(self.segment_file), os.path.getsize(self.segment_file))
+        self.file = None
+        self.segment_file = None
+        self.records = []
+
+    def close(self):
+        with self.lock:
+            if (self.file):
+                self.close_segment()
@@ -1,12 +1,27 @@
 ### camcap - captures GPS-tagged photos / videos
 import time
-import sys
 import os
-import traceback
+import re
 import threading
+import io
+import logging
 
-import picamera
 import gpspoll
+import frame
+import metrics
+import framesource
+
+# picamera is only needed when capturing from the camera (not when a framesource stands in for it)
+try:
+    import picamera
+except ImportError:
+    picamera = None
+
+log = logging.getLogger("camcap")
+
+FRAMES_CAPTURED = metrics.get_counter("camcap_frames_captured_total", "Frames captured, by source (for named sources)")
+FRAMES_NO_GPS = metrics.get_counter("camcap_frames_no_gps_total", "Captures skipped for lack of a GPS fix, by source (for named sources)")
+CAPTURE_SECONDS = metrics.get_histogram("camcap_capture_seconds", "Time taken by each camera capture, by source (for named sources)")
 
 RESOLUTION_LOW = (1640,1232)
 RESOLUTION_HIGH = (3280,2464)
@@ -14,12 +29,27 @@ RESOLUTION_HIGH = (3280,2464)
 PORT_CAMERA = False
 PORT_VIDEO = True
 
+CAPTURE_TO_FILE = "file" # write each frame to target_dir
+CAPTURE_TO_MEMORY = "memory" # keep each frame in memory and hand the JPEG bytes to the recognizers (needs a work queue)
+
 MAX_FILES_INITIAL_SLEEP_SECS = .5
 MAX_FILES_MAX_SLEEP_SECS = 30.0
 MAX_FILES_BACKOFF_FACTOR = 1.25
 
 CTL_FILE_SLEEP_SECS = 3
 
+NAME_RE = re.compile('^\w+$') # source names go in file names, so no dashes (see frame.name_source)
+
+# capture metadata for a frame (see frame.frame) captured at capture_time at the given position (a gpspoll.fix)
+def capture_meta(capture_time, position):
+    return {
+        'capture_epoch_time': capture_time,
+        'latitude': position.latitude,
+        'longitude': position.longitude,
+        'altitude': position.altitude if position.altitude else None,
+        'speed': position.speed if position.speed else None
+    }
+
 class camcap (threading.Thread):
     camera_port = PORT_CAMERA
     camera_hflip = False
@@ -28,129 +58,290 @@ class camcap (threading.Thread):
     exposure_mode = 'auto'
     jpg_quality = 85
     resolution = RESOLUTION_HIGH
-    gps_max_age = 10
+    gps_max_age = 10 # skip frames captured more than this many seconds after the last GPS fix
     ctl_file = None
+    work_queue = None
+    capture_meta = None
+    capture_mode = CAPTURE_TO_FILE
+    rate_control = None # set to a ratectl.ratectl to pace captures to what the recognizers can handle
+    continuous = False # capture continuously from the camera (see framesource.picamerasource) instead of one still at a time
+    storage = None # set to a storage.storagemanager to pause capturing while the disk is full
+    max_fps = None # capture at most this many frames per second (on top of any rate control)
+    report_secs = 300.0 # how often to log how many frames we've captured
 
     last_max_files_sleep_secs = None
+    last_capture_time = 0.0
 
-    def __init__(self):
+    # gps_source - where GPS fixes come from (a gpspoll.gpssource, e.g. gpspoll.replay). gpsd if None. if it's already
+    #              running, it's shared with other camcaps and it's up to the caller to stop it
+    # frame_source - where frames come from instead of the camera (see framesource), e.g. for testing. the camera if None
+    # name - with more than one camcap, tells them apart: it goes in the name of every frame captured, and in the
+    #        stats and metrics. letters, digits and underscores only
+    # camera_num - which camera to open, on boards with more than one camera connector
+    def __init__(self, gps_source = None, frame_source = None, name = None, camera_num = 0):
         threading.Thread.__init__(self)
+        self.frame_source = frame_source
+        self.camera = None
+        self.gpsp = None
+        self.owns_gps = False
+
+        if name is not None and not(NAME_RE.match(name)):
+            raise (ValueError('bad capture source name {!r} -- use letters, digits and underscores'.format(name)))
+        if (name):
+            self.name = "camcap-" + name # the thread's name
+        self.source = name
+        self.tag = "[{}]".format(name) if name else "" # for the log
+        self.labels = {'source': name} if name else {} # for the metrics
+        self.frames_captured = 0
+        self.frames_no_gps = 0
+        self.last_report = time.time()
+        self.frames_at_last_report = 0
         
-        print "camcap:init - starting"
+        log.info("camcap:init{} - starting".format(self.tag))
 
         # set up GPS polling
-        print "camcap:init - setting up GPS"
+        log.info("camcap:init{} - setting up GPS".format(self.tag))
         try:
-            self.gpsp = gpspoll.gpspoll()
+            self.gpsp = gps_source or gpspoll.gpspoll()
         except:
-            print ("camcap:init - could not start gpspoll")
-            traceback.print_exc()
+            log.exception("camcap:init - could not start gpspoll")
             exit()
     
-    	self.gpsp.start()
+        self.owns_gps = not(self.gpsp.is_alive())
+        if (self.owns_gps):
+            self.gpsp.start()
 
         # initialize the camera
-        print "camcap:init - setting up camera"
-        try:
-            self.camera = picamera.PiCamera()
-        except:
-            print ("camcap:init - could not set up camera")
-            traceback.print_exc()
-            exit()
+        if (self.frame_source is None):
+            log.info("camcap:init{} - setting up camera {}".format(self.tag, camera_num))
+            try:
+                self.camera = picamera.PiCamera(camera_num = camera_num)
+            except:
+                log.exception("camcap:init{} - could not set up camera".format(self.tag))
+                exit()
 
-        print "camcap:init - done"
+        log.info("camcap:init{} - done".format(self.tag))
 
     # stop gps thread when camcap object goes away
     def __del__ (self):
-        if (self.gpsp):
-            print "camcap:del - stopping GPS"
+        if (self.gpsp and self.owns_gps):
+            log.info("camcap:del - stopping GPS")
             self.gpsp.stop();
-            print "camcap:del - done"
+            log.info("camcap:del - done")
         
     def stop (self):
-        print "camcap:stop - waiting for camcap timed capture thread to finish"
+        log.info("camcap:stop{} - waiting for camcap timed capture thread to finish".format(self.tag))
         self.running = False
         self.join()
-        print "camcap:stop - camcap timed capture thread finished"
+        log.info("camcap:stop{} - camcap timed capture thread finished".format(self.tag))
+        self.report()
 
-        print "camcap:stop - stopping GPS"
-        self.gpsp.stop();
+        if (self.owns_gps):
+            log.info("camcap:stop - stopping GPS")
+            self.gpsp.stop();
         self.gpsp = None
-        print "camcap:stop - done"
+        log.info("camcap:stop{} - done".format(self.tag))
+
+    # log how many frames we've captured, and how fast since the last report
+    def report(self):
+        now = time.time()
+        elapsed = now - self.last_report
+        log.info("camcap:report{} - {} frames captured, {:.2f} frames/s over the last {:.0f}s, {} skipped for lack of a GPS fix".format(self.tag,
+            self.frames_captured, (self.frames_captured - self.frames_at_last_report) / elapsed if elapsed > 0 else 0.0, elapsed, self.frames_no_gps))
+        self.last_report = now
+        self.frames_at_last_report = self.frames_captured
+
+    # the file name for a frame captured at capture_time
+    def frame_name(self, capture_time):
+        if (self.source):
+            return "{:.0f}-{}-{}.jpg".format(capture_time * 1000, os.getpid(), self.source)
+        return "{:.0f}-{}.jpg".format(capture_time * 1000, os.getpid())
+
+    def count_captured(self, capture_secs = None):
+        self.frames_captured += 1
+        FRAMES_CAPTURED.inc(**self.labels)
+        if capture_secs is not None:
+            CAPTURE_SECONDS.observe(capture_secs, **self.labels)
 
-    def start_auto_capture(self, target_dir, sleep_secs = 1, max_files = None, ctl_file = None):
+    def count_no_gps(self):
+        self.frames_no_gps += 1
+        FRAMES_NO_GPS.inc(**self.labels)
+
+    # if work_queue is specified, each finished capture is put on the queue for the recognizers. with
+    # capture_mode = CAPTURE_TO_MEMORY, frames never touch target_dir and max_files limits the number of frames held in memory.
+    # if capture_meta (a capmeta.capmeta) is specified, the time and GPS data for each file written to target_dir is logged there
+    def start_auto_capture(self, target_dir, sleep_secs = 1, max_files = None, ctl_file = None, work_queue = None, capture_meta = None):
         self.target_dir = target_dir.rstrip("/")
         ## TODO: check directory and raise error if it's not valid
 
+        if self.capture_mode == CAPTURE_TO_MEMORY and work_queue is None:
+            raise (TypeError('capture_mode {} requires a work_queue'.format(CAPTURE_TO_MEMORY)))
+
         self.sleep_secs = sleep_secs
         self.max_files = max_files
         self.ctl_file = ctl_file
+        self.work_queue = work_queue
+        self.capture_meta = capture_meta
 
-        print "camcap:start_auto_capture - launching capture thread"
+        log.info("camcap:start_auto_capture{} - launching capture thread".format(self.tag))
         self.running = True
         self.start()
         
     def run(self):
-        print "camcap:run - auto capture thread running"
+        log.info("camcap:run{} - auto capture thread running".format(self.tag))
 
         # set camera resolution and orientation
-        self.camera.resolution = self.resolution
-        self.camera.hflip = self.camera_hflip
-        self.camera.vflip = self.camera_vflip
-        self.camera.exposure_mode = self.exposure_mode
-        self.camera.iso = self.iso
+        if (self.camera):
+            self.camera.resolution = self.resolution
+            self.camera.hflip = self.camera_hflip
+            self.camera.vflip = self.camera_vflip
+            self.camera.exposure_mode = self.exposure_mode
+            self.camera.iso = self.iso
+
+        if (self.frame_source is None and self.continuous):
+            self.frame_source = framesource.picamerasource(self.camera, self.camera_port, self.jpg_quality)
+        if (self.frame_source):
+            self.stream(self.frame_source)
+            return
 
         while(self.running):
-            
-            # flush stdout (for logging)
-            sys.stdout.flush()
 
             # do our sleep
             time.sleep(self.sleep_secs)
-            
-            # check if we're at our file limit
-            if (self.max_files):
-                file_count = len(os.listdir(self.target_dir))
 
-            if (file_count >= self.max_files):
-                if self.last_max_files_sleep_secs:
-                    sleep_secs = min (MAX_FILES_MAX_SLEEP_SECS, self.last_max_files_sleep_secs * MAX_FILES_BACKOFF_FACTOR)
+            if not(self.ready()):
+                continue
+
+            filename = self.frame_name(time.time())
+
+            if self.capture_mode == CAPTURE_TO_MEMORY:
+                stream = io.BytesIO()
+                meta = self.still(stream, 'jpeg')
+                if (meta):
+                    self.deliver(filename, meta, data = stream.getvalue())
+                continue
+
+            # capture image into a temp file -- deliver moves it to the final file name
+            capture_file = self.target_dir + "/_tmp." + filename
+            meta = self.still (capture_file)
+            if(meta):
+                self.deliver(filename, meta, capture_file = capture_file)
+
+    # capture from a frame source until we're stopped (or it runs out of frames). frames are only pulled from the
+    # source when we're ready for them, so the backlog limits and rate control pace the source
+    def stream(self, source):
+        log.info("camcap:stream{} - capturing continuously from {}".format(self.tag, source.__class__.__name__))
+        frames = source.frames()
+        try:
+            while(self.running):
+                if not(self.ready()):
+                    continue
+
+                data = next(frames, None)
+                if (data is None):
+                    log.info("camcap:stream{} - frame source finished".format(self.tag))
+                    break
+                capture_time = time.time()
+
+                # GPS comes from the recent fixes rather than EXIF -- rewriting the EXIF tags per frame would
+                # mean setting up the encoder again for every frame
+                position = self.gpsp.position_at(capture_time, self.gps_max_age)
+                if (position == None):
+                    log.warning("camcap:stream{} - no gps fix within {}s, dropping frame".format(self.tag, self.gps_max_age))
+                    self.count_no_gps()
+                    continue
+
+                self.count_captured()
+                filename = self.frame_name(capture_time)
+                meta = capture_meta(capture_time, position)
+                if self.capture_mode == CAPTURE_TO_MEMORY:
+                    self.deliver(filename, meta, data = data)
                 else:
-                    sleep_secs = MAX_FILES_INITIAL_SLEEP_SECS
-                
-                print "camcap:run - {} files in target_dir exceeds maximum of {}. sleeping for {:.2f}s.".format(file_count, self.max_files, sleep_secs)
+                    capture_file = self.target_dir + "/_tmp." + filename
+                    with open(capture_file, "wb") as f:
+                        f.write(data)
+                    self.deliver(filename, meta, capture_file = capture_file)
+        finally:
+            source.close()
 
-                time.sleep(sleep_secs)
+    # hand a captured frame on: to the work queue if it's in memory (data), or by moving capture_file to its final
+    # name in target_dir. the rename keeps the recognizers from trying to parse the file before it's done
+    def deliver(self, filename, meta, data = None, capture_file = None):
+        if (data is not None):
+            self.work_queue.put(frame.frame(filename, data = data, meta = meta))
+            return
 
-                self.last_max_files_sleep_secs = sleep_secs
+        if (self.capture_meta):
+            self.capture_meta.add(filename, meta)
+        os.rename (capture_file, self.target_dir + "/" + filename)
+        if (self.work_queue is not None):
+            self.work_queue.put(frame.frame(filename, meta = meta))
 
-                continue # loop until we're below our file limit
-            
-            # we're not at our file limit
-            self.last_max_files_sleep_secs = None
-        
-            # if a control file is specified, make sure it's present -- otherwise, don't capture
-            if self.ctl_file and not(os.path.exists(self.ctl_file)):
-                print "camcap:run - control file {} not present, sleeping for {:.2f}s".format(self.ctl_file, CTL_FILE_SLEEP_SECS)
-                time.sleep(CTL_FILE_SLEEP_SECS)
-                continue # loop until the control file is present
+    # log why we can't capture and sleep, a little longer each time we're called in a row
+    def backoff(self, reason):
+        if self.last_max_files_sleep_secs:
+            sleep_secs = min (MAX_FILES_MAX_SLEEP_SECS, self.last_max_files_sleep_secs * MAX_FILES_BACKOFF_FACTOR)
+        else:
+            sleep_secs = MAX_FILES_INITIAL_SLEEP_SECS
 
-            # capture image into a temp file, then move it to the final file name
-            # this keeps the recognizer from trying to parse the file before it's done
+        log.warning("camcap:run{} - {}. sleeping for {:.2f}s.".format(self.tag, reason, sleep_secs))
 
-            filename = "{:.0f}-{}.jpg".format(time.time() * 1000, os.getpid())
-            final_file = self.target_dir + "/" + filename
-            capture_file = self.target_dir + "/_tmp." + filename
-            if(self.still (capture_file)):
-                os.rename (capture_file, final_file)
+        time.sleep(sleep_secs)
+        self.last_max_files_sleep_secs = sleep_secs
 
-    # capture a still photo w/ gps -- will exit if no GPS signal is available
-    def still (self, file):
-            # get GPS data
-            data = self.gpsp.get(self.gps_max_age);
+    # whether to capture now. sleeps (and returns False) while we're at the file limit, the disk is full or the control
+    # file is missing, and with rate control, waits out the rest of the capture interval
+    def ready(self):
+        # check if we're at our file limit. with a work queue, the queue depth is the
+        # number of files waiting, so there's no need to list the directory
+        file_count = 0
+        if (self.max_files or self.rate_control):
+            if (self.work_queue is not None):
+                file_count = len(self.work_queue)
+            else:
+                file_count = len(os.listdir(self.target_dir))
+
+        if (self.max_files and file_count >= self.max_files):
+            self.backoff("{} files in target_dir exceeds maximum of {}".format(file_count, self.max_files))
+            return False # loop until we're below our file limit
+
+        # the storage manager clears out old images as the disk fills up. if that's not enough, wait for it
+        if (self.storage and self.storage.headroom() <= 0):
+            self.backoff("disk is nearly full ({:.1f}MB short of the free space to keep)".format(-self.storage.headroom() / 1e6))
+            return False # loop until there's room
+
+        # we're not at our file or disk limit
+        self.last_max_files_sleep_secs = None
+
+        # if a control file is specified, make sure it's present -- otherwise, don't capture
+        if self.ctl_file and not(os.path.exists(self.ctl_file)):
+            log.info("camcap:run{} - control file {} not present, sleeping for {:.2f}s".format(self.tag, self.ctl_file, CTL_FILE_SLEEP_SECS))
+            time.sleep(CTL_FILE_SLEEP_SECS)
+            return False # loop until the control file is present
+
+        if time.time() - self.last_report >= self.report_secs:
+            self.report()
+
+        # wait out whatever is left of the capture interval: the one rate control picked for the current backlog,
+        # or max_fps, whichever is slower
+        interval_secs = 1.0 / self.max_fps if self.max_fps else 0.0
+        if (self.rate_control):
+            interval_secs = max(interval_secs, self.rate_control.interval(file_count))
+        wait_secs = interval_secs - (time.time() - self.last_capture_time)
+        if wait_secs > 0:
+            time.sleep(wait_secs)
+        self.last_capture_time = time.time()
+        return True
+
+    # capture a still photo w/ gps to a file name or stream. returns the capture metadata for the frame
+    # (see frame.frame), or None if no GPS signal is available and nothing was captured
+    def still (self, file, format = None):
+            # get our position now from the recent GPS fixes -- extrapolated from the last fix along its speed and track
+            data = self.gpsp.position_at(time.time(), self.gps_max_age)
             if (data == None):
-                print "camcap:still - no gps fix, skipping photo"
-                return False
+                log.warning("camcap:still{} - no gps fix within {}s, skipping photo".format(self.tag, self.gps_max_age))
+                self.count_no_gps()
+                return None
 
             # set up GPS EXIF tags
             self.camera.exif_tags['GPS.GPSLatitude'] = gpspoll.deg_to_str(data.latitude)
@@ -165,11 +356,13 @@ class camcap (threading.Thread):
                 self.camera.exif_tags['GPS.GPSSpeed'] = gpspoll.dist_to_str(data.speed / 1000) # divide to convert mph to kph
                 self.camera.exif_tags["GPS.GPSSpeedRef"] = "K"
 
-            #print "camcap:still - EXIF tags: {}".format(self.camera.exif_tags)
+            #log.debug("camcap:still - EXIF tags: {}".format(self.camera.exif_tags))
 
             # do capture
             capture_start = time.time();
-            self.camera.capture(file, None, self.camera_port, quality=self.jpg_quality)
-            print ("camcap:still captured {} in {:.2f}s".format(file, time.time()-capture_start))
-            
-            return True
\ No newline at end of file
+            self.camera.capture(file, format, self.camera_port, quality=self.jpg_quality)
+            capture_secs = time.time() - capture_start
+            self.count_captured(capture_secs)
+            log.debug("camcap:still captured {} in {:.2f}s".format(file if format is None else "frame to memory", capture_secs))
+
+            return capture_meta(capture_start, data)
@@ -0,0 +1,66 @@
+### capmeta - append-only log of capture metadata (time and GPS) for the files in the capture directory
+import os
+import json
+import threading
+import logging
+
+log = logging.getLogger("capmeta")
+
+# fields stored for each capture, in log order (see frame.frame for what they mean)
+FIELDS = ('capture_epoch_time', 'latitude', 'longitude', 'altitude', 'speed')
+
+class capmeta (object):
+
+    # loads any existing entries from log_file, then appends new ones to it
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.entries = {}
+        self.lock = threading.Lock()
+
+        if os.path.exists(self.log_file):
+            with open(self.log_file, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # partial line from a power loss mid-write
+                    self.entries[record[0]] = dict(zip(FIELDS, record[1:]))
+
+        self.log = open(self.log_file, "a")
+        log.info("capmeta:init - loaded metadata for {} captures from {}".format(len(self.entries), self.log_file))
+
+    def close(self):
+        with self.lock:
+            self.log.close()
+
+    # record the metadata for a capture. each record is one short JSON line
+    def add(self, name, meta):
+        record = [name] + [meta.get(field) for field in FIELDS]
+        with self.lock:
+            self.entries[name] = meta
+            self.log.write(json.dumps(record, separators=(',', ':')) + "\n")
+            self.log.flush()
+
+    # metadata for a capture, or None if we don't have any (e.g. an image that wasn't captured by camcap)
+    def get(self, name):
+        return self.entries.get(name)
+
+    # forget a capture once it's been recognized. the log itself is only trimmed by compact()
+    def remove(self, name):
+        self.entries.pop(name, None)
+
+    # rewrite the log so it only holds entries for the given capture names (e.g. whatever is still in the capture
+    # directory at startup). keeps the log from growing forever
+    def compact(self, names):
+        with self.lock:
+            self.entries = dict((name, self.entries[name]) for name in names if name in self.entries)
+
+            self.log.close()
+            tmp_file = self.log_file + ".tmp"
+            with open(tmp_file, "w") as f:
+                for name, meta in self.entries.items():
+                    f.write(json.dumps([name] + [meta.get(field) for field in FIELDS], separators=(',', ':')) + "\n")
+            os.rename(tmp_file, self.log_file)
+            self.log = open(self.log_file, "a")
+
+        log.info("capmeta:compact - kept metadata for {} captures".format(len(self.entries)))
@@ -0,0 +1,125 @@
+### dedup - merges repeated reads of the same plate across consecutive frames into a single sighting
+import math
+import time
+
+EARTH_RADIUS_M = 6371000.0
+
+# fields added to a match record when it becomes a sighting
+SIGHTING_FIELDS = ['first_seen_time', 'first_seen_epoch_time', 'last_seen_epoch_time', 'frame_count']
+
+# number of single character inserts, deletes or substitutions to turn a into b
+def edit_distance(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = range(len(b) + 1)
+    for i, ca in enumerate(a):
+        current = [i + 1]
+        for j, cb in enumerate(b):
+            current.append(min(previous[j + 1] + 1, current[j] + 1, previous[j] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+# great circle distance in meters between two points in decimal degrees
+def distance_m(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def _float(value, default = 0.0):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+class sighting (object):
+
+    def __init__(self, match):
+        self.best = match
+        self.first_seen = _float(match.get('capture_epoch_time'))
+        self.last_seen = self.first_seen
+        self.latitude = _float(match.get('capture_latitude'))
+        self.longitude = _float(match.get('capture_longitude'))
+        self.candidates = set(match.get('candidates') or [match['plate']])
+        self.frame_count = 1
+        self.updated = time.time()
+
+    # could this read be the same plate as this sighting?
+    def same_plate(self, match, max_edit_distance):
+        candidates = match.get('candidates') or [match['plate']]
+        for plate in candidates:
+            if plate in self.candidates:
+                return True
+        if max_edit_distance > 0:
+            for plate in candidates:
+                for seen in self.candidates:
+                    if abs(len(plate) - len(seen)) <= max_edit_distance and edit_distance(plate, seen) <= max_edit_distance:
+                        return True
+        return False
+
+    def merge(self, match):
+        capture_time = _float(match.get('capture_epoch_time'))
+        self.first_seen = min(self.first_seen, capture_time)
+        self.last_seen = max(self.last_seen, capture_time)
+        self.latitude = _float(match.get('capture_latitude'))
+        self.longitude = _float(match.get('capture_longitude'))
+        self.frame_count += 1
+        self.updated = time.time()
+
+        # keep the most confident frame as the one that represents the sighting. later reads are matched against its
+        # candidates only -- gathering up every read's candidates would let a long sighting chain-merge unrelated plates
+        if _float(match.get('confidence')) > _float(self.best.get('confidence')):
+            self.best = match
+            self.candidates = set(match.get('candidates') or [match['plate']])
+
+    # the sighting as a match record for output: the best frame's match plus when it was first/last seen and how often
+    def record(self):
+        record = dict(self.best)
+        record['first_seen_time'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.first_seen)) if self.first_seen else ''
+        record['first_seen_epoch_time'] = "{:.0f}".format(self.first_seen)
+        record['last_seen_epoch_time'] = "{:.0f}".format(self.last_seen)
+        record['frame_count'] = self.frame_count
+        return record
+
+class dedup (object):
+    window_secs = 10.0 # reads further apart in capture time than this are separate sightings
+    max_distance_m = 100.0 # ... as are reads further apart than this
+    max_edit_distance = 1 # how different two candidate plates can be and still count as the same plate
+
+    def __init__(self):
+        self.open = []
+        self.latest_capture = 0.0
+
+    # add a read. returns a list of sightings (as match records) that are now closed and ready for output
+    def add(self, match):
+        capture_time = _float(match.get('capture_epoch_time'))
+        latitude = _float(match.get('capture_latitude'))
+        longitude = _float(match.get('capture_longitude'))
+        self.latest_capture = max(self.latest_capture, capture_time)
+
+        for s in self.open:
+            if (capture_time < s.first_seen - self.window_secs or capture_time > s.last_seen + self.window_secs):
+                continue
+            if (distance_m(s.latitude, s.longitude, latitude, longitude) > self.max_distance_m):
+                continue
+            if (s.same_plate(match, self.max_edit_distance)):
+                s.merge(match)
+                break
+        else:
+            self.open.append(sighting(match))
+
+        return self.expire()
+
+    # close sightings that can't get any more reads: newer frames are already past the window, or nothing has been
+    # merged in for window_secs (e.g. we've stopped seeing plates at all)
+    def expire(self):
+        now = time.time()
+        closed = [s for s in self.open if self.latest_capture - s.last_seen > self.window_secs or now - s.updated > self.window_secs]
+        if closed:
+            self.open = [s for s in self.open if s not in closed]
+        return [s.record() for s in closed]
+
+    # close everything (e.g. on shutdown)
+    def close_all(self):
+        closed = self.open
+        self.open = []
+        return [s.record() for s in closed]
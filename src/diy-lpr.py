@@ -1,13 +1,27 @@
 # main script to launch the lpr
 
-import traceback
-import threading
-import random
-import sys
+import startup # first, so it can time startup from launch
 import os
+import logging
 
 import camcap
+import gpspoll
+import framesource
+import watchlist
+import rawlog
+import storage
+import archive
 import recognizer
+import alprengine
+import workqueue
+import capmeta
+import outwriter
+import dedup
+import framefilter
+import ratectl
+import roi
+import metrics
+import logsetup
 
 import time
 
@@ -29,6 +43,79 @@ CAPTURE_CTL_FILE = PROJECT_DIR + "/capture_ctl"
 #             can recognize them
 MAX_FILES = 10000
 
+# TARGET_LATENCY_SECS (optional) - if set, the capture rate is adjusted to what the recognizers can keep up with, aiming to have
+#                                 every frame recognized within TARGET_LATENCY_SECS of capture. MAX_FILES still applies as
+#                                 a hard limit. if None, frames are captured as fast as possible until MAX_FILES is reached
+TARGET_LATENCY_SECS = 10.0
+
+# DISPATCH_MODE - how captured images get handed to the recognizers. "queue" has camcap put each finished capture
+#                 on an in-memory work queue that the recognizers block on. "poll" has the recognizers list
+#                 CAPTURE_DIR over and over looking for new files (slower, but doesn't depend on camcap)
+DISPATCH_MODE = "queue"
+
+# SCHEDULE_POLICY - with DISPATCH_MODE = "queue", the order captured images are recognized in. "fifo" is oldest first. "lifo"
+#                   is newest first, so fresh images don't wait behind a backlog (images older than SCHEDULE_MAX_AGE_SECS
+#                   are dropped without being recognized, like SCHEDULE_DEADLINE_SECS). "priority" recognizes images
+#                   captured at higher GPS speed first
+SCHEDULE_POLICY = "fifo"
+SCHEDULE_MAX_AGE_SECS = 60.0
+
+# SCHEDULE_DEADLINE_SECS (optional) - with DISPATCH_MODE = "queue", images that have waited longer than this are dropped
+#                                     without being recognized (handled like images with no hit)
+SCHEDULE_DEADLINE_SECS = None
+
+# CAPTURE_MODE - "file" writes every captured image to CAPTURE_DIR. "memory" keeps captured images in memory and hands them
+#                straight to the recognizers (requires DISPATCH_MODE = "queue"), so only images that end up in one of the
+#                POSTPROC directories below are ever written to disk. Saves a lot of I/O and SD card wear
+CAPTURE_MODE = "file"
+
+# CAPTURE_CONTINUOUS - Capture a continuous stream of frames from the camera's video port (picamera's capture_continuous)
+#                      instead of taking one still at a time. Much higher frame rates, but GPS data only goes in the
+#                      capture metadata (see CAPTURE_META_LOG), not in the images' EXIF tags
+CAPTURE_CONTINUOUS = False
+
+# CAPTURE_SOURCE_DIR - Take frames from the JPEGs in this directory (over and over) instead of the camera, for testing.
+#                      None to use the camera
+CAPTURE_SOURCE_DIR = None
+
+# CAMERAS - The cameras to capture from, each a dict of its settings. Any setting left out comes from CAMERA_DEFAULTS:
+#             name - Tells the cameras apart: goes in the file name of every image the camera captures, and in its stats
+#                    and metrics. Letters, digits and underscores only. Needed when there's more than one camera
+#             camera_num - Which camera connector (on boards with more than one)
+#             source_dir - Replay the JPEGs in this directory instead of using the camera, like CAPTURE_SOURCE_DIR
+#             resolution, hflip, vflip, iso, exposure_mode - Camera settings
+#             max_fps - Capture at most this many frames a second from this camera. None for no limit
+#           All the cameras share the GPS and the recognizers, which take images from each camera in turn so that a
+#           busy camera can't hold up the others. Capture rate control (TARGET_LATENCY_SECS) is split between them
+CAMERAS = [{}]
+#CAMERAS = [{'name': 'front'}, {'name': 'side', 'camera_num': 1, 'hflip': False, 'vflip': False, 'max_fps': 2}]
+#CAMERAS = [{'name': 'front', 'source_dir': '/mnt/usb/front'}, {'name': 'side', 'source_dir': '/mnt/usb/side'}] # no camera needed
+
+# CAMERA_DEFAULTS - Settings for every camera in CAMERAS that doesn't set its own
+CAMERA_DEFAULTS = {
+    'camera_num': 0,
+    'source_dir': CAPTURE_SOURCE_DIR,
+    'resolution': camcap.RESOLUTION_LOW,
+    'hflip': True,
+    'vflip': True,
+    'iso': 800,
+    'exposure_mode': 'sports',
+    'max_fps': None
+}
+
+# MAX_MEMORY_FRAMES - with CAPTURE_MODE = "memory", the max number of captured images to hold in memory waiting for
+#                     recognition. used instead of MAX_FILES. each image is a few hundred KB
+MAX_MEMORY_FRAMES = 50
+
+# CAPTURE_META_LOG - log of the capture time and GPS location of each image written to CAPTURE_DIR. lets the recognizers
+#                    get this without parsing EXIF (and without the rounding in the EXIF GPS values)
+CAPTURE_META_LOG = PROJECT_DIR + "/capture_meta.log"
+
+# PROCESSING_DIR - where images are held while they are being recognized. each recognizer claims an image by moving it
+#                  into its own subdirectory. anything left here at startup (e.g. after a power loss) is moved back to
+#                  CAPTURE_DIR to be recognized again
+PROCESSING_DIR = PROJECT_DIR + "/processing"
+
 # POSTPROC_HIT_DIR - where to put files with a license plate hit after recognition
 POSTPROC_HIT_DIR = PROJECT_DIR  + "/proc-hit"
 
@@ -41,10 +128,72 @@ POSTPROC_LOWCONF_DIR = PROJECT_DIR  + "/proc-lowconf"
 POSTPROC_NOHIT_DIR = None
 #POSTPROC_NOHIT_DIR = PROJECT_DIR  + "/work/proc-nohit"
 
+# POSTPROC_LAYOUT - How images are laid out in the POSTPROC directories (and JSON files in OUTPUT_JSON): a time.strftime
+#                   pattern for the subdirectory each one goes in, from its capture time (e.g. "%Y/%m/%d/%H" for a
+#                   directory per hour), so no one directory grows to hundreds of thousands of files. None to put them all
+#                   in the directory itself. alpr-reshard moves existing files over after a change
+POSTPROC_LAYOUT = "%Y/%m/%d/%H"
+
+# ARCHIVE_DIR - Append the images that would go in the POSTPROC directories (along with their capture time, position and
+#               matches) to segment files of ARCHIVE_SEGMENT_MB each in this directory instead, rather than keeping a file
+#               per image. Far quicker to copy off the Pi, and alpr-archive can look up any frame in them by file name
+#               or time. None to keep each image as its own file
+ARCHIVE_DIR = None
+#ARCHIVE_DIR = PROJECT_DIR + "/archive"
+ARCHIVE_SEGMENT_MB = 512
+
+# STORAGE_MIN_FREE_MB (optional) - Keep at least this much space free on the disk PROJECT_DIR is on. When free space drops
+#                                  below it, the oldest images are deleted from POSTPROC_NOHIT_DIR first, then
+#                                  POSTPROC_LOWCONF_DIR, then POSTPROC_HIT_DIR, then the oldest ARCHIVE_DIR segments. If that
+#                                  still isn't enough (e.g. output files have filled the disk), capturing pauses until
+#                                  there's room. None to never delete images to free up space (capturing still pauses
+#                                  when the disk is full)
+STORAGE_MIN_FREE_MB = None
+#STORAGE_MIN_FREE_MB = 500
+
+# STORAGE_*_MAX_MB, STORAGE_*_MAX_FILES (optional) - Most images to keep in each post-processing directory (or segments in
+#                                                   ARCHIVE_DIR), in MB and/or number of files. The oldest go first once
+#                                                   one is over. None for no limit
+STORAGE_HIT_MAX_MB = None
+STORAGE_HIT_MAX_FILES = None
+STORAGE_LOWCONF_MAX_MB = None
+#STORAGE_LOWCONF_MAX_MB = 4000
+STORAGE_LOWCONF_MAX_FILES = None
+STORAGE_NOHIT_MAX_MB = None
+#STORAGE_NOHIT_MAX_MB = 1000
+STORAGE_NOHIT_MAX_FILES = None
+STORAGE_ARCHIVE_MAX_MB = None
+STORAGE_ARCHIVE_MAX_FILES = None
+
 # OUTPUT_JSON (optional, if OUTPUT_CSV specified) - on recognition, put a JSON file in this directory with the details of the hit
 OUTPUT_JSON = PROJECT_DIR  + "/output/json"
 # OUTPUT_CSV (optional, if OUTPUT_JSON specified) - on recnognition, add a line to the CSV file with details of the HIT
 OUTPUT_CSV = PROJECT_DIR  + "/output/output.csv"
+# OUTPUT_JSONL (optional) - on recognition, add a line with the details of the hits in the image to this JSON Lines file.
+#                           a lighter alternative to OUTPUT_JSON (one file instead of one file per image)
+OUTPUT_JSONL = None
+#OUTPUT_JSONL = PROJECT_DIR  + "/output/output.jsonl"
+# OUTPUT_SQLITE (optional) - on recognition, add the hits to this SQLite database, indexed for lookups by plate, time and
+#                            location. query it with src/plate-query.py
+OUTPUT_SQLITE = None
+#OUTPUT_SQLITE = PROJECT_DIR  + "/output/results.db"
+
+# OUTPUT_BATCH_SIZE, OUTPUT_FLUSH_SECS - output is written in batches, once OUTPUT_BATCH_SIZE hits are waiting or the oldest
+#                                        waiting hit is OUTPUT_FLUSH_SECS old (whichever comes first)
+OUTPUT_BATCH_SIZE = 50
+OUTPUT_FLUSH_SECS = 5.0
+
+# DEDUP_WINDOW_SECS (optional) - if set, repeated reads of the same plate are merged into one "sighting" before output. reads
+#                               merge when they are captured within DEDUP_WINDOW_SECS and DEDUP_MAX_DISTANCE_M of each other
+#                               and one of OpenALPR's candidate plates is within DEDUP_MAX_EDIT_DISTANCE characters. output
+#                               gets the most confident read, plus first/last seen times and a frame count
+DEDUP_WINDOW_SECS = None
+#DEDUP_WINDOW_SECS = 10.0
+DEDUP_MAX_DISTANCE_M = 100.0
+DEDUP_MAX_EDIT_DISTANCE = 1
+
+# OUTPUT_FSYNC - "batch" forces output to disk after every batch (safer on power loss). "never" leaves it to the OS
+OUTPUT_FSYNC = "never"
 
 # DEFAULT_REGION (optional) - The default OpenALPR region (or US state) to try to pattern match license plate strings.
 #                             See Open ALPR documentation for more detail
@@ -58,71 +207,346 @@ MIN_CONF_PATTERNMATCH = 75.0
 #                         match the pattern for the DEFAULT_REGION
 MIN_CONF_NOPATTERNMATCH = 85.0
 
+# SKIP_UNCHANGED_FRAMES - if True, frames that barely differ from the last recognized frame while the vehicle is (nearly)
+#                         stopped are not recognized, and are handled like frames with no hit. requires numpy and PIL.
+#                         FRAME_MIN_CHANGE is the mean per-pixel difference (0-255) needed to count as changed,
+#                         FRAME_SKIP_MAX_SPEED is the GPS speed (m/s) above which frames are never skipped, and at least
+#                         one frame is recognized every FRAME_SKIP_MAX_SECS
+SKIP_UNCHANGED_FRAMES = False
+FRAME_MIN_CHANGE = 4.0
+FRAME_SKIP_MAX_SPEED = 1.0
+FRAME_SKIP_MAX_SECS = 10.0
+
+# DETECT_ROI (optional) - only look for plates inside this polygon, given as a list of (x, y) points where x and y are fractions
+#                         (0.0 - 1.0) of the image width and height. e.g. [(0, 0.3), (1, 0.3), (1, 0.85), (0, 0.85)] skips
+#                         the sky and the hood. requires PIL
+DETECT_ROI = None
+
+# DETECT_SCALE - if less than 1.0, find plates on a copy of the image scaled down by this much, then read each plate found from
+#                the full resolution image. much less work for OpenALPR on big images, but very small plates may be missed.
+#                DETECT_MARGIN is how much to pad each plate found (as a fraction of its size) before reading it. requires PIL
+DETECT_SCALE = 1.0
+DETECT_MARGIN = 0.5
+
 # RECOGNIZER_THREADS - How many threads to launch to perform recognition. Recommend # of processor cores minus one.
 RECOGNIZER_THREADS = 3 # we have four processor cores on the Raspberry Pi 3 Model B
 
+# RECOGNIZER_BACKEND - Where OpenALPR runs. "thread" runs it inside each recognizer thread. "process" gives each recognizer
+#                      its own worker process running OpenALPR, so recognition isn't held up by the GIL and a crash in
+#                      OpenALPR only takes down (and restarts) that worker
+RECOGNIZER_BACKEND = "thread"
+
+# RECOGNIZER_RESTART_SECS - A recognizer that stops (e.g. because OpenALPR couldn't be loaded) is replaced with a new one,
+#                           at most this often
+RECOGNIZER_RESTART_SECS = 30
+
+# WATCHLIST_FILE - Plates to watch for, one per line (optionally followed by a comma and a note). Every candidate OpenALPR
+#                  comes up with is checked against it, and hits are alerted on (logged and appended to
+#                  WATCHLIST_ALERT_FILE) as soon as they're read. Changes to the file are picked up within
+#                  WATCHLIST_RELOAD_SECS. None to disable
+WATCHLIST_FILE = None
+WATCHLIST_ALERT_FILE = PROJECT_DIR + "/output/alerts.jsonl"
+WATCHLIST_RELOAD_SECS = 10
+
+# WATCHLIST_MAX_DISTANCE - 1 to also alert on plates one character off from a listed plate, 0 for exact matches only.
+#                          Characters OCR commonly confuses (0/O/D/Q, 1/I/L, 2/Z, 5/S, 6/G, 8/B) always match each other
+WATCHLIST_MAX_DISTANCE = 1
+
+# RAW_LOG (optional) - Append every frame's raw OpenALPR results (all candidates for each plate, plate corners, processing
+#                      time) to this compact binary log, so thresholds can be tried out later with alpr-reprocess --rescore
+#                      instead of running OpenALPR again. It is never trimmed, so it grows for as long as it is enabled
+RAW_LOG = None
+#RAW_LOG = PROJECT_DIR + "/output/raw.bin"
+
+# GPS_REPLAY_FILE - Play GPS fixes back from this log instead of reading them from gpsd, for testing. Either gpsd JSON
+#                   (e.g. saved with "gpspipe -w") or raw NMEA sentences. None to use gpsd
+GPS_REPLAY_FILE = None
+
+# LOG_LEVEL - How much to log: "DEBUG" (every frame), "INFO", "WARNING" or "ERROR"
+LOG_LEVEL = "INFO"
+
+# LOG_FILE - Also append the log to this file. None to only log to stdout
+LOG_FILE = None
+
+# LOG_RATE_LIMIT - How many messages any one log statement may write per minute. Past that, messages are dropped and
+#                  counted, and the count is logged once the minute is up. None for no limit
+LOG_RATE_LIMIT = 10
+
+# METRICS_PORT - Serve pipeline metrics (capture rate, queue depth, per-worker OCR time, outcomes, GPS fix age, output
+#                write time...) at http://localhost:METRICS_PORT/metrics in Prometheus format, and at /metrics.json.
+#                None to disable
+METRICS_PORT = None
+
+# METRICS_SNAPSHOT_FILE - Write a JSON snapshot of the metrics to this file every METRICS_SNAPSHOT_SECS seconds. None to disable
+METRICS_SNAPSHOT_FILE = None
+METRICS_SNAPSHOT_SECS = 60
+
 ## END DIY-ALPR CONFIG
 
-try:
-    print "diy-lpr - setting up camcap"
-    cam = camcap.camcap()
-    
-    cam.camera_port = camcap.PORT_VIDEO
-    cam.resolution = camcap.RESOLUTION_LOW
-    cam.camera_hflip = True
-    cam.camera_vflip = True
-    cam.iso = 800
-    cam.exposure_mode = 'sports'
-
-    print "diy-lpr - done setting up camcap"
-
-    print "diy-lpr - setting up {} recognizer objects".format(RECOGNIZER_THREADS)
-    recogs = []
-    lock = threading.RLock();
+logsetup.setup(LOG_LEVEL, LOG_FILE, LOG_RATE_LIMIT)
+log = logging.getLogger("diy-lpr")
+
+metrics_server = None
+metrics_snapshot = None
+gps = None
+cams = []
+recogs = []
+output = None
+hotlist = None
+raw_log = None
+storage_manager = None
+archive_writer = None
+
+# these set up the components that take a while to start and don't depend on each other, so they can be set up in
+# parallel (see startup.parallel)
+
+# returns (gps, cams): the GPS source (started), and a camcap for each of CAMERAS, all sharing it
+def setup_cameras():
+    names = [settings.get('name') for settings in CAMERAS]
+    if len(CAMERAS) > 1 and (None in names or len(set(names)) < len(names)):
+        raise (ValueError('with more than one camera, each one in CAMERAS needs a name of its own'))
+
+    gps = gpspoll.replay(GPS_REPLAY_FILE, loop = True) if GPS_REPLAY_FILE else gpspoll.gpspoll()
+    gps.start()
+
+    cams = []
+    for settings in CAMERAS:
+        settings = dict(CAMERA_DEFAULTS, **settings)
+        log.info("diy-lpr - setting up camcap{}".format(" " + settings['name'] if settings.get('name') else ""))
+        cam = camcap.camcap(
+            gps_source = gps,
+            frame_source = framesource.dirsource(settings['source_dir'], loop = True) if settings['source_dir'] else None,
+            name = settings.get('name'),
+            camera_num = settings['camera_num']
+        )
     
+        cam.camera_port = camcap.PORT_VIDEO
+        cam.resolution = settings['resolution']
+        cam.camera_hflip = settings['hflip']
+        cam.camera_vflip = settings['vflip']
+        cam.iso = settings['iso']
+        cam.exposure_mode = settings['exposure_mode']
+        cam.max_fps = settings['max_fps']
+        cam.capture_mode = CAPTURE_MODE
+        cam.continuous = CAPTURE_CONTINUOUS
+        cams.append(cam)
+
+    log.info("diy-lpr - done setting up camcap")
+    return gps, cams
+
+# returns (capture_meta, work_queue)
+def setup_capture_queue():
+    # put back anything a recognizer was working on when we last stopped
+    recognizer.recover_processing(PROCESSING_DIR, CAPTURE_DIR)
+
+    # load capture metadata, dropping entries for files that have already been recognized
+    capture_meta = capmeta.capmeta(CAPTURE_META_LOG)
+    capture_meta.compact(workqueue.list_captures(CAPTURE_DIR))
+
+    work_queue = None
+    if DISPATCH_MODE == "queue":
+        # pick up anything left over in CAPTURE_DIR from the last run before camcap starts adding to it
+        work_queue = workqueue.workqueue(max_files, workqueue.create_scheduler(SCHEDULE_POLICY, SCHEDULE_MAX_AGE_SECS, fair_sources = len(CAMERAS) > 1))
+        work_queue.deadline_secs = SCHEDULE_DEADLINE_SECS
+        work_queue.fill_from_dir(CAPTURE_DIR, capture_meta)
+        metrics.get_gauge("workqueue_depth", "Frames waiting to be recognized", fn = lambda: len(work_queue))
+
+    return capture_meta, work_queue
+
+def setup_watchlist():
+    if not(WATCHLIST_FILE):
+        return None
+
+    hotlist = watchlist.watchlist(WATCHLIST_FILE, watchlist.alertsink(WATCHLIST_ALERT_FILE))
+    hotlist.max_distance = WATCHLIST_MAX_DISTANCE
+    hotlist.reload_secs = WATCHLIST_RELOAD_SECS
+    return hotlist
+
+# returns (storage_manager, archive_writer)
+def setup_storage():
+    # when the disk fills up, images with no plates go first, then low confidence ones, then hits
+    storage_manager = storage.storagemanager(PROJECT_DIR, STORAGE_MIN_FREE_MB * 1000000 if STORAGE_MIN_FREE_MB else None)
+    for dir, max_mb, max_files, evict_rank in [(POSTPROC_NOHIT_DIR, STORAGE_NOHIT_MAX_MB, STORAGE_NOHIT_MAX_FILES, 0),
+            (POSTPROC_LOWCONF_DIR, STORAGE_LOWCONF_MAX_MB, STORAGE_LOWCONF_MAX_FILES, 1),
+            (POSTPROC_HIT_DIR, STORAGE_HIT_MAX_MB, STORAGE_HIT_MAX_FILES, 2)]:
+        if dir:
+            storage_manager.add_dir(dir, max_mb * 1000000 if max_mb else None, max_files, evict_rank)
+
+    archive_writer = None
+    if ARCHIVE_DIR:
+        archive_writer = archive.archivewriter(ARCHIVE_DIR)
+        archive_writer.segment_bytes = ARCHIVE_SEGMENT_MB * 1000000
+        archive_writer.storage = storage_manager
+        storage_manager.add_dir(ARCHIVE_DIR, STORAGE_ARCHIVE_MAX_MB * 1000000 if STORAGE_ARCHIVE_MAX_MB else None, STORAGE_ARCHIVE_MAX_FILES, 3)
+
+    return storage_manager, archive_writer
 
+# recognizer number x, using engine (an alprengine engine) if given, or loading OpenALPR for itself otherwise. uses the
+# components set up below, so only call it once they have been
+def create_recognizer(x, engine = None):
+    recog = recognizer.recognizer (
+        source_dir = CAPTURE_DIR,
+        processing_dir = PROCESSING_DIR + "/recog-{}".format(x),
+        postproc_hit_dir = POSTPROC_HIT_DIR,
+        postproc_nohit_lowconf_dir = POSTPROC_LOWCONF_DIR,
+        postproc_nohit_dir = POSTPROC_NOHIT_DIR,
+        output = output,
+        default_region=DEFAULT_REGION,
+        work_queue = work_queue,
+        backend = RECOGNIZER_BACKEND,
+        capture_meta = capture_meta,
+        frame_filter = frame_filter,
+        rate_control = rate_control,
+        detector = detector,
+        watchlist = hotlist,
+        raw_log = raw_log,
+        storage = storage_manager,
+        archive = archive_writer,
+        engine = engine
+    )
+
+    recog.min_conf_patternmatch = MIN_CONF_PATTERNMATCH
+    recog.min_conf_nopatternmatch = MIN_CONF_NOPATTERNMATCH
+    recog.postproc_layout = POSTPROC_LAYOUT
+    recog.on_ready = boot.recognizer_ready
+    recog.on_frame = boot.frame_recognized
+    return recog
+
+boot = startup.report()
+
+try:
+    detector = None
+    if DETECT_ROI or DETECT_SCALE < 1.0:
+        if roi.available():
+            detector = roi.detector(DETECT_ROI, DETECT_SCALE, DETECT_MARGIN)
+        else:
+            log.warning("diy-lpr - PIL not installed, ignoring DETECT_ROI and DETECT_SCALE")
+
+    # loading OpenALPR takes longest, so it starts first and all the engines load at once while everything else is
+    # set up. (this is also before we start any other threads, so worker processes fork from a quiet parent)
+    log.info("diy-lpr - loading OpenALPR for {} recognizers".format(RECOGNIZER_THREADS))
+    engines = [alprengine.create(RECOGNIZER_BACKEND, DEFAULT_REGION, name = "recog-{}".format(x), detector = detector) for x in range(RECOGNIZER_THREADS)]
+    boot.lap("start loading OpenALPR")
+
+    # captures held in memory are limited separately -- they cost RAM rather than disk
+    max_files = MAX_MEMORY_FRAMES if CAPTURE_MODE == camcap.CAPTURE_TO_MEMORY else MAX_FILES
+
+    (gps, cams), (capture_meta, work_queue), hotlist, (storage_manager, archive_writer) = startup.parallel([
+        ("cameras", setup_cameras),
+        ("capture queue", setup_capture_queue),
+        ("watchlist", setup_watchlist),
+        ("storage", setup_storage)
+    ], boot)
+    boot.lap("parallel setup")
+    boot.watch_gps(gps)
+    for cam in cams:
+        cam.storage = storage_manager
+
+    output = outwriter.outwriter(output_csv_file = OUTPUT_CSV, output_json_dir = OUTPUT_JSON, output_jsonl_file = OUTPUT_JSONL, output_sqlite_file = OUTPUT_SQLITE)
+    output.batch_size = OUTPUT_BATCH_SIZE
+    output.flush_secs = OUTPUT_FLUSH_SECS
+    output.fsync = OUTPUT_FSYNC
+    output.gps_source = gps
+    output.json_layout = POSTPROC_LAYOUT
+    if DEDUP_WINDOW_SECS:
+        output.dedup = dedup.dedup()
+        output.dedup.window_secs = DEDUP_WINDOW_SECS
+        output.dedup.max_distance_m = DEDUP_MAX_DISTANCE_M
+        output.dedup.max_edit_distance = DEDUP_MAX_EDIT_DISTANCE
+
+    rate_control = None
+    if TARGET_LATENCY_SECS:
+        rate_control = ratectl.ratectl()
+        rate_control.target_latency_secs = TARGET_LATENCY_SECS
+        rate_control.sources = len(cams)
+        for cam in cams:
+            cam.rate_control = rate_control
+
+    frame_filter = None
+    if SKIP_UNCHANGED_FRAMES:
+        frame_filter = framefilter.framefilter()
+        frame_filter.min_change = FRAME_MIN_CHANGE
+        frame_filter.max_speed = FRAME_SKIP_MAX_SPEED
+        frame_filter.max_skip_secs = FRAME_SKIP_MAX_SECS
+
+    if RAW_LOG:
+        raw_log = rawlog.rawlog(RAW_LOG)
+
+    log.info("diy-lpr - setting up {} recognizer objects".format(RECOGNIZER_THREADS))
     for x in range(RECOGNIZER_THREADS):
-        recog = recognizer.recognizer (
-            source_dir = CAPTURE_DIR,
-            postproc_hit_dir = POSTPROC_HIT_DIR,
-            postproc_nohit_lowconf_dir = POSTPROC_LOWCONF_DIR,
-            postproc_nohit_dir = POSTPROC_NOHIT_DIR,
-            output_json_dir= OUTPUT_JSON,
-            output_csv_file = OUTPUT_CSV,
-            default_region=DEFAULT_REGION,
-            lock = lock
-        )
+        recogs.append(create_recognizer(x, engines[x]))
+
+    log.info("diy-lpr - done setting up recognizers")
+    boot.lap("output and recognizers")
+
+    if METRICS_PORT:
+        metrics_server = metrics.server(METRICS_PORT)
+        metrics_server.start()
+
+    if METRICS_SNAPSHOT_FILE:
+        metrics_snapshot = metrics.snapshotwriter(METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_SECS)
+        metrics_snapshot.start()
 
-        recog.min_conf_patternmatch = MIN_CONF_PATTERNMATCH
-        recog.min_conf_nopatternmatch = MIN_CONF_NOPATTERNMATCH
-        
-        recogs.append(recog)
+    log.info("diy-lpr - starting camcap auto capture")
+    for cam in cams:
+        cam.start_auto_capture(target_dir = CAPTURE_DIR, sleep_secs = .01, max_files = max_files, ctl_file = CAPTURE_CTL_FILE, work_queue = work_queue, capture_meta = capture_meta)
 
-    print "diy-lpr - done setting up recognizers"
+    log.info("diy-lpr - starting output writer")
+    output.start()
 
+    if (hotlist):
+        hotlist.start()
 
-    print "diy-lpr - starting camcap auto capture"
-    cam.start_auto_capture(target_dir = CAPTURE_DIR, sleep_secs = .01, max_files = MAX_FILES, ctl_file = CAPTURE_CTL_FILE)
+    storage_manager.start()
 
-    print "diy-lpr - starting {} recognizer threads".format(len(recogs))
+    # no need to stagger them -- they take frames off the work queue (or claim files) as they come, and each one
+    # starts taking frames as soon as its OpenALPR has loaded
+    log.info("diy-lpr - starting {} recognizer threads".format(len(recogs)))
     for recog in recogs:
         recog.start()
-        time.sleep(random.random() * 5) # sleep a bit so the threads are offset from each other
+    boot.lap("start threads")
 
-    # loop forever while th threads do their thing
-    while True:
-        sys.stdout.flush()
-        time.sleep (0.1)
+    # loop forever while the threads do their thing. a recognizer only stops on its own if something went wrong outside
+    # of any one frame (e.g. it couldn't load OpenALPR) -- it's replaced with a new one, which loads OpenALPR afresh. the
+    # output writer keeps going through failed writes, so if it stops, nothing more would be written -- shut down
+    restart_after = [0.0] * len(recogs)
+    while output.is_alive():
+        for x, recog in enumerate(recogs):
+            if recog.is_alive() or time.time() < restart_after[x]:
+                continue
+            log.error("diy-lpr - recognizer {} has stopped, starting a new one".format(recog.name))
+            recog.stop()
+            recogs[x] = create_recognizer(x)
+            recogs[x].start()
+            restart_after[x] = time.time() + RECOGNIZER_RESTART_SECS
+        time.sleep (1.0)
+    log.error("diy-lpr - the output writer has stopped, shutting down")
 
 except KeyError:
 	pass
 except (KeyboardInterrupt, SystemExit):
 	pass
 except:
-    traceback.print_exc()
-    pass
+    log.exception("diy-lpr - unexpected error")
 
-print "diy-lpr stopping"
-cam.stop()
+log.info("diy-lpr stopping")
+for cam in cams:
+    cam.stop()
+if (gps):
+    gps.stop()
 for recog in recogs:
     recog.stop()
+if (output):
+    output.stop()
+if (archive_writer):
+    archive_writer.close()
+if (hotlist):
+    hotlist.stop()
+if (raw_log):
+    raw_log.close()
+if (storage_manager):
+    storage_manager.stop()
+if (metrics_snapshot):
+    metrics_snapshot.stop()
+if (metrics_server):
+    metrics_server.stop()
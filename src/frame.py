@@ -0,0 +1,42 @@
+### frame - a captured image on its way from camcap to a recognizer
+
+# capture time (seconds since the epoch) from a capture file name, or None if it doesn't have one
+def name_time(name):
+    try:
+        return int(name.split('-')[0]) / 1000.0
+    except ValueError:
+        return None
+
+# the name of the capture source (camera) a capture file came from, or None if it came from an unnamed one. names
+# are "<capture time in ms>-<pid>[-<source>].jpg"
+def name_source(name):
+    parts = name.rsplit('.', 1)[0].split('-', 2)
+    return parts[2] if len(parts) > 2 else None
+
+class frame (object):
+
+    # name - file name of the capture (e.g. "1489012345678-1234.jpg"), also used when it's written out
+    # data - JPEG bytes for a frame captured to memory. None if the frame is a file in the capture directory
+    # meta - capture metadata recorded by camcap, or None if unknown. a dict with:
+    #        capture_epoch_time - when the frame was captured (seconds since the epoch)
+    #        latitude, longitude - decimal degrees
+    #        altitude - meters (or None)
+    #        speed - meters/second (or None)
+    def __init__(self, name, data = None, meta = None):
+        self.name = name
+        self.data = data
+        self.meta = meta
+        self.source = name_source(name) # which camera it came from (None if unnamed)
+        self.expired = False # set by the work queue if the frame waited past its deadline
+
+    def in_memory(self):
+        return self.data is not None
+
+    # when the frame was captured (seconds since the epoch). falls back on the capture time in the file name
+    def capture_time(self):
+        if self.meta and self.meta.get('capture_epoch_time'):
+            return self.meta['capture_epoch_time']
+        return name_time(self.name)
+
+    def __repr__(self):
+        return "frame({}{})".format(self.name, ", {} bytes".format(len(self.data)) if self.in_memory() else "")
@@ -0,0 +1,76 @@
+### framefilter - skips recognition of frames that barely differ from the last frame recognized from the same camera
+### (e.g. stopped at a light)
+import io
+import time
+import threading
+import logging
+
+log = logging.getLogger("framefilter")
+
+# numpy and PIL are optional -- without them, every frame gets recognized
+try:
+    import numpy
+    from PIL import Image
+except ImportError:
+    numpy = None
+    Image = None
+
+class framefilter (object):
+    thumb_size = (64, 48) # frames are compared as greyscale thumbnails of this size
+    min_change = 4.0 # mean per-pixel difference (0-255) a frame needs from the last recognized frame to be recognized
+    max_speed = 1.0 # only skip frames when GPS speed (m/s) is at most this. None to ignore speed
+    max_skip_secs = 10.0 # recognize at least one frame this often, even if nothing seems to change
+
+    def __init__(self):
+        if not(self.available()):
+            log.warning("framefilter:init - numpy and/or PIL not installed, frames will not be filtered")
+
+        self.lock = threading.Lock()
+        self.last_thumb = {} # capture source (see frame.source) -> thumbnail of the last frame recognized from it
+        self.last_time = {} # capture source -> when that frame was recognized
+        self.skipped = 0
+
+    def available(self):
+        return numpy is not None
+
+    # small greyscale version of a frame as a numpy array. JPEG draft mode lets PIL decode at 1/8 scale, which is much
+    # cheaper than decoding the full frame
+    def thumbnail(self, frm, file):
+        img = Image.open(io.BytesIO(frm.data) if frm.in_memory() else file)
+        img.draft('L', (self.thumb_size[0] * 2, self.thumb_size[1] * 2))
+        img = img.convert('L').resize(self.thumb_size)
+        return numpy.asarray(img, dtype = numpy.float32)
+
+    # should this frame (a frame.frame, with file being where it is on disk) be recognized? returns (recognize, change)
+    # where change is how different it was from the last recognized frame from the same source (None if it wasn't
+    # compared)
+    def check(self, frm, file = None):
+        if not(self.available()):
+            return True, None
+
+        # moving, so the scene is changing anyway -- don't bother comparing. the next stop starts a new comparison
+        speed = frm.meta.get('speed') if frm.meta else None
+        if self.max_speed is not None and speed is not None and speed > self.max_speed:
+            with self.lock:
+                self.last_thumb.pop(frm.source, None)
+            return True, None
+
+        try:
+            thumb = self.thumbnail(frm, file)
+        except (IOError, ValueError) as e:
+            log.warning("framefilter:check - could not read {}: {}".format(frm.name, e))
+            return True, None
+
+        with self.lock:
+            now = time.time()
+            change = None
+            last_thumb = self.last_thumb.get(frm.source)
+            if last_thumb is not None and last_thumb.shape == thumb.shape:
+                change = float(numpy.mean(numpy.abs(thumb - last_thumb)))
+                if change < self.min_change and now - self.last_time[frm.source] < self.max_skip_secs:
+                    self.skipped += 1
+                    return False, change
+
+            self.last_thumb[frm.source] = thumb
+            self.last_time[frm.source] = now
+            return True, change
@@ -0,0 +1,118 @@
+### framesource - where camcap's frames come from when capturing continuously: the camera's video port, or a stand-in
+### (a directory of JPEGs, or synthetic frames) for testing without a camera
+###
+### a frame source has frames(), a generator of JPEG bytes -- each frame is captured when the generator is advanced, so
+### the caller sets the pace -- and close()
+import io
+import os
+import time
+import logging
+
+import layout
+
+# PIL is optional -- only the synthetic source needs it
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+    ImageDraw = None
+
+log = logging.getLogger("framesource")
+
+# waits out whatever is left of the frame interval at fps since the last frame
+class _pacer (object):
+    def __init__(self, fps):
+        self.interval_secs = 1.0 / fps if fps else 0.0
+        self.last = 0.0
+
+    def wait(self):
+        if self.interval_secs:
+            wait_secs = self.interval_secs - (time.time() - self.last)
+            if wait_secs > 0:
+                time.sleep(wait_secs)
+        self.last = time.time()
+
+# frames from a picamera.PiCamera via capture_continuous, which keeps the encoder set up between frames instead of
+# paying the setup cost of a still capture for each one
+class picamerasource (object):
+
+    # use_video_port - capture from the video port (fast, and the camera doesn't change modes between frames) rather
+    #                  than the still port (slower, but higher quality)
+    def __init__(self, camera, use_video_port = True, quality = 85):
+        self.camera = camera
+        self.use_video_port = use_video_port
+        self.quality = quality
+        self.captures = None
+
+    def frames(self):
+        stream = io.BytesIO()
+        self.captures = self.camera.capture_continuous(stream, format = 'jpeg', use_video_port = self.use_video_port, quality = self.quality)
+        for _ in self.captures:
+            data = stream.getvalue()
+            stream.seek(0)
+            stream.truncate()
+            yield data
+
+    def close(self):
+        if (self.captures):
+            self.captures.close()
+            self.captures = None
+
+# frames read from the JPEGs in a directory and its subdirectories (oldest first), e.g. a directory of earlier captures
+class dirsource (object):
+
+    # fps - at most this many frames per second. None for as fast as they're asked for
+    # loop - start over at the first image after the last one. otherwise the source ends after the last image
+    def __init__(self, source_dir, fps = None, loop = False):
+        self.source_dir = source_dir
+        self.pacer = _pacer(fps)
+        self.loop = loop
+
+    def frames(self):
+        files = [f for f in layout.walk(self.source_dir) if f.lower().endswith(".jpg")]
+        if not(files):
+            log.warning("framesource:dirsource - no images in {}".format(self.source_dir))
+            return
+        log.info("framesource:dirsource - replaying {} images from {}".format(len(files), self.source_dir))
+
+        while True:
+            for f in files:
+                self.pacer.wait()
+                with open(os.path.join(self.source_dir, f), "rb") as image:
+                    yield image.read()
+            if not(self.loop):
+                break
+
+    def close(self):
+        pass
+
+# generated frames (a moving box and a frame counter on a plain background). needs PIL
+class syntheticsource (object):
+
+    # count - stop after this many frames. None for no limit
+    def __init__(self, resolution = (640, 480), fps = None, count = None, quality = 85):
+        if Image is None:
+            raise (TypeError('syntheticsource requires PIL'))
+        self.resolution = resolution
+        self.pacer = _pacer(fps)
+        self.count = count
+        self.quality = quality
+
+    def frames(self):
+        width, height = self.resolution
+        n = 0
+        while self.count is None or n < self.count:
+            self.pacer.wait()
+            img = Image.new('RGB', self.resolution, (96, 96, 96))
+            draw = ImageDraw.Draw(img)
+            x = (n * 8) % max(1, width - height / 4)
+            draw.rectangle((x, height / 2, x + height / 4, height / 2 + height / 8), fill = (240, 240, 240))
+            draw.text((10, 10), "frame {}".format(n), fill = (0, 0, 0))
+
+            out = io.BytesIO()
+            img.save(out, 'JPEG', quality = self.quality)
+            yield out.getvalue()
+            n += 1
+
+    def close(self):
+        pass
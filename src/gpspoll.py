@@ -1,11 +1,78 @@
-import gps
+import os
 import threading
 import time
-import sys
 import math
+import json
+import bisect
+import calendar
+import collections
 import dateutil.parser
 import datetime
 from datetime import timedelta, tzinfo
+import logging
+
+# ctypes is only needed for a monotonic clock on python 2
+try:
+	import ctypes
+	import ctypes.util
+except ImportError:
+	ctypes = None
+
+# the gpsd client is only needed for live GPS -- replay works without it
+try:
+	import gps
+except ImportError:
+	gps = None
+
+import metrics
+
+log = logging.getLogger("gpspoll")
+
+FIXES = metrics.get_counter("gps_fixes_total", "GPS fixes received")
+
+# monotonic clock for fix ages, so setting the system clock (e.g. from the GPS itself, or NTP once we're online)
+# can't make fixes look older or newer than they are. python 2 has no time.monotonic, so go to clock_gettime directly,
+# or failing that the elapsed time from os.times() (coarser, but still monotonic). returns None if clock_gettime
+# can't be found
+def _clock_gettime_monotonic():
+	CLOCK_MONOTONIC = 1 # from <time.h> on Linux
+
+	class timespec (ctypes.Structure):
+		_fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+	try:
+		clock_gettime = ctypes.CDLL(ctypes.util.find_library('rt') or ctypes.util.find_library('c'), use_errno = True).clock_gettime
+	except (AttributeError, OSError, TypeError):
+		return None
+	clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+	def monotonic():
+		t = timespec()
+		if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+			errno = ctypes.get_errno()
+			raise OSError(errno, os.strerror(errno))
+		return t.tv_sec + t.tv_nsec * 1e-9
+	return monotonic
+
+if hasattr(time, 'monotonic'):
+	_monotonic = time.monotonic
+else:
+	_monotonic = (ctypes and _clock_gettime_monotonic()) or (lambda: os.times()[4])
+
+MPS_PER_KNOT = 0.514444
+EARTH_RADIUS_M = 6371000.0
+
+HISTORY_SIZE = 300 # how many recent fixes each source keeps for positions_at (5 minutes at 1Hz)
+
+# a GPS fix, as published by a gpssource. never changed once published, so readers can hold on to it
+#   latitude, longitude - decimal degrees
+#   altitude - meters (or None)
+#   speed - meters/second (or None)
+#   track - degrees clockwise from true north (or None)
+#   gps_time - time of the fix according to the GPS (seconds since the epoch, or None)
+#   received - when we received the fix, on the _monotonic clock
+#   received_time - when we received the fix (seconds since the epoch)
+fix = collections.namedtuple('fix', ['latitude', 'longitude', 'altitude', 'speed', 'track', 'gps_time', 'received', 'received_time'])
 
 ZERO = timedelta(0)
 
@@ -24,6 +91,12 @@ class UTC(tzinfo):
 
 utc = UTC()
 
+EPOCH = datetime.datetime(1970,1,1,0,0,0,0, utc)
+
+# ISO 8601 time from gpsd to seconds since the epoch
+def iso_to_epoch(s):
+	return (dateutil.parser.parse(s) - EPOCH).total_seconds()
+
 def dist_to_str (f):
 	return "{:.0f}/10".format (f * 10)
 
@@ -40,36 +113,199 @@ def deg_to_str (f):
     
 	return "{:03.0f}/1,{:02.0f}/1,{:05.0f}/1000".format(fdeg, fmin, fsec*1000)
 
-class gpspoll (threading.Thread):
+# where a fix would have put us at time t (seconds since the epoch), following its speed and track. None if t is more
+# than max_secs from when the fix was received
+def extrapolate(f, t, max_secs):
+	dt = t - f.received_time
+	if abs(dt) > max_secs:
+		return None
+	latitude, longitude = f.latitude, f.longitude
+	if f.speed and f.track is not None:
+		dist = f.speed * dt
+		track = math.radians(f.track)
+		latitude += math.degrees(dist * math.cos(track) / EARTH_RADIUS_M)
+		longitude += math.degrees(dist * math.sin(track) / (EARTH_RADIUS_M * math.cos(math.radians(f.latitude))))
+	return f._replace(latitude = latitude, longitude = longitude, gps_time = f.gps_time + dt if f.gps_time is not None else None,
+		received = f.received + dt, received_time = t)
+
+def _lerp(a, b, w):
+	if a is None or b is None:
+		return a if b is None else b
+	return a + (b - a) * w
+
+# position at time t (seconds since the epoch) from fixes sorted by received_time, with received_times their receive
+# times. interpolated between the fixes either side of t, or extrapolated from the nearest fix if t is outside them (or
+# they're too far apart to interpolate between). None if t is more than max_extrapolate_secs from any fix
+def interpolate(fixes, received_times, t, max_extrapolate_secs):
+	if not(fixes):
+		return None
+
+	i = bisect.bisect_left(received_times, t)
+	if 0 < i < len(fixes):
+		a, b = fixes[i - 1], fixes[i]
+		span = b.received_time - a.received_time
+		if span <= 2 * max_extrapolate_secs:
+			w = (t - a.received_time) / span if span > 0 else 0.0
+			track = None
+			if a.track is not None and b.track is not None:
+				track = (a.track + (((b.track - a.track + 180) % 360) - 180) * w) % 360 # the short way round
+			return fix(
+				latitude = _lerp(a.latitude, b.latitude, w),
+				longitude = _lerp(a.longitude, b.longitude, w),
+				altitude = _lerp(a.altitude, b.altitude, w),
+				speed = _lerp(a.speed, b.speed, w),
+				track = track if track is not None else (a.track if b.track is None else b.track),
+				gps_time = _lerp(a.gps_time, b.gps_time, w),
+				received = _lerp(a.received, b.received, w),
+				received_time = t
+			)
+		nearest = a if t - a.received_time < b.received_time - t else b
+	else:
+		nearest = fixes[0] if i == 0 else fixes[-1]
+
+	return extrapolate(nearest, t, max_extrapolate_secs)
+
+# base class for where fixes come from. the source thread publishes each new fix as an immutable snapshot in
+# self.latest, so readers get a consistent fix with a plain attribute read, and calls each listener with it
+class gpssource (threading.Thread):
 	def __init__(self):
 		threading.Thread.__init__(self)
-		print "gpspoll:init - starting"
-		self.session = gps.gps("localhost", "2947")
-		self.session.stream(gps.WATCH_ENABLE | gps.WATCH_NEWSTYLE)
+		self.daemon = True
+		self.latest = None
+		self.history = collections.deque(maxlen = HISTORY_SIZE) # recent fixes, oldest first
+		self.listeners = []
 		self.running = True
-		print "gpspoll:init - done"
+		metrics.get_gauge("gps_fix_age_seconds", "Age of the latest GPS fix", fn = self.age)
 
-	def run(self):
-		while(self.running):
-			sys.stdout.flush()
-			self.session.next()
+	# fn(fix) is called (on the source thread) for every new fix. keep it quick
+	def add_listener(self, fn):
+		self.listeners.append(fn)
+
+	def publish(self, f):
+		self.history.append(f)
+		self.latest = f
+		FIXES.inc()
+		for fn in self.listeners:
+			try:
+				fn(f)
+			except Exception:
+				log.exception("gpspoll:publish - listener failed")
 
 	def stop(self):
-		print "gpspoll:stop - waiting for polling thread to finish"
+		log.info("gpspoll:stop - waiting for polling thread to finish")
 		self.running = False
 		self.join()
-		print "gpspoll:stop - polling thread finished"
+		log.info("gpspoll:stop - polling thread finished")
+
+	# seconds since the latest fix was received, or None if we haven't had one
+	def age(self):
+		latest = self.latest
+		if latest is None:
+			return None
+		return _monotonic() - latest.received
 
+	# the latest fix, or None if there isn't one (or it's more than max_age seconds old)
 	def get(self, max_age = None):
-		if not(self.session.utc):
-			print "gpspoll:get - no gps"
+		latest = self.latest
+		if latest is None:
+			log.warning("gpspoll:get - no gps")
 			return None
 	
 		if max_age:
-			age = time.time() - (dateutil.parser.parse(self.session.utc) - datetime.datetime(1970,1,1,0,0,0,0, UTC())).total_seconds()
+			age = _monotonic() - latest.received
 			if (max_age < age):
-				print "gpspoll:get - gps too old ({:.2f}s old)".format(age)
+				log.warning("gpspoll:get - gps too old ({:.2f}s old)".format(age))
 				return None
 		
-		#print "gpspoll:get - gps ok ({:.2f}s old)".format(time.time() - (dateutil.parser.parse(self.session.utc) - datetime.datetime(1970,1,1,0,0,0,0, UTC())).total_seconds())
-		return self.session.fix
+		return latest
+
+	# positions at each of the given times (seconds since the epoch), interpolated/extrapolated from the recent fixes.
+	# each is a fix, or None if there's no fix within max_extrapolate_secs of that time
+	def positions_at(self, times, max_extrapolate_secs = 10.0):
+		fixes = list(self.history)
+		received_times = [f.received_time for f in fixes]
+		return [interpolate(fixes, received_times, t, max_extrapolate_secs) for t in times]
+
+	def position_at(self, t, max_extrapolate_secs = 10.0):
+		return self.positions_at([t], max_extrapolate_secs)[0]
+
+# fixes from gpsd
+class gpspoll (gpssource):
+	def __init__(self):
+		gpssource.__init__(self)
+		log.info("gpspoll:init - starting")
+		self.session = gps.gps("localhost", "2947")
+		self.session.stream(gps.WATCH_ENABLE | gps.WATCH_NEWSTYLE)
+		log.info("gpspoll:init - done")
+
+	def run(self):
+		while(self.running):
+			report = self.session.next()
+			if report.get('class') == 'TPV' and report.get('mode', 0) >= 2 and 'lat' in report and 'lon' in report:
+				self.publish(fix(
+					latitude = report['lat'],
+					longitude = report['lon'],
+					altitude = report.get('alt'),
+					speed = report.get('speed'),
+					track = report.get('track'),
+					gps_time = iso_to_epoch(report['time']) if report.get('time') else None,
+					received = _monotonic(),
+					received_time = time.time()
+				))
+
+# NMEA latitude/longitude ("4807.038", "N") to decimal degrees
+def nmea_to_deg(value, hemisphere):
+	if not(value):
+		return None
+	dot = value.index('.') if '.' in value else len(value)
+	deg = float(value[:dot - 2]) + float(value[dot - 2:]) / 60
+	return -deg if hemisphere in ('S', 'W') else deg
+
+# fixes played back from a log, for testing without gpsd. the log is either gpsd JSON (e.g. from gpspipe -w, only TPV
+# reports are used) or NMEA sentences (RMC for position/speed/track, GGA for altitude). fixes are published with the
+# current time as their receive time, spaced out like the original (divided by speed). speed None plays the log back as
+# fast as it can be read. loop starts over at the end of the log
+class replay (gpssource):
+	def __init__(self, log_file, speed = 1.0, loop = False):
+		gpssource.__init__(self)
+		self.log_file = log_file
+		self.speed = speed
+		self.loop = loop
+		log.info("gpspoll:replay - replaying fixes from {}".format(log_file))
+
+	def run(self):
+		while(self.running):
+			last_gps_time = None
+			for f in self.read():
+				if not(self.running):
+					return
+				if (self.speed and last_gps_time is not None and f.gps_time is not None):
+					time.sleep(max(0.0, (f.gps_time - last_gps_time) / self.speed))
+				last_gps_time = f.gps_time
+				self.publish(f._replace(received = _monotonic(), received_time = time.time()))
+			if not(self.loop):
+				break
+
+	# the fixes in the log, with their original GPS times
+	def read(self):
+		altitude = None
+		with open(self.log_file) as lines:
+			for line in lines:
+				line = line.strip()
+				if line.startswith('{'):
+					report = json.loads(line)
+					if report.get('class') == 'TPV' and 'lat' in report and 'lon' in report:
+						yield fix(report['lat'], report['lon'], report.get('alt'), report.get('speed'), report.get('track'),
+							iso_to_epoch(report['time']) if report.get('time') else None, None, None)
+				elif line.startswith('$'):
+					fields = line.split('*')[0].split(',')
+					if fields[0].endswith('GGA') and len(fields) > 9 and fields[9]:
+						altitude = float(fields[9])
+					elif fields[0].endswith('RMC') and len(fields) > 9 and fields[2] == 'A':
+						gps_time = None
+						if fields[1] and fields[9]:
+							t = time.strptime(fields[9] + fields[1].split('.')[0], "%d%m%y%H%M%S")
+							gps_time = calendar.timegm(t) + (float('0.' + fields[1].split('.')[1]) if '.' in fields[1] else 0.0)
+						yield fix(nmea_to_deg(fields[3], fields[4]), nmea_to_deg(fields[5], fields[6]), altitude,
+							float(fields[7]) * MPS_PER_KNOT if fields[7] else None, float(fields[8]) if fields[8] else None,
+							gps_time, None, None)
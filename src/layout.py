@@ -0,0 +1,60 @@
+### layout - where images and JSON results go within an output directory: in the directory itself (flat), or
+### partitioned into subdirectories by capture time (e.g. YYYY/MM/DD/HH) so that no one directory grows huge
+import os
+import time
+import errno
+
+import frame
+
+# layouts are time.strftime patterns for the subdirectory, applied to the capture time in each file's name (local time,
+# like the times in the output). None for flat
+LAYOUT_FLAT = None
+LAYOUT_DAY = "%Y/%m/%d"
+LAYOUT_HOUR = "%Y/%m/%d/%H"
+
+_made = set() # directories we've made (or found) already, so we don't have to check again
+
+# the subdirectory name goes in under layout ("" if flat, or if there's no capture time in the name)
+def subdir(name, layout):
+    if not(layout):
+        return ""
+    t = frame.name_time(name)
+    if t is None:
+        return ""
+    return time.strftime(layout, time.localtime(t))
+
+# where name goes under layout, relative to the top of the tree
+def relpath(name, layout):
+    sub = subdir(name, layout)
+    return sub + "/" + name if sub else name
+
+# where name goes in dir under layout. its subdirectory is made if it doesn't exist yet
+def path(dir, name, layout):
+    sub = subdir(name, layout)
+    if not(sub):
+        return dir + "/" + name
+
+    sub_dir = dir + "/" + sub
+    if sub_dir not in _made:
+        try:
+            os.makedirs(sub_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST: # another thread got there first
+                raise
+        _made.add(sub_dir)
+    return sub_dir + "/" + name
+
+# where name is in dir: under layout, or in dir itself if it was written before dir was partitioned. None if neither
+def find(dir, name, layout):
+    for file in [dir + "/" + relpath(name, layout), dir + "/" + name]:
+        if os.path.exists(file):
+            return file
+    return None
+
+# the path (relative to dir) of every file under dir whatever its layout, oldest first (names start with the capture time)
+def walk(dir):
+    files = []
+    for root, subdirs, names in os.walk(dir):
+        rel = os.path.relpath(root, dir)
+        files.extend(name if rel == "." else rel + "/" + name for name in names)
+    return sorted(files, key = os.path.basename)
@@ -0,0 +1,57 @@
+### logsetup - leveled, rate-limited logging for diy-lpr
+import sys
+import time
+import logging
+import threading
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(message)s"
+
+# limits how often any one log statement can fire. once a statement has logged burst messages within
+# interval_secs, the rest are dropped until the interval is up, and the next message that gets through
+# says how many were dropped
+class ratelimit (logging.Filter):
+
+    def __init__(self, burst = 10, interval_secs = 60.0):
+        logging.Filter.__init__(self)
+        self.burst = burst
+        self.interval_secs = interval_secs
+        self.lock = threading.Lock()
+        self.sites = {} # (file, line) -> [window start, messages this window, suppressed]
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True # never drop errors
+
+        site = (record.pathname, record.lineno)
+        now = time.time()
+        with self.lock:
+            state = self.sites.get(site)
+            if state is None or now - state[0] >= self.interval_secs:
+                suppressed = state[2] if state else 0
+                state = self.sites[site] = [now, 0, 0]
+                if suppressed:
+                    record.msg = "{} ({} similar messages suppressed)".format(record.getMessage(), suppressed)
+                    record.args = None
+
+            if state[1] >= self.burst:
+                state[2] += 1
+                return False
+
+            state[1] += 1
+            return True
+
+# set up the root logger. level is a level name ("DEBUG", "INFO", ...). logs go to stdout (so the usual
+# nohup/redirect still works) and to log_file if given. burst/interval_secs set the rate limit (burst None for no limit)
+def setup(level = "INFO", log_file = None, burst = 10, interval_secs = 60.0):
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, level.upper()))
+
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+
+    for handler in handlers:
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        if burst:
+            handler.addFilter(ratelimit(burst, interval_secs))
+        root.addHandler(handler)
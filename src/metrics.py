@@ -0,0 +1,230 @@
+### metrics - counters, gauges and histograms for the whole pipeline, served over HTTP (Prometheus text format)
+### and/or written out periodically as a JSON snapshot
+import os
+import json
+import time
+import logging
+import threading
+import collections
+import BaseHTTPServer
+
+log = logging.getLogger("metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = collections.OrderedDict()
+_registry_lock = threading.Lock()
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+def _format_labels(key, extra = ()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in pairs) + "}"
+
+class counter (object):
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount = 1, **labels):
+        key = _key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def snapshot(self):
+        with self.lock:
+            return dict((_format_labels(key) or "", value) for key, value in self.values.items())
+
+class gauge (object):
+    kind = "gauge"
+
+    # fn - if given, called at collection time to get the (unlabeled) value
+    def __init__(self, name, help, fn = None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_key(labels)] = value
+
+    def samples(self):
+        with self.lock:
+            samples = [(self.name, key, value) for key, value in self.values.items()]
+        if self.fn:
+            try:
+                value = self.fn()
+            except Exception:
+                log.exception("metrics:gauge - error collecting %s", self.name)
+                value = None
+            if value is not None:
+                samples.append((self.name, (), value))
+        return samples
+
+    def snapshot(self):
+        return dict((_format_labels(key) or "", value) for name, key, value in self.samples())
+
+class histogram (object):
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.values = {} # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        with self.lock:
+            v = self.values.get(key)
+            if v is None:
+                v = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, v in self.values.items():
+                for i, bound in enumerate(self.buckets):
+                    samples.append((self.name + "_bucket", key + (("le", repr(bound)),), v[i]))
+                samples.append((self.name + "_bucket", key + (("le", "+Inf"),), v[-1]))
+                samples.append((self.name + "_sum", key, v[-2]))
+                samples.append((self.name + "_count", key, v[-1]))
+        return samples
+
+    def snapshot(self):
+        snapshot = {}
+        with self.lock:
+            for key, v in self.values.items():
+                snapshot[_format_labels(key) or ""] = {
+                    'count': v[-1],
+                    'sum': v[-2],
+                    'mean': v[-2] / v[-1] if v[-1] else 0.0,
+                    'buckets': dict((repr(bound), v[i]) for i, bound in enumerate(self.buckets))
+                }
+        return snapshot
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = _registry.get(name)
+        if metric is None:
+            metric = _registry[name] = cls(name, *args, **kwargs)
+        return metric
+
+# get (or create) a metric by name. safe to call from every instance of a component
+def get_counter(name, help):
+    return _register(counter, name, help)
+
+def get_gauge(name, help, fn = None):
+    metric = _register(gauge, name, help)
+    if fn:
+        metric.fn = fn
+    return metric
+
+def get_histogram(name, help, buckets = DEFAULT_BUCKETS):
+    return _register(histogram, name, help, buckets)
+
+# all metrics in Prometheus text exposition format
+def render_prometheus():
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry.values())
+    for metric in metrics:
+        lines.append("# HELP {} {}".format(metric.name, metric.help))
+        lines.append("# TYPE {} {}".format(metric.name, metric.kind))
+        for name, key, value in metric.samples():
+            lines.append("{}{} {}".format(name, _format_labels(key), repr(float(value))))
+    return "\n".join(lines) + "\n"
+
+# all metrics as a dict, for the JSON snapshot
+def snapshot():
+    with _registry_lock:
+        metrics = list(_registry.values())
+    return {
+        'time': time.time(),
+        'metrics': dict((metric.name, metric.snapshot()) for metric in metrics)
+    }
+
+class _handler (BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.startswith("/metrics.json"):
+            body = json.dumps(snapshot(), sort_keys = True)
+            content_type = "application/json"
+        elif self.path.startswith("/metrics") or self.path == "/":
+            body = render_prometheus()
+            content_type = "text/plain; version=0.0.4"
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # don't log every scrape
+
+# serves /metrics (Prometheus text) and /metrics.json on a local port
+class server (threading.Thread):
+
+    def __init__(self, port, host = "127.0.0.1"):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.httpd = BaseHTTPServer.HTTPServer((host, port), _handler)
+        log.info("metrics:server - serving metrics on http://%s:%d/metrics", host, port)
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+# writes a JSON snapshot of all metrics to a file every interval_secs
+class snapshotwriter (threading.Thread):
+
+    def __init__(self, snapshot_file, interval_secs = 60.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.snapshot_file = snapshot_file
+        self.interval_secs = interval_secs
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not(self.stopped.wait(self.interval_secs)):
+            self.write()
+
+    def write(self):
+        tmp_file = self.snapshot_file + ".tmp"
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(snapshot(), f, sort_keys = True)
+            os.rename(tmp_file, self.snapshot_file)
+        except (IOError, OSError):
+            log.exception("metrics:snapshotwriter - could not write %s", self.snapshot_file)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.write()
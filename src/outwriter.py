@@ -0,0 +1,261 @@
+### outwriter - writes recognizer matches to CSV / JSON / SQLite in batches from a single thread
+import os
+import time
+import csv
+import json
+import threading
+import collections
+import Queue
+import logging
+
+import resultdb
+import dedup
+import metrics
+import frame
+import layout
+
+log = logging.getLogger("outwriter")
+
+RECORDS_WRITTEN = metrics.get_counter("outwriter_images_written_total", "Images whose matches have been written out")
+FLUSH_SECONDS = metrics.get_histogram("outwriter_flush_seconds", "Time taken to write out each batch")
+FLUSH_ERRORS = metrics.get_counter("outwriter_flush_errors_total", "Batches that could not be written (and were tried again)")
+
+CSV_FIELDS = ["recognize_time", "recognize_epoch_time", "plate","confidence", "matches_template", "file", "recognize_secs", 'capture_time', 'capture_epoch_time', 'capture_latitude', 'capture_longitude', 'capture_altitude_m']
+
+FSYNC_NEVER = "never" # leave it to the OS to get data to disk
+FSYNC_BATCH = "batch" # fsync output files after every batch
+
+QUEUE_GET_TIMEOUT_SECS = 0.5 # how long to block waiting for matches before checking if a flush is due
+
+# the column names in an existing CSV file's header, or None if it's empty
+def read_csv_header(csv_file):
+    with open(csv_file, "rb") as f:
+        return next(csv.reader(f), None)
+
+# move an existing output file out of the way, to the same name with the time it was moved added (e.g.
+# output.20170308-1025.csv). returns the new name
+def rotate(output_file):
+    root, ext = os.path.splitext(output_file)
+    rotated = "{}.{}{}".format(root, time.strftime("%Y%m%d-%H%M%S"), ext)
+    os.rename(output_file, rotated)
+    return rotated
+
+# when the image a match record came from was captured: its capture_epoch_time (from the capture metadata or EXIF), or
+# failing that the time in its file name. the name has the time to the ms where the record only has whole seconds, so
+# it's used when they agree -- if they don't, the image was renamed or copied in, and the name can't be trusted
+def capture_time(match):
+    name_time = frame.name_time(match['file'])
+    try:
+        meta_time = float(match.get('capture_epoch_time') or 0)
+    except ValueError:
+        meta_time = 0
+    if not(meta_time):
+        return name_time
+    if name_time is not None and abs(name_time - meta_time) <= 1.0:
+        return name_time
+    return meta_time
+
+# group records by the image they came from, so each image's output stays together
+def group_by_file(records):
+    groups = collections.OrderedDict()
+    for record in records:
+        groups.setdefault(record['file'], []).append(record)
+    return groups.values()
+
+class outwriter (threading.Thread):
+    batch_size = 50 # flush once this many matches are waiting
+    flush_secs = 5.0 # ... or once the oldest waiting match is this many seconds old
+    fsync = FSYNC_NEVER
+    retry_secs = 5.0 # if writing a batch fails (e.g. an I/O error, or the database is locked), try it again after this long
+    dedup = None # set to a dedup.dedup to write one record per sighting instead of one per read
+    gps_source = None # set to a gpspoll.gpssource to redo capture positions from the fixes either side of each capture
+    gps_max_extrapolate_secs = 10.0
+    json_layout = layout.LAYOUT_FLAT # how the JSON files are laid out in output_json_dir (see layout)
+
+    # output_csv_file - append a row per match to this CSV file
+    # output_json_dir - write a JSON file per image with that image's matches to this directory
+    # output_jsonl_file - append a line per image with that image's matches to this JSON Lines file
+    # output_sqlite_file - insert a row per match into this SQLite database (see resultdb)
+    def __init__(self, output_csv_file = None, output_json_dir = None, output_jsonl_file = None, output_sqlite_file = None):
+        threading.Thread.__init__(self)
+
+        if not(output_csv_file) and not(output_json_dir) and not(output_jsonl_file) and not(output_sqlite_file):
+            raise (TypeError('must specify output_csv_file, output_json_dir, output_jsonl_file and/or output_sqlite_file'))
+
+        self.output_csv_file = output_csv_file
+        self.output_json_dir = output_json_dir.rstrip("/") if output_json_dir else None
+        self.output_jsonl_file = output_jsonl_file
+        self.output_sqlite_file = output_sqlite_file
+
+        self.queue = Queue.Queue()
+        self.csv_file = None
+        self.csv_writer = None
+        self.jsonl_file = None
+        self.db = None
+        self.running = True
+
+    def stop(self):
+        log.info("outwriter:stop - waiting for output thread to finish")
+        self.running = False
+        self.join()
+        log.info("outwriter:stop - output thread finished")
+
+    # queue up the matches for one image. called by the recognizers, never blocks
+    def write(self, matches):
+        self.queue.put(matches)
+
+    def run(self):
+        pending = []
+        pending_count = 0
+        oldest = None
+        retry_after = 0.0
+
+        # keep going after being stopped until everything queued has been written
+        while self.running or not(self.queue.empty()):
+            try:
+                matches = self.queue.get(timeout = QUEUE_GET_TIMEOUT_SECS)
+            except Queue.Empty:
+                matches = None
+
+            if (self.dedup):
+                # the de-duplicator compares positions, so they have to be right before it sees them
+                if matches and self.gps_source:
+                    self.locate([matches])
+
+                # reads go into the de-duplicator, and only sightings it has finished with get written
+                if matches:
+                    sightings = [s for match in matches for s in self.dedup.add(match)]
+                else:
+                    sightings = self.dedup.expire()
+                new = group_by_file(sightings)
+            else:
+                new = [matches] if matches else []
+
+            for matches in new:
+                pending.append(matches)
+                pending_count += len(matches)
+                if oldest is None:
+                    oldest = time.time()
+
+            if pending and (pending_count >= self.batch_size or time.time() - oldest >= self.flush_secs) and time.time() >= retry_after:
+                if self.try_flush(pending):
+                    pending = []
+                    pending_count = 0
+                    oldest = None
+                else:
+                    retry_after = time.time() + self.retry_secs
+
+        if (self.dedup):
+            pending.extend(group_by_file(self.dedup.close_all()))
+        if pending and not(self.try_flush(pending)):
+            log.error("outwriter:run - could not write the matches for {} images before stopping".format(len(pending)))
+        self.close()
+
+    # flush a batch, keeping the thread going if it fails -- the batch stays pending, to be tried again. the output
+    # files are closed and opened again for the retry. returns whether it was written
+    def try_flush(self, batch):
+        try:
+            self.flush(batch)
+            return True
+        except Exception:
+            log.exception("outwriter:run - could not write {} images, will try again in {:g}s".format(len(batch), self.retry_secs))
+            FLUSH_ERRORS.inc()
+            try:
+                self.close()
+            except Exception:
+                pass
+            self.csv_file = self.csv_writer = self.jsonl_file = self.db = None
+            return False
+
+    # set the capture position of each image in a batch (a list with the list of matches for each image) from the GPS
+    # fixes around its capture time. by now the fixes after the capture have usually come in, so this interpolates
+    # where camcap could only extrapolate from the last fix
+    def locate(self, batch):
+        times = [capture_time(matches[0]) for matches in batch]
+        positions = self.gps_source.positions_at([t or 0 for t in times], self.gps_max_extrapolate_secs)
+        for matches, position in zip(batch, positions):
+            if position is None:
+                continue
+            for match in matches:
+                match['capture_latitude'] = "{:0.7f}".format(position.latitude)
+                match['capture_longitude'] = "{:0.7f}".format(position.longitude)
+                match['capture_altitude_m'] = "{:0.2f}".format(position.altitude or 0)
+
+    # write a batch -- a list with the list of matches for each image
+    def flush(self, batch):
+        start_time = time.time()
+
+        if (self.gps_source and not(self.dedup)):
+            self.locate(batch)
+
+        if (self.output_csv_file):
+            if not(self.csv_file):
+                fields = CSV_FIELDS + dedup.SIGHTING_FIELDS if self.dedup else CSV_FIELDS
+
+                # an existing file written with other columns (e.g. from before dedup was turned on) is moved aside
+                # rather than appended to, so every row in a file lines up with its header
+                header = read_csv_header(self.output_csv_file) if os.access(self.output_csv_file, os.F_OK) else None
+                if header is not None and header != fields:
+                    log.warning("outwriter:flush - {} has different columns, moved it to {}".format(self.output_csv_file, rotate(self.output_csv_file)))
+                    header = None
+
+                self.csv_file = open(self.output_csv_file, "a")
+                self.csv_writer = csv.DictWriter(self.csv_file, fields, extrasaction = 'ignore')
+                if (header is None):
+                    self.csv_writer.writeheader()
+
+            for matches in batch:
+                self.csv_writer.writerows(matches)
+            self.sync(self.csv_file)
+
+        if (self.output_jsonl_file):
+            if not(self.jsonl_file):
+                self.jsonl_file = open(self.output_jsonl_file, "a")
+
+            for matches in batch:
+                self.jsonl_file.write(json.dumps(matches) + "\n")
+            self.sync(self.jsonl_file)
+
+        # the database connection has to be opened in this thread, since it's the only one that uses it
+        if (self.output_sqlite_file):
+            if not(self.db):
+                self.db = resultdb.resultdb(self.output_sqlite_file)
+
+            self.db.write_batch([match for matches in batch for match in matches])
+
+        # JSON gets one file per image
+        if (self.output_json_dir):
+            for matches in batch:
+                file = matches[0]['file']
+                json_file = layout.path(self.output_json_dir, file[:file.index(".jpg")] + ".json", self.json_layout)
+
+                # sightings that close at different times can share a best image
+                if (self.dedup and os.path.exists(json_file)):
+                    with open (json_file, "r") as jsonfile:
+                        matches = json.load(jsonfile) + matches
+
+                with open (json_file, "w") as jsonfile:
+                    jsonfile.write(json.dumps(matches))
+                    self.sync(jsonfile)
+
+        flush_secs = time.time() - start_time
+        RECORDS_WRITTEN.inc(len(batch))
+        FLUSH_SECONDS.observe(flush_secs)
+        log.debug("outwriter:flush - wrote {} images in {:.4f}s".format(len(batch), flush_secs))
+
+    def sync(self, f):
+        f.flush()
+        if self.fsync == FSYNC_BATCH:
+            os.fsync(f.fileno())
+
+    def close(self):
+        if (self.csv_file):
+            self.csv_file.close()
+            self.csv_file = None
+            self.csv_writer = None
+        if (self.jsonl_file):
+            self.jsonl_file.close()
+            self.jsonl_file = None
+        if (self.db):
+            self.db.close()
+            self.db = None
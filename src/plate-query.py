@@ -0,0 +1,72 @@
+# look up plate reads in the SQLite database written by diy-lpr (see OUTPUT_SQLITE in diy-lpr.py)
+#
+# examples:
+#   python src/plate-query.py ABC123                       # every read of ABC123, newest first
+#   python src/plate-query.py --like "ABC%" --limit 10     # plates starting with ABC
+#   python src/plate-query.py --since "2017-03-01 08:00" --until "2017-03-01 09:00"
+#   python src/plate-query.py --bbox 42.35,-71.07,42.37,-71.05
+#   python src/plate-query.py ABC123 --images work/proc-hit  # with where each image is
+
+import os
+import sys
+import csv
+import time
+import argparse
+
+import resultdb
+import layout
+
+DEFAULT_DB = os.path.dirname(os.path.realpath(__file__)) + "/../work/output/results.db"
+
+def parse_time(value):
+    try:
+        return float(value) # already epoch seconds
+    except ValueError:
+        pass
+
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+
+    raise argparse.ArgumentTypeError("can't parse time {}".format(value))
+
+def parse_bbox(value):
+    try:
+        bbox = [float(v) for v in value.split(",")]
+    except ValueError:
+        bbox = []
+    if len(bbox) != 4:
+        raise argparse.ArgumentTypeError("bbox must be MIN_LAT,MIN_LON,MAX_LAT,MAX_LON")
+    return bbox
+
+parser = argparse.ArgumentParser(description = "look up plate reads recorded by diy-lpr")
+parser.add_argument("plate", nargs = "?", help = "plate to look for")
+parser.add_argument("--db", default = DEFAULT_DB, help = "database file (default: %(default)s)")
+parser.add_argument("--like", metavar = "PATTERN", help = "SQL LIKE pattern to match plates against (e.g. 'ABC%%')")
+parser.add_argument("--since", type = parse_time, help = "only reads captured at or after this time (epoch seconds or YYYY-MM-DD[ HH:MM[:SS]])")
+parser.add_argument("--until", type = parse_time, help = "only reads captured at or before this time")
+parser.add_argument("--bbox", type = parse_bbox, help = "only reads within MIN_LAT,MIN_LON,MAX_LAT,MAX_LON")
+parser.add_argument("--limit", type = int, help = "return at most this many reads")
+parser.add_argument("--images", metavar = "DIR", help = "add the path of each read's image in DIR (e.g. POSTPROC_HIT_DIR)")
+parser.add_argument("--layout", default = layout.LAYOUT_HOUR, help = "how images are laid out in DIR, see POSTPROC_LAYOUT in diy-lpr.py (default: %(default)s)")
+args = parser.parse_args()
+
+if not(os.path.exists(args.db)):
+    print >> sys.stderr, "plate-query - no database at {}".format(args.db)
+    sys.exit(1)
+
+db = resultdb.resultdb(args.db)
+start_time = time.time()
+rows = db.query(plate = args.like or args.plate, like = bool(args.like), since = args.since, until = args.until, bbox = args.bbox, limit = args.limit)
+
+writer = csv.writer(sys.stdout)
+writer.writerow(["capture_time"] + resultdb.COLUMNS + (["image"] if args.images else []))
+for row in rows:
+    capture_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row['capture_epoch_time'])) if row['capture_epoch_time'] else ''
+    image = [layout.find(args.images.rstrip("/"), row['file'], args.layout) or ''] if args.images else []
+    writer.writerow([capture_time] + [row[column] for column in resultdb.COLUMNS] + image)
+
+print >> sys.stderr, "plate-query - {} reads in {:.3f}s".format(len(rows), time.time() - start_time)
+db.close()
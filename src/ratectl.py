@@ -0,0 +1,80 @@
+### ratectl - picks a capture interval that the recognizers can keep up with
+import time
+import threading
+import collections
+import logging
+
+import metrics
+
+log = logging.getLogger("ratectl")
+
+CAPTURE_INTERVAL = metrics.get_gauge("ratectl_capture_interval_seconds", "Capture interval chosen by rate control")
+
+class ratectl (object):
+    target_latency_secs = 10.0 # try to have every frame recognized within this long of being captured
+    min_interval_secs = 0.05 # never capture faster than this
+    max_interval_secs = 5.0 # never capture slower than this
+    initial_interval_secs = 0.5 # capture interval until we've measured how fast the recognizers are
+    window_secs = 30.0 # measure recognizer throughput over this many seconds
+    smoothing = 0.2 # weight of each new interval in the running average (keeps the rate from jumping around)
+    report_secs = 30.0 # how often to print the chosen rate
+    sources = 1 # how many capture sources (cameras) share the rate -- each one captures at its share of it
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.completions = collections.deque()
+        self.started = time.time()
+        self.interval_secs = None
+        self.last_report = 0.0
+
+    # called by the recognizers each time they finish with a frame
+    def done(self):
+        with self.lock:
+            self.completions.append(time.time())
+
+    # frames/sec the recognizers have finished over the last window_secs, or None if we don't know yet
+    def throughput(self):
+        now = time.time()
+        with self.lock:
+            while self.completions and self.completions[0] < now - self.window_secs:
+                self.completions.popleft()
+            count = len(self.completions)
+
+        elapsed = min(self.window_secs, now - self.started)
+        if count < 2 or elapsed <= 0:
+            return None
+        return count / elapsed
+
+    # seconds each capture source should wait between captures, given the number of frames waiting to be recognized.
+    # aims to keep the backlog at what the recognizers can get through in target_latency_secs: below that we capture
+    # faster than they recognize, above it slower
+    def interval(self, queue_depth):
+        throughput = self.throughput()
+        if throughput is None:
+            interval = self.initial_interval_secs
+        else:
+            allowed_backlog = throughput * self.target_latency_secs
+            rate = throughput + (allowed_backlog - queue_depth) / self.target_latency_secs
+            interval = 1.0 / rate if rate > 0 else self.max_interval_secs
+
+        interval = min(self.max_interval_secs, max(self.min_interval_secs, interval))
+
+        # every capture source calls this, each from its own thread
+        with self.lock:
+            if self.interval_secs is None:
+                self.interval_secs = interval
+            else:
+                self.interval_secs += self.smoothing * (interval - self.interval_secs)
+            interval_secs = self.interval_secs
+            CAPTURE_INTERVAL.set(interval_secs)
+
+            now = time.time()
+            report = now - self.last_report >= self.report_secs
+            if report:
+                self.last_report = now
+
+        if report:
+            log.info("ratectl:interval - capturing every {:.2f}s ({:.2f} frames/s), recognizing {} frames/s, {} frames waiting".format(
+                interval_secs, 1.0 / interval_secs, "{:.2f}".format(throughput) if throughput is not None else "?", queue_depth))
+
+        return interval_secs * self.sources
@@ -0,0 +1,204 @@
+### rawlog - compact append-only binary log of every recognition's raw OpenALPR results (all top N candidates, plate
+### coordinates, processing time), keyed by frame, so scoring can be re-run later without OCR
+import math
+import array
+import struct
+import threading
+
+# each record is MAGIC, then the length of the rest (uint32), then
+#   frame: name length (uint16) and name, start time (double), recognize secs (float), capture time, latitude,
+#          longitude, altitude (doubles, NaN if unknown), number of plates (uint16)
+#   each plate: 4 corners (x, y as int16), number of candidates (uint8)
+#   each candidate: plate length (uint8) and plate, confidence (double), matches template (uint8)
+# all little endian. a record cut short (e.g. by a power loss) is skipped when reading. the last byte of MAGIC is the
+# format version -- version 1 records (confidence as a float) are still read
+MAGIC = b'\xfaRL\x02'
+_LENGTH = struct.Struct('<I')
+_NAME = struct.Struct('<H')
+_FRAME = struct.Struct('<dfddddH')
+_PLATE = struct.Struct('<8hB')
+_CANDIDATE = struct.Struct('<dB')
+_PLATE_TEXT = struct.Struct('<B')
+
+# the candidate layout for each version. a float confidence can come back a hair either side of a threshold it was
+# scored against live, which is why version 2 stores doubles
+_CANDIDATES = {b'\x01': struct.Struct('<fB'), b'\x02': _CANDIDATE}
+
+READ_BLOCK_SIZE = 4 * 1024 * 1024
+
+NAN = float('nan')
+
+def _text(s):
+    return s.encode('utf-8') if isinstance(s, unicode) else s
+
+def _nan_to_none(v):
+    return None if math.isnan(v) else v
+
+def encode(name, start_time, recognize_secs, results, meta = None):
+    meta = meta or {}
+    name = _text(name)
+    parts = [_NAME.pack(len(name)), name, _FRAME.pack(start_time, recognize_secs,
+        *[NAN if meta.get(field) is None else meta[field] for field in ('capture_epoch_time', 'latitude', 'longitude', 'altitude')] +
+        [len(results['results'])])]
+
+    for plate in results['results']:
+        corners = []
+        for point in (plate.get('coordinates') or [])[:4]:
+            corners.extend([point['x'], point['y']])
+        corners.extend([0] * (8 - len(corners)))
+        candidates = plate['candidates'][:255]
+        parts.append(_PLATE.pack(*(corners + [len(candidates)])))
+        for candidate in candidates:
+            text = _text(candidate['plate'])[:255]
+            parts.append(_PLATE_TEXT.pack(len(text)))
+            parts.append(text)
+            parts.append(_CANDIDATE.pack(candidate['confidence'], 1 if candidate['matches_template'] else 0))
+
+    body = b''.join(parts)
+    return MAGIC + _LENGTH.pack(len(body)) + body
+
+# returns (name, start time, recognize secs, capture meta, results), with results shaped like OpenALPR's. candidate
+# is the record's candidate layout (see read_records)
+def decode(body, candidate = _CANDIDATE):
+    (name_len,) = _NAME.unpack_from(body, 0)
+    pos = _NAME.size
+    name = body[pos:pos + name_len]
+    pos += name_len
+    start_time, recognize_secs, capture_time, latitude, longitude, altitude, plate_count = _FRAME.unpack_from(body, pos)
+    pos += _FRAME.size
+
+    plates = []
+    for p in range(plate_count):
+        values = _PLATE.unpack_from(body, pos)
+        pos += _PLATE.size
+        candidates = []
+        for c in range(values[8]):
+            (text_len,) = _PLATE_TEXT.unpack_from(body, pos)
+            pos += _PLATE_TEXT.size
+            text = body[pos:pos + text_len]
+            pos += text_len
+            confidence, matches_template = candidate.unpack_from(body, pos)
+            pos += candidate.size
+            candidates.append({'plate': text, 'confidence': confidence, 'matches_template': matches_template})
+        plates.append({
+            'coordinates': [{'x': values[i], 'y': values[i + 1]} for i in range(0, 8, 2)],
+            'candidates': candidates
+        })
+
+    meta = {
+        'capture_epoch_time': _nan_to_none(capture_time),
+        'latitude': _nan_to_none(latitude),
+        'longitude': _nan_to_none(longitude),
+        'altitude': _nan_to_none(altitude),
+        'speed': None
+    }
+    return name, start_time, recognize_secs, meta, {'results': plates}
+
+# (body, candidate layout) for every complete record in log_file, in order
+def read_records(log_file):
+    prefix = MAGIC[:-1] # any version
+    header_size = len(MAGIC) + _LENGTH.size
+    with open(log_file, 'rb') as f:
+        buf, pos = b'', 0
+        while True:
+            avail = len(buf) - pos
+            need = header_size
+            if avail >= header_size:
+                candidate = _CANDIDATES.get(buf[pos + len(prefix):pos + len(MAGIC)]) if buf.startswith(prefix, pos) else None
+                if candidate is not None:
+                    (length,) = _LENGTH.unpack_from(buf, pos + len(MAGIC))
+                    need = header_size + length
+                    if avail >= need:
+                        yield buf[pos + header_size:pos + need], candidate
+                        pos += need
+                        continue
+                else:
+                    # damaged -- skip ahead to the next record
+                    next_pos = buf.find(prefix, pos + 1)
+                    pos = next_pos if next_pos >= 0 else len(buf) - (len(MAGIC) - 1)
+                    continue
+
+            # need more of the file
+            block = f.read(max(READ_BLOCK_SIZE, need - avail))
+            if not(block):
+                return # anything left is a record cut short
+            buf, pos = buf[pos:] + block, 0
+
+# (name, start time, recognize secs, capture meta, results) for every record in log_file
+def read(log_file):
+    for body, candidate in read_records(log_file):
+        try:
+            yield decode(body, candidate)
+        except struct.error:
+            pass # damaged record
+
+# the whole log as columns, for scoring.score_columns. returns a dict of:
+#   names, start_times, recognize_secs, capture_times, latitudes, longitudes, altitudes - per frame
+#   plate_frames - frame index of each plate
+#   plate_first, plate_counts - index of each plate's first candidate and how many it has
+#   texts, confidences, matches_templates - per candidate
+def read_columns(log_file):
+    cols = {
+        'names': [], 'start_times': array.array('d'), 'recognize_secs': array.array('f'),
+        'capture_times': array.array('d'), 'latitudes': array.array('d'), 'longitudes': array.array('d'), 'altitudes': array.array('d'),
+        'plate_frames': array.array('l'), 'plate_first': array.array('l'), 'plate_counts': array.array('l'),
+        'texts': [], 'confidences': array.array('d'), 'matches_templates': array.array('B')
+    }
+    for body, candidate in read_records(log_file):
+        try:
+            (name_len,) = _NAME.unpack_from(body, 0)
+            pos = _NAME.size + name_len
+            frame_values = _FRAME.unpack_from(body, pos)
+            pos += _FRAME.size
+            plates = []
+            for p in range(frame_values[6]):
+                candidate_count = _PLATE.unpack_from(body, pos)[8]
+                pos += _PLATE.size
+                candidates = []
+                for c in range(candidate_count):
+                    (text_len,) = _PLATE_TEXT.unpack_from(body, pos)
+                    pos += _PLATE_TEXT.size
+                    text = body[pos:pos + text_len]
+                    pos += text_len
+                    candidates.append((text,) + candidate.unpack_from(body, pos))
+                    pos += candidate.size
+                plates.append(candidates)
+        except struct.error:
+            continue # damaged record
+
+        frame = len(cols['names'])
+        cols['names'].append(body[_NAME.size:_NAME.size + name_len])
+        for key, value in zip(['start_times', 'recognize_secs', 'capture_times', 'latitudes', 'longitudes', 'altitudes'], frame_values):
+            cols[key].append(value)
+        for candidates in plates:
+            cols['plate_frames'].append(frame)
+            cols['plate_first'].append(len(cols['texts']))
+            cols['plate_counts'].append(len(candidates))
+            for text, confidence, matches_template in candidates:
+                cols['texts'].append(text)
+                cols['confidences'].append(confidence)
+                cols['matches_templates'].append(matches_template)
+    return cols
+
+# appends records to log_file. shared by all the recognizers
+class rawlog (object):
+
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.lock = threading.Lock()
+        self.file = open(log_file, 'ab')
+
+    # each record is flushed as it's written -- the Pi is usually shut down by cutting the power
+    def append(self, name, start_time, recognize_secs, results, meta = None):
+        data = encode(name, start_time, recognize_secs, results, meta)
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
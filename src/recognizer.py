@@ -1,46 +1,247 @@
-import sys
+import io
 import os
+import errno
 import threading
-import re
 import time
-import csv
-import json
+import collections
+import logging
+
+import workqueue
+import alprengine
+import frame
+import metrics
+import scoring
+import layout
+
+log = logging.getLogger("recognizer")
+
+FRAMES = metrics.get_counter("recognizer_frames_total", "Frames handled, by worker, outcome and (for named sources) capture source")
+STAGE_SECONDS = metrics.get_histogram("recognizer_stage_seconds", "Time spent in each processing stage, by worker and stage")
+FRAME_SECONDS = metrics.get_histogram("recognizer_frame_seconds", "Time taken to process each frame, by worker")
+CAPTURE_LATENCY_SECONDS = metrics.get_histogram("recognizer_capture_latency_seconds", "Time from capture until a frame has been recognized, by capture source (for named sources)",
+    buckets = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0))
+
+OUTCOME_HIT = "hit"
+OUTCOME_LOWCONF = "lowconf"
+OUTCOME_NOHIT = "nohit"
+OUTCOME_SKIPPED = "skipped" # unchanged since the last frame recognized
+OUTCOME_EXPIRED = "expired" # waited past its deadline
+OUTCOME_FAILED = "failed" # processing raised (e.g. a corrupt image) -- the image is set aside, see set_aside
+
+QUEUE_GET_TIMEOUT_SECS = 0.5 # how long to block on the work queue before checking if we've been stopped
+POLL_SLEEP_SECS = 0.05 # how long to sleep between directory scans when there is no work queue
+
+# move any files left in recognizer processing directories (e.g. after a crash or power loss) back into
+# source_dir so they get recognized again. call this before any recognizers start. returns the list of files moved
+def recover_processing(processing_dir, source_dir):
+    recovered = []
+    if not(os.path.isdir(processing_dir)):
+        return recovered
+
+    for worker_dir in sorted(os.listdir(processing_dir)):
+        worker_dir = processing_dir.rstrip("/") + "/" + worker_dir
+        if not(os.path.isdir(worker_dir)):
+            continue
+
+        for file in os.listdir(worker_dir):
+            if not(workqueue.CAPTURE_FILE_RE.match(file)):
+                continue
+            os.rename(worker_dir + "/" + file, source_dir.rstrip("/") + "/" + file)
+            recovered.append(file)
+
+    if recovered:
+        log.info("recognizer:recover_processing - moved {} orphaned files from {} back to {}".format(len(recovered), processing_dir, source_dir))
+    return recovered
+
+# read the capture time, GPS coordinates and altitude that camcap wrote into a JPEG's EXIF tags. file is a path or
+# an open file. returns a capture metadata dict (see frame.frame), with anything missing set to None
+def read_exif_meta(file):
+    meta = {'capture_epoch_time': None, 'latitude': None, 'longitude': None, 'altitude': None, 'speed': None}
+
+    import exifread
+
+    if hasattr(file, 'read'):
+        tags = exifread.process_file(file, details=False)
+    else:
+        with open(file, 'rb') as jpgfile:
+            tags = exifread.process_file(jpgfile, details=False)
+
+    # extract the image capture date and time
+    tag_datetime = tags.get('EXIF DateTimeOriginal')
+    if (tag_datetime):
+        meta['capture_epoch_time'] = time.mktime(time.strptime("{}".format(tag_datetime), '%Y:%m:%d %H:%M:%S'))
+
+    # extract the GPS coordinates (convert from DMS to DD) and altitude
+    tag_lat = tags.get('GPS GPSLatitude')
+    if (tag_lat and len(tag_lat.values) == 3 and tag_lat.values[0].den > 0):
+        meta['latitude'] = (float(tag_lat.values[0].num) / float(tag_lat.values[0].den)) + ((float(tag_lat.values[1].num) / float(tag_lat.values[1].den))/60.0) + ((float(tag_lat.values[2].num) / float(tag_lat.values[2].den))/3600.0)
+        meta['latitude'] *= -1 if (str(tags.get('GPS GPSLatitudeRef')) == "S") else 1
+
+    tag_lon = tags.get('GPS GPSLongitude')
+    if (tag_lon and len(tag_lon.values) == 3 and tag_lon.values[0].den > 0):
+        meta['longitude'] = (float(tag_lon.values[0].num) / float(tag_lon.values[0].den)) + ((float(tag_lon.values[1].num) / float(tag_lon.values[1].den))/60.0) + ((float(tag_lon.values[2].num) / float(tag_lon.values[2].den))/3600.0)
+        meta['longitude'] *= -1 if (str(tags.get('GPS GPSLongitudeRef')) == "W") else 1
+
+    tag_altitude = tags.get('GPS GPSAltitude')
+    if (tag_altitude and tag_altitude.values[0].den > 0):
+        meta['altitude'] = float(tag_altitude.values[0].num) / float(tag_altitude.values[0].den)
+
+    return meta
+
+# the match record (see outwriter.CSV_FIELDS) for the best candidate for a plate found in file
+def match_record(file, plate, best, start_time, recognize_secs):
+    return {
+        'recognize_time': time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time)),
+        'recognize_epoch_time': "{:.0f}".format(start_time),
+        'recognize_secs': "{:0.4f}".format(recognize_secs),
+        'plate': best['plate'],
+        'confidence': "{:0.2f}".format(best['confidence']),
+        'matches_template': bool(best['matches_template']),
+        'file': file,
+        'candidates': [candidate['plate'] for candidate in plate['candidates']]
+    }
+
+# store capture data (see frame.frame) in match records
+def add_capture_meta(matches, meta):
+    for match in (matches):
+        if(meta['capture_epoch_time']):
+            match['capture_epoch_time'] = '{:.0f}'.format(meta['capture_epoch_time'])
+            match['capture_time'] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(meta['capture_epoch_time']))
+        else:
+            match['capture_epoch_time'] = 0
+            match['capture_time'] = ''
+        
+        match['capture_longitude'] = "{:0.7f}".format(meta['longitude'] or 0.0)
+        match['capture_latitude'] = "{:0.7f}".format(meta['latitude'] or 0.0)
+        match['capture_altitude_m'] = "{:0.2f}".format(meta['altitude'] or 0)
+
+# how long each stage of processing a frame took (claim, filter, ocr, scoring, meta, output, finish)
+class stagetimer (object):
+
+    def __init__(self):
+        self.stages = collections.OrderedDict()
+        self.start = self.last = time.time()
 
-import exifread
-from openalpr import Alpr
+    # charge the time since the last lap to stage
+    def lap(self, stage):
+        now = time.time()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - self.last
+        self.last = now
 
-STALE_LOCK_AGE = 120 # ignore/remove locks older than this many seconds
+    def total(self):
+        return self.last - self.start
 
 class recognizer (threading.Thread):
     
     min_conf_patternmatch = 75.0
     min_conf_nopatternmatch = 85.0
 
-    lock = None
+    output = None
+    work_queue = None
+    capture_meta = None
+    frame_filter = None
+    rate_control = None
+    postproc_layout = layout.LAYOUT_FLAT # how images are laid out in the post-processing directories (see layout)
+    on_frame = None # if set, called as on_frame(frame, outcome, timer) after each frame, with outcome one of the OUTCOME_ values
+    on_ready = None # if set, called as on_ready(recognizer) once OpenALPR has loaded and we start taking frames
 
     def __init__ (self, 
         source_dir, 
+        processing_dir,
         postproc_hit_dir, 
         postproc_nohit_dir, 
         postproc_nohit_lowconf_dir = None, 
-        output_json_dir=None, 
-        output_csv_file=None, 
+        output = None,
         default_region=None,
-        lock = None):
+        work_queue = None,
+        backend = alprengine.BACKEND_THREAD,
+        capture_meta = None,
+        frame_filter = None,
+        rate_control = None,
+        detector = None,
+        watchlist = None,
+        raw_log = None,
+        storage = None,
+        archive = None,
+        engine = None):
 
         threading.Thread.__init__(self)
 
-        ## save the lock (if specified)
-        ## passing in a lock object allows 
-        ## multiple recognizer threads to run 
-        ## without bumping into each other
+        ## save the output writer
+        ## all recognizers hand their matches to
+        ## one outwriter, so they never wait on
+        ## each other to write output
+
+        self.output = output
+
+        ## save the work queue (if specified)
+        ## when there is a work queue, camcap hands
+        ## us each capture as it's finished. otherwise
+        ## we poll source_dir for new files
+
+        self.work_queue = work_queue
+
+        ## save the capture metadata log (if specified)
+        ## so capture time and location can be looked
+        ## up for files without parsing EXIF
+
+        self.capture_meta = capture_meta
+
+        ## save the frame filter (if specified)
+        ## shared by all recognizers so frames are
+        ## compared to the last one any of them recognized
+
+        self.frame_filter = frame_filter
+
+        ## save the capture rate controller (if specified)
+        ## we tell it each time we finish a frame, so
+        ## camcap can capture only as fast as we recognize
+
+        self.rate_control = rate_control
+
+        ## save the watchlist (if specified)
+        ## every candidate for every plate is checked
+        ## against it, whatever its confidence
+
+        self.watchlist = watchlist
 
-        self.lock = lock
+        ## save the raw results log (if specified)
+        ## every frame's OpenALPR results go in it
+        ## as they came back, before scoring
+
+        self.raw_log = raw_log
+
+        ## save the storage manager (if specified)
+        ## we tell it about every image we put in a
+        ## post-processing directory, so it can keep
+        ## them within their quotas
+
+        self.storage = storage
+
+        ## save the archive writer (if specified)
+        ## frames we keep get appended to it, with
+        ## their capture data and results, instead of
+        ## each going in its own file
+
+        self.archive = archive
+
+        ## save the engine (if specified)
+        ## e.g. one created up front so OpenALPR is
+        ## already loading while everything else is
+        ## set up. otherwise we create one for backend
+
+        self.engine = engine
 
         ## check and clean up config
         ## TODO: use os.path to test files and directories, then raise appropriate errors
 
         self.source_dir = source_dir.rstrip ("/")
+
+        # each recognizer needs its own processing directory -- it's where files go while they're being recognized
+        self.processing_dir = processing_dir.rstrip ("/")
+        if not(os.path.isdir(self.processing_dir)):
+            os.makedirs(self.processing_dir)
+
         self.postproc_hit_dir = postproc_hit_dir.rstrip ("/")
         self.postproc_nohit_dir = postproc_nohit_dir
         if(self.postproc_nohit_dir):
@@ -52,222 +253,257 @@ class recognizer (threading.Thread):
         else:
             self.postproc_nohit_lowconf_dir = self.postproc_nohit_dir
 
-        if not(output_json_dir) and not(output_csv_file):
-            raise (TypeError('must specify output_csv_file and/or output_json_dir'))
-        
-        self.output_json_dir = output_json_dir.rstrip ("/")
-        self.output_csv_file = output_csv_file
-
-        print "recognizer:init - initializing alpr"
-        self.alpr = Alpr("us", "/etc/openalpr/openalpr.conf", "/usr/share/openalpr/runtime_data")
-        if not self.alpr.is_loaded():
-            print("recognizer:init - error loading OpenALPR")
-            sys.exit(1)
+        if not(output):
+            raise (TypeError('must specify output'))
 
-        self.alpr.set_top_n(10)
+        self.name = os.path.basename(self.processing_dir)
 
-        if (default_region):
-            self.alpr.set_default_region(default_region)
+        # OpenALPR loads in the background -- run() waits for it
+        if (self.engine is None):
+            log.info("recognizer:init - loading alpr ({} backend)".format(backend))
+            self.engine = alprengine.create(backend, default_region, name = self.name, detector = detector)
 
         self.running = True
-        print "recognizer:init - done initializing alpr"
         
     def __del__ (self):
-        print "recognizer:del - unloading alpr"
-        self.alpr.unload()
-        print "recognizer:del - done"
+        log.info("recognizer:del - unloading alpr")
+        self.engine.unload()
+        log.info("recognizer:del - done")
 
     def stop(self):
-        print "recognizer:stop - waiting for recognizer thread to finish"
+        log.info("recognizer:stop - waiting for recognizer thread to finish")
         self.running = False
         self.join()
-        print "recognizer:stop - recognizer thread finished"
+        log.info("recognizer:stop - recognizer thread finished")
+        self.engine.unload()
 
     def run(self):
-        tid = self.ident
+        if not(self.engine.wait_ready()):
+            log.error("recognizer:run - {} could not load OpenALPR, stopping".format(self.name))
+            return
+
+        log.info("recognizer:run - {} ready, OpenALPR loaded in {:.2f}s".format(self.name, self.engine.load_secs))
+        if (self.on_ready):
+            self.on_ready(self)
 
         while(self.running):
-            sys.stdout.flush()
-            
-            time.sleep(0.05)
+            if (self.work_queue is not None):
+                # block on the queue -- the timeout just lets us notice when we're being stopped
+                frm = self.work_queue.get(timeout = QUEUE_GET_TIMEOUT_SECS)
+                if (frm):
+                    self.process_safely(frm)
+                continue
+
+            # no work queue, so fall back to polling the source directory
+            time.sleep(POLL_SLEEP_SECS)
             files = sorted(os.listdir(self.source_dir))
 
-#            if (len(files) > 0):
-#                print "recognizer:run[{}] - found {} files in {}".format(tid, len(files), self.source_dir)
-
             for file in files:
                 # if we're supposed to be shutting down, then break out of the file processing loop
                 if (self.running == False):
                     break
 
-                matches = []
-                lowconf_hit = False
-
-                # make sure it looks like one of ours
-                if (not(re.match('^\d+(.*)\.jpg$', file))):
-                    if file == "README" or file.startswith(".") or re.search('.lock$', file):
-                        pass # silently ignore lock files and hidden files
-                    else: 
-                        print "recognizer:run - ignoring file with bad name {}".format(file)
-                else:
-
-                    # to be thread safe, create a lock file while we process
-                    img_file = self.source_dir + "/" + file
-                    lock_file = img_file + ".lock"
-
-                    # set up file lock while blocking other threads
-                    try:
-                        if (self.lock):
-                            self.lock.acquire()
-                        
-                        # does the file still exist? if not, skip it silently -- another thread processed already
-                        if not(os.path.exists(img_file)):
-                            continue
-
-                        # is the file already locked? if so, skip it and say something -- could be another thread working on it or could be a stale lock
-                        ## TODO: auto remove old locks
-                        try:
-                            lock_stat = os.stat(lock_file)
-                            if lock_stat: # lock file exists
-                                lock_age = time.time() - lock_stat.st_mtime
-                                if (lock_age > STALE_LOCK_AGE):
-                                    print "recognizer:run - removing stale lock file ({:.0f}s) for {}".format(lock_age, file)
-                                    os.unlink(lock_file)
-                                else:
-                                    continue # file recently locked -- skip it silently
-                        except OSError:
-                            pass # ignore this error -- indicates lock file doesn't exist
-
-                        # create the lock file
-                        with open (lock_file, "w") as f:
-                            f.write("{}".format(self.ident))
-
-                    finally:
-                        if (self.lock):
-                            self.lock.release()
-
-
-                    # do plate recognition
-                    start_time = time.time()
-                    results = self.alpr.recognize_file(self.source_dir + "/" + file)
-                    recognize_secs = time.time() - start_time
-                    print "recognizer:run - recognized {:s} in {:.4f}s found {:2d} possible plates".format(self.source_dir + "/" + file, recognize_secs, len(results['results']))
-                    
-                    # remove lock file
-                    os.remove(lock_file)
-
-                    # review results
-                    for plate in results['results']:
-                        best_match_plate = None
-                        best_match_template = None
-                        best_match_confidence = 0.0
-
-                        for candidate in plate['candidates']:
-                            if (candidate['matches_template']):
-                                if (candidate['confidence'] > self.min_conf_patternmatch and candidate['confidence'] > best_match_confidence):
-                                    best_match_plate = candidate['plate']
-                                    best_match_confidence = candidate['confidence']
-                                    best_match_template = True
-                            else:
-                                if (candidate['confidence'] > self.min_conf_nopatternmatch and candidate['confidence'] > best_match_confidence):
-                                    best_match_plate = candidate['plate']
-                                    best_match_confidence = candidate['confidence']
-                                    best_match_template = False
-                        
-                        if (best_match_plate):
-                            print "recognizer:run - best match: {} (confidence: {:.3f}, template: {})".format(best_match_plate, best_match_confidence, "yes" if best_match_template else "no")
-                            match = {
-                                'recognize_time': time.strftime("%Y-%m-%d %H:%M:%S"),
-                                'recognize_epoch_time': "{:.0f}".format(start_time),
-                                'recognize_secs': "{:0.4f}".format(recognize_secs),
-                                'plate': best_match_plate,
-                                'confidence': "{:0.2f}".format(best_match_confidence),
-                                'matches_template': best_match_template,
-                                'file': file
-                            }
-
-                            matches.append(match)
-                        else:
-                            lowconf_hit = True
-                            print "recognizer:run - insufficient confidence"
-
-                    # record matches (if any) and move the file away
-                    if (len(matches) > 0):
-
-                        # extract GPS and other EXIF data, append to match record, then write output
-                        with open(self.source_dir + "/" + file, 'rb') as jpgfile:
-                            tags = exifread.process_file(jpgfile, details=False)
-                            
-                            # extract the image capture date and time
-                            if (tags['EXIF DateTimeOriginal']):
-                                exif_datetimeoriginal = time.strptime("{}".format(tags['EXIF DateTimeOriginal']), '%Y:%m:%d %H:%M:%S')
-
-                            # extract the GPS coordinates (convert from DMS to DD) and altitude
-                            exif_gpslongitude = 0.0
-                            exif_gpslatitude = 0.0
-                            exif_gpsaltitude = 0
-                            tag_lat = tags['GPS GPSLatitude']
-                            if (tag_lat and len(tag_lat.values) == 3 and tag_lat.values[0].den > 0):
-                                exif_gpslatitude = (float(tag_lat.values[0].num) / float(tag_lat.values[0].den)) + ((float(tag_lat.values[1].num) / float(tag_lat.values[1].den))/60.0) + ((float(tag_lat.values[2].num) / float(tag_lat.values[2].den))/3600.0)
-                                exif_gpslatitude *= -1 if (str(tags['GPS GPSLatitudeRef']) == "S") else 1
-
-                            tag_lon = tags['GPS GPSLongitude']
-                            if (tag_lon and len(tag_lon.values) == 3 and tag_lon.values[0].den > 0):
-                                exif_gpslongitude = (float(tag_lon.values[0].num) / float(tag_lon.values[0].den)) + ((float(tag_lon.values[1].num) / float(tag_lon.values[1].den))/60.0) + ((float(tag_lon.values[2].num) / float(tag_lon.values[2].den))/3600.0)
-                                exif_gpslongitude *= -1 if (str(tags['GPS GPSLongitudeRef']) == "W") else 1
-
-                            tag_altitude = tags['GPS GPSAltitude']
-                            if (tag_altitude and tag_altitude.values[0].den > 0):
-                                exif_gpsaltitude = float(tag_altitude.values[0].num) / float(tag_altitude.values[0].den)
-
-                            # store EXIF data in match records
-                            for match in (matches):
-                                if(exif_datetimeoriginal):
-                                    match['capture_epoch_time'] = '{:.0f}'.format(time.mktime(exif_datetimeoriginal))
-                                    match['capture_time'] = time.strftime("%Y-%m-%d %H:%M:%S",exif_datetimeoriginal)
-                                else:
-                                    match['capture_epoch_time'] = 0
-                                    match['capture_time'] = ''
-                                
-                                match['capture_longitude'] = "{:0.7f}".format(exif_gpslongitude)
-                                match['capture_latitude'] = "{:0.7f}".format(exif_gpslatitude)
-                                match['capture_altitude_m'] = "{:0.2f}".format(exif_gpsaltitude)
-
-                        # write matches to CSV
-                        if (self.output_csv_file):
-                            write_header = False if os.access(self.output_csv_file, os.F_OK) else True
-
-                            try:
-                                # only one thread can write to the CSV at a time
-                                if (self.lock):
-                                    self.lock.acquire()
-
-                                with open (self.output_csv_file, "a") as csvfile:
-                                    writer = csv.DictWriter(csvfile, ["recognize_time", "recognize_epoch_time", "plate","confidence", "matches_template", "file", "recognize_secs", 'capture_time', 'capture_epoch_time', 'capture_latitude', 'capture_longitude', 'capture_altitude_m'])
-                                    if (write_header):
-                                        writer.writeheader()
-
-                                    writer.writerow(match)
-                            finally:
-                                if (self.lock):
-                                    self.lock.release()
-
-                        # write JSON (each file is unique, so no thread locking needed)
-                        if (self.output_json_dir):
-                            json_file = self.output_json_dir + "/" + file[:file.index(".jpg")] + ".json"
-                            with open (json_file, "w") as jsonfile:
-                                jsonfile.write(json.dumps(matches))            
-
-                        # move the file
-                        os.rename (self.source_dir + "/" + file, self.postproc_hit_dir + "/" + file)
-                    elif (lowconf_hit): #insufficient confidence
-                        if (self.postproc_nohit_lowconf_dir):
-                            os.rename (self.source_dir + "/" + file, self.postproc_nohit_lowconf_dir + "/" + file)
-                        else:
-                            os.unlink(self.source_dir + "/" + file)
-                    else: #no hit
-                        if (self.postproc_nohit_dir):
-                            os.rename (self.source_dir + "/" + file, self.postproc_nohit_dir + "/" + file)
-                        else:
-                            os.unlink(self.source_dir + "/" + file)
+                self.process_safely(frame.frame(file))
+
+    # process a frame, without letting one bad frame (a corrupt JPEG, unreadable EXIF...) take the recognizer down
+    def process_safely(self, frm):
+        timer = stagetimer()
+        try:
+            self.process(frm)
+        except Exception:
+            log.exception("recognizer:run - {} failed on {}".format(self.name, frm.name))
+            self.set_aside(frm, timer)
+
+    # move a frame that failed out of the way -- to postproc_nohit_lowconf_dir if there is one, otherwise it's deleted --
+    # so it isn't claimed again (e.g. put back by recover_processing on the next start) and fail over and over
+    def set_aside(self, frm, timer):
+        claimed_file = self.processing_dir + "/" + frm.name
+        dest_dir = self.postproc_nohit_lowconf_dir
+        try:
+            if (self.capture_meta):
+                self.capture_meta.remove(frm.name)
+            if (self.rate_control):
+                self.rate_control.done()
+
+            dest_file = layout.path(dest_dir, frm.name, self.postproc_layout) if dest_dir else None
+            if (frm.in_memory()):
+                if (dest_file):
+                    with open(dest_file, "wb") as f:
+                        f.write(frm.data)
+            elif not(os.path.exists(claimed_file)):
+                dest_file = None # never claimed, or already moved on
+            elif (dest_file):
+                os.rename(claimed_file, dest_file)
+            else:
+                os.unlink(claimed_file)
+
+            if (dest_file):
+                log.warning("recognizer:run - set {} aside in {}".format(frm.name, dest_dir))
+        except Exception:
+            log.exception("recognizer:run - could not set {} aside".format(frm.name))
+
+        timer.lap('finish')
+
+        source = {'source': frm.source} if frm.source else {}
+        FRAMES.inc(worker = self.name, outcome = OUTCOME_FAILED, **source)
+        if (self.on_frame):
+            self.on_frame(frm, OUTCOME_FAILED, timer)
+
+    # recognize a single frame (see frame.frame), write any matches to output, and move the image to its post-processing directory.
+    # frames on disk are claimed from source_dir first. frames captured to memory are recognized from their JPEG bytes
+    # and only written out if their post-processing directory is set
+    def process(self, frm):
+        file = frm.name
+        matches = []
+        lowconf_hit = False
+        timer = stagetimer()
+
+        # make sure it looks like one of ours
+        if (not(workqueue.CAPTURE_FILE_RE.match(file))):
+            if file == "README" or file.startswith("."):
+                pass # silently ignore hidden files
+            else: 
+                log.warning("recognizer:run - ignoring file with bad name {}".format(file))
+            return
+
+        claimed_file = None
+        if not(frm.in_memory()):
+            # claim the file by moving it into our own in-progress directory. rename is atomic, so
+            # if another recognizer got there first, the rename fails and we skip the file
+            img_file = self.source_dir + "/" + file
+            claimed_file = self.processing_dir + "/" + file
+            try:
+                os.rename(img_file, claimed_file)
+            except OSError as e:
+                if e.errno == errno.ENOENT:
+                    return # another recognizer claimed it already
+                raise
+        timer.lap('claim')
+
+        # frames that waited too long to be worth recognizing are dropped
+        if (frm.expired):
+            log.debug("recognizer:run - dropping {}, it waited past its deadline".format(file))
+            self.finish(frm, claimed_file, self.postproc_nohit_dir, OUTCOME_EXPIRED, timer)
+            return
+
+        # skip frames that look just like the last one recognized -- they'd only give us the same plates again
+        if (self.frame_filter):
+            recognize, change = self.frame_filter.check(frm, claimed_file)
+            if not(recognize):
+                log.debug("recognizer:run - skipping {} (change {:.2f} since last recognized frame)".format(file, change))
+                self.finish(frm, claimed_file, self.postproc_nohit_dir, OUTCOME_SKIPPED, timer)
+                return
+            timer.lap('filter')
+
+        # do plate recognition
+        start_time = time.time()
+        try:
+            if (frm.in_memory()):
+                results, recognize_secs = self.engine.recognize_array(frm.data)
+            else:
+                results, recognize_secs = self.engine.recognize_file(claimed_file)
+        except alprengine.workercrashed:
+            # treat a file that took down OpenALPR as a no hit, so it can't crash the worker over and over
+            results = {'results': []}
+            recognize_secs = time.time() - start_time
+        log.debug("recognizer:run - recognized {:s} in {:.4f}s found {:2d} possible plates".format(claimed_file or file, recognize_secs, len(results['results'])))
+        timer.lap('ocr')
+
+        # frames from camcap carry their capture time and location with them, or have it in the capture metadata log
+        meta = frm.meta
+        if meta is None and self.capture_meta:
+            meta = self.capture_meta.get(file)
+
+        # log the raw results, so they can be re-scored later without running OpenALPR again
+        if (self.raw_log):
+            self.raw_log.append(file, start_time, recognize_secs, results, meta)
+            timer.lap('rawlog')
+
+        # check every candidate against the watchlist. hits are alerted on right away rather than waiting for output
+        alerts = []
+        if (self.watchlist and results['results']):
+            details = {'file': file}
+            if meta:
+                details.update(meta)
+            for plate in results['results']:
+                alerts.extend(self.watchlist.check(plate['candidates'], details))
+            timer.lap('watchlist')
+
+        # review results
+        for plate, best in scoring.score(results, self.min_conf_patternmatch, self.min_conf_nopatternmatch):
+            if (best):
+                log.info("recognizer:run - best match: {} (confidence: {:.3f}, template: {})".format(best['plate'], best['confidence'], "yes" if best['matches_template'] else "no"))
+                matches.append(match_record(file, plate, best, start_time, recognize_secs))
+            else:
+                lowconf_hit = True
+                log.debug("recognizer:run - insufficient confidence")
+
+        timer.lap('scoring')
+
+        # record matches (if any) and move the file away
+        if (len(matches) > 0):
+
+            # anything not from camcap (e.g. images copied in from elsewhere) has its capture time and location read from EXIF
+            if meta is None:
+                meta = read_exif_meta(io.BytesIO(frm.data) if frm.in_memory() else claimed_file)
+
+            # store capture data in match records
+            add_capture_meta(matches, meta)
+            timer.lap('meta')
+
+            # hand the matches off to be written out
+            self.output.write(matches)
+            timer.lap('output')
+
+            # move the file
+            self.finish(frm, claimed_file, self.postproc_hit_dir, OUTCOME_HIT, timer, meta, matches, alerts)
+        elif (lowconf_hit): #insufficient confidence (images with watchlist hits are always kept with the hits)
+            self.finish(frm, claimed_file, self.postproc_hit_dir if alerts else self.postproc_nohit_lowconf_dir, OUTCOME_LOWCONF, timer, meta, matches, alerts)
+        else: #no hit
+            self.finish(frm, claimed_file, self.postproc_hit_dir if alerts else self.postproc_nohit_dir, OUTCOME_NOHIT, timer, meta, matches, alerts)
+
+    # put a recognized frame in dest_dir -- moved there from our processing directory, or written out if it was
+    # captured to memory. if dest_dir is None, the frame is thrown away. with an archive, frames that would go in
+    # dest_dir are appended to the archive instead, along with meta (capture data), matches and alerts
+    def finish(self, frm, claimed_file, dest_dir, outcome, timer, meta = None, matches = None, alerts = None):
+        if (self.capture_meta):
+            self.capture_meta.remove(frm.name)
+        if (self.rate_control):
+            self.rate_control.done()
+
+        if (dest_dir and self.archive):
+            if (frm.in_memory()):
+                jpeg = frm.data
+            else:
+                with open(claimed_file, "rb") as f:
+                    jpeg = f.read()
+                os.unlink(claimed_file)
+            self.archive.append(frm.name, jpeg, meta if meta is not None else frm.meta, {'outcome': outcome, 'matches': matches or [], 'alerts': alerts or []})
+        else:
+            dest_file = layout.path(dest_dir, frm.name, self.postproc_layout) if dest_dir else None
+            if (frm.in_memory()):
+                if (dest_dir):
+                    with open(dest_file, "wb") as f:
+                        f.write(frm.data)
+            elif (dest_dir):
+                os.rename (claimed_file, dest_file)
+            else:
+                os.unlink(claimed_file)
+
+            if (dest_dir and self.storage):
+                self.storage.add(dest_dir, dest_file[len(dest_dir) + 1:], len(frm.data) if frm.in_memory() else os.path.getsize(dest_file))
+        timer.lap('finish')
+
+        source = {'source': frm.source} if frm.source else {} # with more than one camera, which one it came from
+        FRAMES.inc(worker = self.name, outcome = outcome, **source)
+        FRAME_SECONDS.observe(timer.total(), worker = self.name)
+        for stage, secs in timer.stages.items():
+            STAGE_SECONDS.observe(secs, worker = self.name, stage = stage)
+        capture_time = frm.capture_time()
+        if (capture_time):
+            CAPTURE_LATENCY_SECONDS.observe(time.time() - capture_time, **source)
+
+        if (self.on_frame):
+            self.on_frame(frm, outcome, timer)
+
 
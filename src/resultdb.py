@@ -0,0 +1,128 @@
+### resultdb - SQLite store of recognized plates, indexed by plate, capture time and location
+import math
+import sqlite3
+
+# size of a geo cell in degrees (about 1.1km north/south). reads are indexed by the cell they fall in so
+# location queries only have to look at the cells overlapping the area asked about
+GEO_CELL_DEGREES = 0.01
+GEO_CELL_COLUMNS = int(round(360 / GEO_CELL_DEGREES))
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS reads (
+        id INTEGER PRIMARY KEY,
+        plate TEXT NOT NULL,
+        confidence REAL,
+        matches_template INTEGER,
+        file TEXT,
+        recognize_epoch_time INTEGER,
+        recognize_secs REAL,
+        capture_epoch_time INTEGER,
+        latitude REAL,
+        longitude REAL,
+        altitude_m REAL,
+        geo_cell INTEGER
+    )''',
+    'CREATE INDEX IF NOT EXISTS reads_plate ON reads (plate, capture_epoch_time)',
+    'CREATE INDEX IF NOT EXISTS reads_time ON reads (capture_epoch_time)',
+    'CREATE INDEX IF NOT EXISTS reads_geo ON reads (geo_cell, capture_epoch_time)',
+]
+
+COLUMNS = ['plate', 'confidence', 'matches_template', 'file', 'recognize_epoch_time', 'recognize_secs', 'capture_epoch_time', 'latitude', 'longitude', 'altitude_m', 'geo_cell']
+
+def geo_row(latitude):
+    return int(math.floor((latitude + 90.0) / GEO_CELL_DEGREES))
+
+def geo_column(longitude):
+    return int(math.floor((longitude + 180.0) / GEO_CELL_DEGREES)) % GEO_CELL_COLUMNS
+
+def geo_cell(latitude, longitude):
+    return geo_row(latitude) * GEO_CELL_COLUMNS + geo_column(longitude)
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _int(value):
+    value = _float(value)
+    return int(value) if value is not None else None
+
+class resultdb (object):
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file)
+        self.conn.row_factory = sqlite3.Row
+
+        # WAL lets queries run while the recognizers are writing, and makes batched commits cheap
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self.conn.execute(statement)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    # insert a batch of match records (as built by the recognizer) in one transaction
+    def write_batch(self, matches):
+        rows = []
+        for match in matches:
+            latitude = _float(match.get('capture_latitude'))
+            longitude = _float(match.get('capture_longitude'))
+            rows.append((
+                match['plate'],
+                _float(match.get('confidence')),
+                1 if match.get('matches_template') else 0,
+                match.get('file'),
+                _int(match.get('recognize_epoch_time')),
+                _float(match.get('recognize_secs')),
+                _int(match.get('capture_epoch_time')),
+                latitude,
+                longitude,
+                _float(match.get('capture_altitude_m')),
+                geo_cell(latitude, longitude) if latitude is not None and longitude is not None else None
+            ))
+
+        with self.conn:
+            self.conn.executemany('INSERT INTO reads ({}) VALUES ({})'.format(', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), rows)
+
+    # find reads. any combination of criteria can be given:
+    #   plate - exact plate, or a SQL LIKE pattern (e.g. "ABC%") if like is True
+    #   since, until - capture_epoch_time range (inclusive)
+    #   bbox - (min_latitude, min_longitude, max_latitude, max_longitude)
+    # returns the newest reads first
+    def query(self, plate = None, like = False, since = None, until = None, bbox = None, limit = None):
+        where = []
+        params = []
+
+        if plate:
+            where.append('plate LIKE ?' if like else 'plate = ?')
+            params.append(plate)
+        if since is not None:
+            where.append('capture_epoch_time >= ?')
+            params.append(int(since))
+        if until is not None:
+            where.append('capture_epoch_time <= ?')
+            params.append(int(until))
+        if bbox:
+            min_lat, min_lon, max_lat, max_lon = bbox
+
+            # one range of cells per row of the grid, then an exact check on the coordinates
+            cells = []
+            for row in range(geo_row(min_lat), geo_row(max_lat) + 1):
+                cells.append('geo_cell BETWEEN ? AND ?')
+                params.extend([row * GEO_CELL_COLUMNS + geo_column(min_lon), row * GEO_CELL_COLUMNS + geo_column(max_lon)])
+            where.append('(' + ' OR '.join(cells) + ')')
+            where.append('latitude BETWEEN ? AND ? AND longitude BETWEEN ? AND ?')
+            params.extend([min_lat, max_lat, min_lon, max_lon])
+
+        sql = 'SELECT * FROM reads'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY capture_epoch_time DESC'
+        if limit:
+            sql += ' LIMIT {:d}'.format(int(limit))
+
+        return self.conn.execute(sql, params).fetchall()
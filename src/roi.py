@@ -0,0 +1,95 @@
+### roi - cuts down the pixels OpenALPR has to look at: crop to a region of interest, and/or find plates on a
+### downscaled copy of the frame first, then read them from the full resolution image
+import io
+
+# PIL is optional -- without it, frames are recognized whole
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    Image = None
+    ImageDraw = None
+
+ENCODE_QUALITY = 95 # JPEG quality for the cropped/scaled images handed to OpenALPR
+
+def available():
+    return Image is not None
+
+# encode a PIL image as JPEG bytes for Alpr.recognize_array
+def _encode(img):
+    out = io.BytesIO()
+    img.save(out, 'JPEG', quality = ENCODE_QUALITY)
+    return out.getvalue()
+
+# shift (and scale) the plate coordinates in OpenALPR results, e.g. from a crop back to the full frame
+def _remap(results, offset_x, offset_y, scale = 1.0):
+    for plate in results['results']:
+        for point in plate.get('coordinates', []):
+            point['x'] = int(round(point['x'] / scale)) + offset_x
+            point['y'] = int(round(point['y'] / scale)) + offset_y
+    return results
+
+# the settings are plain attributes so a detector can be handed to a worker process
+class detector (object):
+
+    # polygon - region of interest as a list of (x, y) points, each a fraction (0.0-1.0) of the frame width/height.
+    #           anything outside it is ignored. None to use the whole frame
+    # scale - find plates on a copy of the frame scaled by this much (e.g. 0.5), then read each plate from the full
+    #         resolution image. 1.0 to recognize at full resolution in one pass
+    # margin - how much to pad each plate found at the lower scale, as a fraction of the plate's width/height
+    def __init__(self, polygon = None, scale = 1.0, margin = 0.5):
+        self.polygon = polygon
+        self.scale = scale
+        self.margin = margin
+
+    # recognize an image file with the given Alpr. returns OpenALPR results with coordinates in the full frame
+    def recognize_file(self, alpr, file):
+        return self.recognize_image(alpr, Image.open(file))
+
+    # recognize encoded image bytes (e.g. a JPEG) with the given Alpr
+    def recognize_array(self, alpr, data):
+        return self.recognize_image(alpr, Image.open(io.BytesIO(data)))
+
+    def recognize_image(self, alpr, img):
+        width, height = img.size
+
+        # crop to the region of interest, then blank out whatever in the crop is outside the polygon (nothing to blank
+        # if the polygon is just a rectangle). only the crop is masked and encoded, not the whole frame
+        offset_x, offset_y = 0, 0
+        if self.polygon:
+            points = [(int(x * width), int(y * height)) for x, y in self.polygon]
+            box = (min(p[0] for p in points), min(p[1] for p in points), max(p[0] for p in points), max(p[1] for p in points))
+            img = img.crop(box)
+            offset_x, offset_y = box[0], box[1]
+            corners = set([(box[0], box[1]), (box[2], box[1]), (box[2], box[3]), (box[0], box[3])])
+            if not(len(points) == 4 and set(points) == corners):
+                mask = Image.new('L', img.size, 0)
+                ImageDraw.Draw(mask).polygon([(x - offset_x, y - offset_y) for x, y in points], fill = 255)
+                img = Image.composite(img, Image.new(img.mode, img.size), mask)
+
+        if self.scale >= 1.0:
+            return _remap(alpr.recognize_array(_encode(img)), offset_x, offset_y)
+
+        # find plates on the scaled down image. PIL's default (nearest neighbour) resize drops pixels outright, which
+        # turns plate characters into noise
+        small = img.resize((max(1, int(img.size[0] * self.scale)), max(1, int(img.size[1] * self.scale))), Image.BILINEAR)
+        found = alpr.recognize_array(_encode(small))
+
+        # then read each one from the full resolution image
+        results = dict(found)
+        results['results'] = []
+        for plate in found['results']:
+            xs = [int(p['x'] / self.scale) for p in plate['coordinates']]
+            ys = [int(p['y'] / self.scale) for p in plate['coordinates']]
+            pad_x = int((max(xs) - min(xs)) * self.margin)
+            pad_y = int((max(ys) - min(ys)) * self.margin)
+            box = (max(0, min(xs) - pad_x), max(0, min(ys) - pad_y), min(img.size[0], max(xs) + pad_x), min(img.size[1], max(ys) + pad_y))
+
+            region = alpr.recognize_array(_encode(img.crop(box)))
+            _remap(region, box[0] + offset_x, box[1] + offset_y)
+            if region['results']:
+                results['results'].extend(region['results'])
+            else:
+                # couldn't read it at full resolution -- keep what we got from the scaled image
+                results['results'].append(_remap({'results': [plate]}, offset_x, offset_y, self.scale)['results'][0])
+
+        return results
@@ -0,0 +1,69 @@
+### scoring - picks the best candidate for each plate OpenALPR found. pure functions of the results and thresholds, so the
+### same scoring can be re-run over logged raw results (see rawlog) with different thresholds
+import array
+
+# numpy is optional -- score_columns is much faster with it, but works without
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# pick the best candidate for each plate in OpenALPR results: the most confident one over min_conf_patternmatch if it
+# matches a regional plate pattern, or over min_conf_nopatternmatch if not. returns a (plate, best candidate) pair for
+# each plate, with the best candidate None if none of them were confident enough
+def score(results, min_conf_patternmatch, min_conf_nopatternmatch):
+    scored = []
+    for plate in results['results']:
+        best = None
+        for candidate in plate['candidates']:
+            min_conf = min_conf_patternmatch if candidate['matches_template'] else min_conf_nopatternmatch
+            if (candidate['confidence'] > min_conf and (best is None or candidate['confidence'] > best['confidence'])):
+                best = candidate
+        scored.append((plate, best))
+    return scored
+
+# score for a whole log at once, in the column layout of rawlog.read_columns: plate p's candidates are
+# confidences[plate_first[p]:plate_first[p] + plate_counts[p]] (and the same of matches_templates). returns the index of
+# each plate's best candidate, or -1 where score would have given None
+def score_columns(plate_first, plate_counts, confidences, matches_templates, min_conf_patternmatch, min_conf_nopatternmatch):
+    if numpy is not None:
+        return _score_columns_numpy(plate_first, plate_counts, confidences, matches_templates, min_conf_patternmatch, min_conf_nopatternmatch)
+
+    # each candidate's confidence if it's over its threshold, otherwise -1 (below any real confidence)
+    eligible = [confidence if confidence > (min_conf_patternmatch if matches_template else min_conf_nopatternmatch) else -1.0
+        for confidence, matches_template in zip(confidences, matches_templates)]
+
+    best = array.array('l')
+    for first, count in zip(plate_first, plate_counts):
+        if count:
+            plate_eligible = eligible[first:first + count]
+            top = max(plate_eligible)
+            best.append(first + plate_eligible.index(top) if top >= 0 else -1) # index() gives the first, like score
+        else:
+            best.append(-1)
+    return best
+
+def _score_columns_numpy(plate_first, plate_counts, confidences, matches_templates, min_conf_patternmatch, min_conf_nopatternmatch):
+    first = numpy.asarray(plate_first, dtype = numpy.int64)
+    counts = numpy.asarray(plate_counts, dtype = numpy.int64)
+    confidences = numpy.asarray(confidences, dtype = numpy.float64)
+    best = numpy.full(len(first), -1, dtype = numpy.int64)
+    if not(len(confidences)):
+        return best
+
+    thresholds = numpy.where(numpy.asarray(matches_templates, dtype = bool), min_conf_patternmatch, min_conf_nopatternmatch)
+    eligible = numpy.where(confidences > thresholds, confidences, -1.0)
+
+    # reduceat needs every segment to be non-empty
+    has = counts > 0
+    starts = first[has]
+    plate_of = numpy.repeat(numpy.arange(len(starts)), counts[has])
+    top = numpy.maximum.reduceat(eligible, starts)
+
+    # first candidate in each plate that reaches its plate's top
+    index = numpy.arange(len(eligible))
+    at_top = numpy.where(eligible == top[plate_of], index, len(eligible))
+    first_top = numpy.minimum.reduceat(at_top, starts)
+
+    best[has] = numpy.where(top >= 0, first_top, -1)
+    return best
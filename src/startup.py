@@ -0,0 +1,113 @@
+### startup - brings diy-lpr's components up in parallel and reports how long startup took, from launch until the
+### first frame has been recognized
+import sys
+import time
+import threading
+import collections
+import logging
+
+import metrics
+
+log = logging.getLogger("startup")
+
+FIRST_FRAME_SECONDS = metrics.get_gauge("startup_first_frame_seconds", "Time from launch until the first frame was recognized")
+
+LAUNCH_TIME = time.time() # import this first thing, so this is close to when we were launched
+
+# run each (name, fn) in steps in a thread of its own and wait for them all, noting how long each took in report
+# (if given). returns what each fn returned, in order. if any of them raised, the first exception is raised again
+# here once they've all finished
+def parallel(steps, report = None):
+    results = [None] * len(steps)
+    errors = []
+
+    def run(i, name, fn):
+        start_time = time.time()
+        try:
+            results[i] = fn()
+        except BaseException: # including the exit() camcap does when it can't start
+            errors.append(sys.exc_info())
+        if (report):
+            report.took(name, time.time() - start_time)
+
+    threads = []
+    for i, (name, fn) in enumerate(steps):
+        t = threading.Thread(target = run, args = (i, name, fn), name = "startup-" + name)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        while t.is_alive():
+            t.join(0.5) # join with a timeout so Ctrl-C still gets through
+
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+# collects how long each setup step took and when things first happened (first GPS fix, each OpenALPR loaded...),
+# and logs it all once the first frame has been recognized
+class report (object):
+
+    def __init__(self, start_time = LAUNCH_TIME):
+        self.start_time = start_time
+        self.last = time.time()
+        self.steps = [] # (name, secs)
+        self.events = collections.OrderedDict() # name -> when it first happened
+        self.lock = threading.Lock()
+        self.reported = False
+
+    # charge the time since the last lap to step name
+    def lap(self, name):
+        now = time.time()
+        self.took(name, now - self.last)
+        self.last = now
+
+    def took(self, name, secs):
+        with self.lock:
+            self.steps.append((name, secs))
+
+    # note that name happened at t (default now). only the first time counts
+    def event(self, name, t = None):
+        with self.lock:
+            if name not in self.events:
+                self.events[name] = t if t is not None else time.time()
+
+    # note when gps_source (a gpspoll) gets its first fix -- which it may have already
+    def watch_gps(self, gps_source):
+        latest = gps_source.latest
+        if latest is not None:
+            self.event("first GPS fix", latest.received_time)
+        gps_source.add_listener(self.gps_fix)
+
+    def gps_fix(self, fix):
+        if "first GPS fix" not in self.events:
+            self.event("first GPS fix", fix.received_time)
+
+    # for recognizer.on_ready
+    def recognizer_ready(self, recog):
+        self.event("{} loaded OpenALPR".format(recog.name))
+
+    # for recognizer.on_frame -- the first frame finishes the report
+    def frame_recognized(self, frm, outcome, timer):
+        if self.reported:
+            return
+        with self.lock:
+            if self.reported:
+                return
+            self.reported = True
+        self.event("first frame captured", frm.capture_time())
+        self.event("first frame recognized")
+        self.log()
+
+    def log(self):
+        with self.lock:
+            steps = list(self.steps)
+            events = sorted(self.events.items(), key = lambda item: item[1])
+
+        log.info("startup:report - setup: {}".format(", ".join("{} {:.2f}s".format(name, secs) for name, secs in steps)))
+        for name, t in events:
+            log.info("startup:report - {:7.2f}s {}".format(t - self.start_time, name))
+
+        if "first frame recognized" in self.events:
+            FIRST_FRAME_SECONDS.set(self.events["first frame recognized"] - self.start_time)
@@ -0,0 +1,212 @@
+### storage - keeps the post-processing directories from filling the disk. tracks how much each one holds as the
+### recognizers add to it (the directories are only scanned once, in the background after startup), deletes the oldest
+### images when a directory goes over its quota or free space runs low, and tells camcap how much room is left to
+### capture into
+import os
+import time
+import errno
+import threading
+import collections
+import logging
+
+import metrics
+import layout
+
+log = logging.getLogger("storage")
+
+STORED_BYTES = metrics.get_gauge("storage_bytes", "Bytes of images held, by directory")
+STORED_FILES = metrics.get_gauge("storage_files", "Images held, by directory")
+EVICTED = metrics.get_counter("storage_evicted_total", "Images deleted to make room, by directory and reason")
+FREE_BYTES = metrics.get_gauge("storage_free_bytes", "Free space on the disk the images are stored on")
+
+REASON_QUOTA = "quota" # the directory was over its own quota
+REASON_SPACE = "space" # free space was low
+
+# bytes available to us on the filesystem holding path
+def free_bytes(path):
+    st = os.statvfs(path)
+    return st.f_bavail * st.f_frsize
+
+# one managed directory: its images, oldest first, and their total size
+class _store (object):
+    def __init__(self, path, max_bytes, max_files, evict_rank):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.evict_rank = evict_rank
+        self.files = collections.deque() # (name, size), oldest first
+        self.names = set() # the names in files
+        self.bytes = 0
+        self.same_disk = True # on the same filesystem as the storage manager's root_dir
+        self.scanned = False # until the images already there have been counted, files only has the ones added since
+
+    # add an image, or update its size if we have it already (e.g. an archive segment that was counted while still
+    # being written)
+    def add(self, name, size):
+        if name in self.names:
+            self.files = collections.deque((n, size if n == name else s) for n, s in self.files)
+            self.bytes = sum(s for n, s in self.files)
+            return
+        self.files.append((name, size))
+        self.names.add(name)
+        self.bytes += size
+
+    # take the oldest files off until at least free_bytes have come off (and we're within max_bytes / max_files).
+    # returns the files taken
+    def take_oldest(self, free_bytes = 0):
+        taken = []
+        freed = 0
+        while self.files and (freed < free_bytes or (self.max_bytes is not None and self.bytes > self.max_bytes) or
+                (self.max_files is not None and len(self.files) > self.max_files)):
+            name, size = self.files.popleft()
+            self.names.discard(name)
+            self.bytes -= size
+            freed += size
+            taken.append(name)
+        return taken
+
+    def update_metrics(self):
+        STORED_BYTES.set(self.bytes, dir = self.name)
+        STORED_FILES.set(len(self.files), dir = self.name)
+
+# add the post-processing directories with add_dir, tell it about each image put in one with add(), and run the thread
+# (start()) to keep min_free_bytes free on root_dir's disk
+class storagemanager (threading.Thread):
+    check_secs = 5.0 # how often to check free space
+
+    def __init__(self, root_dir, min_free_bytes = None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.root_dir = root_dir
+        self.min_free_bytes = min_free_bytes
+        self.stores = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.free = free_bytes(root_dir)
+        self.added_since_check = 0
+        self.running = True
+        FREE_BYTES.set(self.free)
+
+    # manage path, holding at most max_bytes / max_files (None for no limit). when free space runs low, directories are
+    # cleared out in order of evict_rank, lowest first (e.g. low confidence frames before hits). the images already in
+    # path (and its subdirectories, see layout) are counted by the thread once it's running (see scan) -- months of
+    # images can take minutes to count on a Pi, which shouldn't hold up startup
+    def add_dir(self, path, max_bytes = None, max_files = None, evict_rank = 0):
+        path = path.rstrip("/")
+        if path in self.stores:
+            return
+        if not(os.path.isdir(path)):
+            os.makedirs(path)
+
+        store = _store(path, max_bytes, max_files, evict_rank)
+        store.same_disk = os.stat(path).st_dev == os.stat(self.root_dir).st_dev
+        with self.lock:
+            self.stores[path] = store
+            self.stores = collections.OrderedDict(sorted(self.stores.items(), key = lambda item: item[1].evict_rank))
+
+    # count the images already in store's directory, oldest first, ahead of any added since add_dir. until this is
+    # done, how much the directory holds is unknown, so it's left out of the metrics and nothing is evicted from it
+    def scan(self, store):
+        start_time = time.time()
+        found = []
+        for name in layout.walk(store.path):
+            try:
+                found.append((name, os.path.getsize(store.path + "/" + name)))
+            except OSError:
+                pass # gone already
+
+        with self.lock:
+            added = set(name for name, size in store.files) # added while we were counting, so the walk may have seen them
+            files = [(name, size) for name, size in found if name not in added] + list(store.files)
+            store.files = collections.deque(files)
+            store.names = set(name for name, size in files)
+            store.bytes = sum(size for name, size in files)
+            store.scanned = True
+            taken = store.take_oldest()
+            store.update_metrics()
+        log.info("storage:scan - {} holds {} images, {:.1f}MB (counted in {:.2f}s)".format(store.path, len(store.files),
+            store.bytes / 1e6, time.time() - start_time))
+        self.evict(store, taken, REASON_QUOTA)
+
+    # an image of size bytes has been put in dir (one of the directories added with add_dir -- others are ignored), at
+    # name relative to dir. if that takes dir over its quota, the oldest images in it are deleted
+    def add(self, dir, name, size):
+        with self.lock:
+            store = self.stores.get(dir.rstrip("/"))
+            if store is None:
+                return
+            before = store.bytes
+            store.add(name, size)
+            self.added_since_check += store.bytes - before
+            if not(store.scanned):
+                return # the quota is checked once we know what was already there
+            taken = store.take_oldest()
+            store.update_metrics()
+        self.evict(store, taken, REASON_QUOTA)
+
+    # bytes that can still be written before going under min_free_bytes. estimated from the last free space check and
+    # what's been added since, so it's cheap enough to call before every capture
+    def headroom(self):
+        if self.min_free_bytes is None:
+            return self.free - self.added_since_check
+        return self.free - self.added_since_check - self.min_free_bytes
+
+    def evict(self, store, names, reason):
+        for name in names:
+            try:
+                os.unlink(store.path + "/" + name)
+            except OSError as e:
+                if e.errno != errno.ENOENT: # deleted by hand -- it's not taking up space either way
+                    log.warning("storage:evict - could not delete {}/{}: {}".format(store.path, name, e))
+        if names:
+            EVICTED.inc(len(names), dir = store.name, reason = reason)
+            log.log(logging.DEBUG if reason == REASON_QUOTA else logging.INFO, # a quota usually has an image go for every one added
+                "storage:evict - deleted {} images from {} ({})".format(len(names), store.path, reason))
+
+    # check free space, and if it's under min_free_bytes, delete the oldest images from the lowest ranked directories
+    # until it isn't
+    def check(self):
+        with self.lock:
+            self.added_since_check = 0
+        self.free = free_bytes(self.root_dir)
+        FREE_BYTES.set(self.free)
+        if self.min_free_bytes is None or self.free >= self.min_free_bytes:
+            return
+
+        need = self.min_free_bytes - self.free
+        for store in self.stores.values():
+            if not(store.same_disk) or not(store.scanned):
+                continue # deleting these wouldn't free anything up, or we don't know which images are oldest yet
+            with self.lock:
+                before = store.bytes
+                taken = store.take_oldest(need)
+                store.update_metrics()
+            self.evict(store, taken, REASON_SPACE)
+            need -= before - store.bytes
+            if need <= 0:
+                break
+
+        self.free = free_bytes(self.root_dir)
+        FREE_BYTES.set(self.free)
+        if self.free < self.min_free_bytes:
+            log.warning("storage:check - only {:.1f}MB free after clearing out images (want {:.1f}MB)".format(self.free / 1e6, self.min_free_bytes / 1e6))
+
+    def run(self):
+        while(self.running):
+            try:
+                self.check()
+            except OSError:
+                log.exception("storage:run - could not check free space on {}".format(self.root_dir))
+
+            # count what's in any directories added since the last time round (the first time, all of them)
+            for store in list(self.stores.values()):
+                if not(store.scanned) and self.running:
+                    try:
+                        self.scan(store)
+                    except OSError:
+                        log.exception("storage:run - could not count the images in {}".format(store.path))
+                        store.scanned = True # don't try again every check -- go by what's added from now on
+            time.sleep(self.check_secs)
+
+    def stop(self):
+        self.running = False
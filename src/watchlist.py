@@ -0,0 +1,186 @@
+### watchlist - checks recognized plates against a hotlist as they're read, and raises an alert for each hit
+import os
+import json
+import time
+import array
+import bisect
+import threading
+import logging
+
+import dedup
+import metrics
+
+log = logging.getLogger("watchlist")
+
+HITS = metrics.get_counter("watchlist_hits_total", "Watchlist hits, by kind of match")
+ENTRIES = metrics.get_gauge("watchlist_entries", "Plates on the watchlist")
+
+MATCH_EXACT = "exact" # same plate (after normalize)
+MATCH_FUZZY = "fuzzy" # one character inserted, dropped or misread beyond the usual confusions
+
+# characters OCR tends to mix up on plates, mapped to one of each group so that either one matches
+CONFUSABLE = {
+    'O': '0', 'Q': '0', 'D': '0',
+    'I': '1', 'L': '1',
+    'Z': '2',
+    'S': '5',
+    'G': '6',
+    'B': '8'
+}
+
+# the key a plate is looked up by: upper case letters and digits only, confusable characters folded together
+def normalize(plate):
+    return ''.join(CONFUSABLE.get(c, c) for c in plate.upper() if c.isalnum())
+
+# every way of dropping one character from key
+def deletions(key):
+    return [key[:i] + key[i + 1:] for i in range(len(key))]
+
+# the loaded list. replaced as a whole on reload, so lookups never see a half loaded list.
+# there are several deletions for every listed plate, so rather than a dict (which would take ~100MB for 100k plates)
+# they're kept as a sorted array of their hashes, with a parallel array of which key each came from
+class _index (object):
+    def __init__(self, entries):
+        self.exact = {} # key -> tuple of (plate, note) entries
+        self.keys = [] # each distinct key
+        for entry in entries:
+            key = normalize(entry[0])
+            if not(key):
+                continue
+            if key in self.exact:
+                self.exact[key] += (entry,)
+            else:
+                self.exact[key] = (entry,)
+                self.keys.append(key)
+
+        # sort (hash, key number) pairs packed into single ints -- much smaller than tuples while loading
+        bits = max(20, len(self.keys).bit_length())
+        deletes = [(hash(d) << bits) | i for i, key in enumerate(self.keys) for d in set(deletions(key))]
+        deletes.sort()
+        self.delete_hashes = array.array('l', (v >> bits for v in deletes))
+        self.delete_keys = array.array('l', (v & ((1 << bits) - 1) for v in deletes))
+
+    # the listed keys with d as one of their deletions (plus the odd hash collision)
+    def deleted(self, d):
+        h = hash(d)
+        i = bisect.bisect_left(self.delete_hashes, h)
+        keys = []
+        while i < len(self.delete_hashes) and self.delete_hashes[i] == h:
+            keys.append(self.keys[self.delete_keys[i]])
+            i += 1
+        return keys
+
+# writes each watchlist hit to the log and to alert_file (a JSON line per hit) as soon as it happens
+class alertsink (object):
+
+    def __init__(self, alert_file = None):
+        self.alert_file = alert_file
+        self.lock = threading.Lock()
+        self.file = open(alert_file, "a") if alert_file else None
+
+    def alert(self, hit):
+        log.warning("watchlist:alert - {} read as {} ({} match{}) in {}".format(hit['watchlist_plate'], hit['candidate'], hit['match'],
+            ", note: {}".format(hit['note']) if hit.get('note') else "", hit.get('file')))
+        if (self.file):
+            with self.lock:
+                self.file.write(json.dumps(hit) + "\n")
+                self.file.flush()
+
+    def close(self):
+        if (self.file):
+            with self.lock:
+                self.file.close()
+
+# list_file has one plate per line, optionally followed by a comma and a note (e.g. why it's listed). blank lines and
+# lines starting with # are ignored. the file is reloaded when it changes -- run the thread (start()) to watch it
+class watchlist (threading.Thread):
+    max_distance = 1 # 1 to also match plates one character off (after normalize), 0 for exact matches only
+    reload_secs = 10.0 # how often to check list_file for changes
+
+    def __init__(self, list_file, sink = None):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.list_file = list_file
+        self.sink = sink or alertsink()
+        self.index = _index([])
+        self.mtime = None
+        self.running = True
+        self.load()
+
+    def load(self):
+        start_time = time.time()
+        mtime = os.path.getmtime(self.list_file)
+        entries = []
+        with open(self.list_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not(line) or line.startswith("#"):
+                    continue
+                plate, _, note = line.partition(",")
+                entries.append((plate.strip(), note.strip() or None))
+
+        self.index = _index(entries)
+        self.mtime = mtime
+        ENTRIES.set(len(entries))
+        log.info("watchlist:load - loaded {} plates from {} in {:.2f}s".format(len(entries), self.list_file, time.time() - start_time))
+
+    def run(self):
+        while(self.running):
+            time.sleep(self.reload_secs)
+            try:
+                if os.path.getmtime(self.list_file) != self.mtime:
+                    self.load()
+            except (IOError, OSError):
+                log.exception("watchlist:run - could not reload {}".format(self.list_file))
+
+    def stop(self):
+        self.running = False
+        self.sink.close()
+
+    # the watchlist entries matching plate, as a list of ((plate, note), MATCH_ value)
+    def lookup(self, plate):
+        index = self.index
+        key = normalize(plate)
+        if not(key):
+            return []
+
+        entries = index.exact.get(key)
+        if entries:
+            return [(entry, MATCH_EXACT) for entry in entries]
+        if not(self.max_distance):
+            return []
+
+        # listed keys within one edit of key share a deletion with it (or one is a deletion of the other)
+        keys = set(index.deleted(key))
+        for d in deletions(key):
+            if d in index.exact:
+                keys.add(d)
+            keys.update(index.deleted(d))
+
+        return [(entry, MATCH_FUZZY) for k in keys if dedup.edit_distance(key, k) <= self.max_distance for entry in index.exact[k]]
+
+    # check every candidate for a plate (OpenALPR's top N, best first), alerting on each listed plate that turns up.
+    # details (e.g. file, capture time and position) are added to each alert. returns the alerts
+    def check(self, candidates, details = None):
+        alerts = []
+        seen = set()
+        for rank, candidate in enumerate(candidates):
+            for (plate, note), match in self.lookup(candidate['plate']):
+                if plate in seen:
+                    continue
+                seen.add(plate)
+
+                hit = dict(details or {})
+                hit.update({
+                    'watchlist_plate': plate,
+                    'note': note,
+                    'candidate': candidate['plate'],
+                    'candidate_rank': rank,
+                    'confidence': "{:0.2f}".format(candidate['confidence']),
+                    'match': match,
+                    'alert_epoch_time': "{:.3f}".format(time.time())
+                })
+                HITS.inc(match = match)
+                self.sink.alert(hit)
+                alerts.append(hit)
+        return alerts
@@ -0,0 +1,202 @@
+### workqueue - bounded in-memory queue of captured frames (see frame.frame) waiting for recognition
+import os
+import re
+import threading
+import time
+import heapq
+import itertools
+import collections
+import logging
+
+import frame
+
+log = logging.getLogger("workqueue")
+
+# names of the images camcap produces -- anything else in the capture directory is ignored
+CAPTURE_FILE_RE = re.compile('^\d+(.*)\.jpg$')
+
+# names of the captures waiting in source_dir, oldest first
+def list_captures(source_dir):
+    return [f for f in sorted(os.listdir(source_dir)) if CAPTURE_FILE_RE.match(f)]
+
+POLICY_FIFO = "fifo"
+POLICY_LIFO = "lifo"
+POLICY_PRIORITY = "priority"
+
+# how long ago a frame was captured
+def frame_age(frm, now):
+    capture_time = frm.capture_time()
+    return now - capture_time if capture_time else 0.0
+
+# priority hint: the faster we were going, the sooner the frame should be recognized. frames taken while
+# stopped mostly repeat plates we've already seen, while at speed a plate is only in view for a moment
+def speed_score(frm):
+    speed = frm.meta.get('speed') if frm.meta else None
+    return speed or 0.0
+
+## scheduling policies -- each holds the waiting frames and decides which one gets recognized next
+
+# oldest first
+class fifo (object):
+
+    def __init__(self):
+        self.items = collections.deque()
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, frm):
+        self.items.append(frm)
+
+    def take(self, now):
+        return self.items.popleft()
+
+# newest first, so fresh frames don't wait behind a backlog. frames that have waited longer than max_age_secs are
+# too stale to be worth recognizing -- they are handed out marked expired (see frame.expired), so the recognizers shed
+# them without running OCR instead of letting them crowd out fresh frames
+class lifo (object):
+
+    def __init__(self, max_age_secs = None):
+        self.items = collections.deque()
+        self.max_age_secs = max_age_secs
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, frm):
+        self.items.append(frm)
+
+    def take(self, now):
+        if self.max_age_secs is not None and frame_age(self.items[0], now) > self.max_age_secs:
+            frm = self.items.popleft()
+            frm.expired = True
+            return frm
+        return self.items.pop()
+
+# highest score first (newest first among equal scores). score_fn takes a frame and returns a number
+class priority (object):
+
+    def __init__(self, score_fn = speed_score):
+        self.items = []
+        self.score_fn = score_fn
+        self.seq = itertools.count()
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, frm):
+        heapq.heappush(self.items, (-self.score_fn(frm), -(frm.capture_time() or 0), next(self.seq), frm))
+
+    def take(self, now):
+        return heapq.heappop(self.items)[-1]
+
+# takes frames from each capture source (see frame.source) in turn, so a busy camera can't hold up the others. the
+# frames from each source are ordered by a scheduler of their own, made by new_scheduler()
+class fair (object):
+
+    def __init__(self, new_scheduler = fifo):
+        self.new_scheduler = new_scheduler
+        self.sources = {} # source -> its scheduler
+        self.turns = collections.deque() # sources with frames waiting, in the order they get their next turn
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def add(self, frm):
+        items = self.sources.get(frm.source)
+        if items is None:
+            items = self.sources[frm.source] = self.new_scheduler()
+        if not(items):
+            self.turns.append(frm.source)
+        items.add(frm)
+        self.count += 1
+
+    def take(self, now):
+        source = self.turns.popleft()
+        items = self.sources[source]
+        frm = items.take(now)
+        if (items):
+            self.turns.append(source)
+        self.count -= 1
+        return frm
+
+# create a scheduler for one of the POLICY_ names. if fair_sources, frames from each capture source take turns (see fair),
+# each source's frames ordered by policy
+def create_scheduler(policy, max_age_secs = None, fair_sources = False):
+    if fair_sources:
+        return fair(lambda: create_scheduler(policy, max_age_secs))
+    if policy == POLICY_FIFO:
+        return fifo()
+    elif policy == POLICY_LIFO:
+        return lifo(max_age_secs)
+    elif policy == POLICY_PRIORITY:
+        return priority()
+    else:
+        raise ValueError("unknown scheduling policy {}".format(policy))
+
+class workqueue (object):
+    deadline_secs = None # frames that have waited longer than this are handed out marked expired, to be dropped unrecognized
+
+    # scheduler decides the order frames are handed out in (fifo if not given)
+    def __init__(self, maxsize = 0, scheduler = None):
+        self.maxsize = maxsize
+        self.items = scheduler if scheduler is not None else fifo()
+        self.cond = threading.Condition()
+        self.expired = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    # add an item to the queue. blocks while the queue is full unless block is False.
+    # returns False if the item could not be queued
+    def put(self, item, block = True, timeout = None):
+        with self.cond:
+            if self.maxsize > 0:
+                if not(block) and len(self.items) >= self.maxsize:
+                    return False
+
+                deadline = None if timeout is None else time.time() + timeout
+                while len(self.items) >= self.maxsize:
+                    remaining = None if deadline is None else deadline - time.time()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+
+            self.items.add(item)
+            self.cond.notify_all()
+            return True
+
+    # take the next item off the queue. returns None if nothing showed up within timeout seconds. if the item
+    # has waited past deadline_secs (or the scheduler's own cutoff), it comes back with expired set
+    def get(self, timeout = None):
+        with self.cond:
+            deadline = None if timeout is None else time.time() + timeout
+            while not(self.items):
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self.cond.wait(remaining)
+
+            now = time.time()
+            item = self.items.take(now)
+            if self.deadline_secs is not None and frame_age(item, now) > self.deadline_secs:
+                item.expired = True
+            if item.expired:
+                self.expired += 1
+            self.cond.notify_all()
+            return item
+
+    # queue up whatever captures are already sitting in source_dir (e.g. left over from the last run), oldest first.
+    # this ignores maxsize -- the files are already on disk, so there is nothing to be gained by refusing them.
+    # if capture_meta (a capmeta.capmeta) is given, frames get their capture metadata from it
+    def fill_from_dir(self, source_dir, capture_meta = None):
+        files = list_captures(source_dir)
+
+        with self.cond:
+            for f in files:
+                self.items.add(frame.frame(f, meta = capture_meta.get(f) if capture_meta else None))
+            self.cond.notify_all()
+
+        log.info("workqueue:fill_from_dir - queued {} existing files from {}".format(len(files), source_dir))
+        return len(files)